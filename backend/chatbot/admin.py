@@ -1,3 +1,10 @@
 from django.contrib import admin
+from .models import ChatIntent
 
-# Register your models here.
+
+@admin.register(ChatIntent)
+class ChatIntentAdmin(admin.ModelAdmin):
+    list_display = ['name', 'weight', 'is_active', 'updated_at']
+    list_filter = ['is_active']
+    search_fields = ['name', 'keywords', 'response']
+    readonly_fields = ['created_at', 'updated_at']
@@ -0,0 +1,152 @@
+import logging
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+
+from django.db.models import Avg, Count, F, Min, Q, Sum
+from django.utils import timezone
+
+from .models import ChatAnalytics, ChatFeedback, ChatMessage, ChatSession
+
+logger = logging.getLogger(__name__)
+
+TOP_MENTIONS = 10
+
+POSITIVE_FEEDBACK = ['helpful', 'excellent']
+NEGATIVE_FEEDBACK = ['not_helpful', 'incorrect', 'incomplete']
+
+
+def _day_bounds(day: date):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _top_mentions(through_model, name_field: str, start, end) -> Dict[str, int]:
+    rows = through_model.objects.filter(
+        chatmessage__created_at__gte=start,
+        chatmessage__created_at__lt=end
+    ).values(name_field).annotate(count=Count('id')).order_by('-count', name_field)[:TOP_MENTIONS]
+    return {row[name_field]: row['count'] for row in rows}
+
+
+def rollup_day(day: date) -> ChatAnalytics:
+    """Aggregate one day of chat activity into its ChatAnalytics row"""
+    start, end = _day_bounds(day)
+    messages = ChatMessage.objects.filter(created_at__gte=start, created_at__lt=end)
+
+    usage = messages.aggregate(
+        total_messages=Count('id'),
+        active_sessions=Count('session', distinct=True),
+        unique_users=Count('session__user', distinct=True)
+    )
+    responses = messages.filter(message_type='assistant').exclude(status='pending').aggregate(
+        avg_response_time_ms=Avg('processing_time_ms'),
+        timed_responses=Count('processing_time_ms'),
+        avg_confidence_score=Avg('confidence_score'),
+        scored_responses=Count('confidence_score')
+    )
+    sessions = ChatSession.objects.filter(created_at__gte=start, created_at__lt=end).aggregate(
+        total_sessions=Count('id'),
+        anonymous_sessions=Count('id', filter=Q(user__isnull=True))
+    )
+    # Summed over days, this counts every session with messages exactly once
+    new_active_sessions = ChatSession.objects.filter(id__in=messages.values('session')).annotate(
+        first_message_at=Min('messages__created_at')
+    ).filter(first_message_at__gte=start).count()
+    feedback = ChatFeedback.objects.filter(created_at__gte=start, created_at__lt=end).aggregate(
+        helpful_responses=Count('id', filter=Q(feedback_type__in=POSITIVE_FEEDBACK)),
+        not_helpful_responses=Count('id', filter=Q(feedback_type__in=NEGATIVE_FEEDBACK))
+    )
+
+    analytics, _ = ChatAnalytics.objects.update_or_create(
+        date=day,
+        defaults={
+            **usage,
+            **responses,
+            **sessions,
+            **feedback,
+            'new_active_sessions': new_active_sessions,
+            'top_places_mentioned': _top_mentions(ChatMessage.mentioned_places.through, 'place__name', start, end),
+            'top_provinces_mentioned': _top_mentions(
+                ChatMessage.mentioned_provinces.through, 'province__name', start, end
+            ),
+        }
+    )
+    return analytics
+
+
+def rollup_chat_analytics(since: Optional[date] = None, until: Optional[date] = None) -> List[ChatAnalytics]:
+    """
+    Bring the daily ChatAnalytics rows up to date.
+
+    Without ``since`` the rollup is incremental: it restarts from the latest
+    rolled-up day, which may have been partial, or from the first message
+    when nothing has been rolled up yet. Each day is recomputed from that
+    day's rows only, so re-running is safe.
+    """
+    until = until or timezone.localdate()
+    if since is None:
+        latest = ChatAnalytics.objects.order_by('-date').values_list('date', flat=True).first()
+        if latest is not None:
+            since = latest
+        else:
+            first_message = ChatMessage.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            since = timezone.localdate(first_message) if first_message else until
+
+    rows = []
+    day = since
+    while day <= until:
+        rows.append(rollup_day(day))
+        day += timedelta(days=1)
+    logger.info("Rolled up chat analytics for %d day(s) from %s", len(rows), since)
+    return rows
+
+
+def _merge_mentions(mentions: List[Dict[str, int]]) -> Dict[str, int]:
+    counts = Counter()
+    for mention in mentions:
+        counts.update(mention)
+    return dict(counts.most_common(TOP_MENTIONS))
+
+
+def chat_statistics(days: int = 7) -> Dict:
+    """
+    Dashboard statistics computed from the daily rollups.
+
+    Only reads the rollups that exist; they are kept up to date by the
+    rollup_chat_analytics beat task or management command, never here.
+    """
+    today = timezone.localdate()
+    since = today - timedelta(days=days)
+
+    totals = ChatAnalytics.objects.aggregate(
+        total_sessions=Sum('total_sessions'),
+        total_messages=Sum('total_messages'),
+        sessions_with_messages=Sum('new_active_sessions'),
+        helpful=Sum('helpful_responses'),
+        not_helpful=Sum('not_helpful_responses'),
+        # Daily averages are weighted by the responses behind them
+        response_time_total=Sum(F('avg_response_time_ms') * F('timed_responses')),
+        timed_responses=Sum('timed_responses')
+    )
+    total_sessions = totals['total_sessions'] or 0
+    total_messages = totals['total_messages'] or 0
+    rated = (totals['helpful'] or 0) + (totals['not_helpful'] or 0)
+
+    recent = list(ChatAnalytics.objects.filter(date__gte=since).order_by('date'))
+    today_row = next((row for row in recent if row.date == today), None)
+
+    return {
+        'total_sessions': total_sessions,
+        'total_messages': total_messages,
+        'active_sessions_today': today_row.active_sessions if today_row else 0,
+        # Messages per session that has any, as before the rollups
+        'average_session_length': total_messages / max(totals['sessions_with_messages'] or 0, 1),
+        'average_response_time': (totals['response_time_total'] or 0) / max(totals['timed_responses'] or 0, 1),
+        'user_satisfaction': (totals['helpful'] or 0) / max(rated, 1) * 100,
+        'popular_topics': {
+            'places': _merge_mentions([row.top_places_mentioned for row in recent]),
+            'provinces': _merge_mentions([row.top_provinces_mentioned for row in recent])
+        },
+        'daily_message_count': {str(row.date): row.total_messages for row in recent}
+    }
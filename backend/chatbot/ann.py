@@ -0,0 +1,165 @@
+"""
+Nearest-neighbour search backends for knowledge base retrieval.
+
+Both backends score rows of an L2-normalised matrix (sparse TF-IDF or dense
+embeddings) by dot product, which equals cosine similarity for such rows.
+The matrix itself is passed to ``search`` rather than stored, so an index can
+be carried over when rows are appended to the matrix.
+"""
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+from decouple import config
+from scipy import sparse
+from sklearn.cluster import MiniBatchKMeans
+
+# 'exact' scans every row, 'ivf' probes the closest k-means clusters only
+RAG_ANN_BACKEND = config('RAG_ANN_BACKEND', default='exact')
+# Corpora smaller than this are always searched exactly
+RAG_ANN_MIN_ROWS = config('RAG_ANN_MIN_ROWS', default=20000, cast=int)
+# Number of IVF clusters (0 = sqrt of the row count)
+RAG_ANN_LISTS = config('RAG_ANN_LISTS', default=0, cast=int)
+# Clusters scanned per query: higher means better recall, slower queries
+RAG_ANN_PROBES = config('RAG_ANN_PROBES', default=8, cast=int)
+
+
+def as_query_vector(query) -> np.ndarray:
+    """Flatten a 1 x n sparse or dense query into a dense 1-D array"""
+    if sparse.issparse(query):
+        return np.asarray(query.todense()).ravel()
+    return np.asarray(query).ravel()
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without a full sort"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+class ExactSearchIndex:
+    """Brute-force scan over every (unmasked) row"""
+
+    name = 'exact'
+
+    def search(self, matrix, query, k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row indices, scores) of the k best rows allowed by ``mask``"""
+        query = as_query_vector(query)
+        if mask is None:
+            scores = np.asarray(matrix @ query).ravel()
+            top = top_k(scores, k)
+            return top, scores[top]
+
+        candidates = np.flatnonzero(mask)
+        if len(candidates) > len(mask) * 0.25:
+            # Slicing a large share of the matrix costs more than scoring it all
+            scores = np.where(mask, np.asarray(matrix @ query).ravel(), -np.inf)
+            top = top_k(scores, min(k, len(candidates)))
+            return top, scores[top]
+
+        scores = np.asarray(matrix[candidates] @ query).ravel()
+        top = top_k(scores, k)
+        return candidates[top], scores[top]
+
+    def extend(self, new_rows) -> 'ExactSearchIndex':
+        return self
+
+    def subset(self, rows: np.ndarray) -> 'ExactSearchIndex':
+        return self
+
+    def save(self, directory):
+        pass
+
+
+class IVFIndex:
+    """
+    Inverted-file index: rows are clustered with k-means and a query only
+    scores rows in the ``n_probe`` clusters whose centroids are closest.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray, n_probe: int = RAG_ANN_PROBES):
+        self.centroids = centroids
+        self.assignments = assignments
+        self.n_probe = n_probe
+
+    @classmethod
+    def fit(cls, matrix, n_lists: int = RAG_ANN_LISTS, n_probe: int = RAG_ANN_PROBES, seed: int = 0) -> 'IVFIndex':
+        n_rows = matrix.shape[0]
+        n_lists = n_lists or int(np.sqrt(n_rows))
+        n_lists = max(1, min(n_lists, n_rows))
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_lists,
+            batch_size=2048,
+            n_init=3,
+            random_state=seed
+        ).fit(matrix)
+        centroids = kmeans.cluster_centers_.astype(np.float32)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+        return cls(centroids, kmeans.labels_.astype(np.int32), n_probe)
+
+    def assign(self, rows) -> np.ndarray:
+        scores = np.asarray(rows @ self.centroids.T)
+        return scores.argmax(axis=1).astype(np.int32)
+
+    def search(self, matrix, query, k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row indices, scores) of the best rows in the probed clusters"""
+        query = as_query_vector(query)
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = top_k(self.centroids @ query, n_probe)
+
+        in_probes = np.isin(self.assignments, probes)
+        if mask is not None:
+            in_probes &= mask
+        candidates = np.flatnonzero(in_probes)
+
+        if len(candidates) < k:
+            # Too few rows in the probed clusters (e.g. a narrow filter), so
+            # fall back to scanning everything the mask allows
+            return ExactSearchIndex().search(matrix, query, k, mask)
+
+        scores = np.asarray(matrix[candidates] @ query).ravel()
+        top = top_k(scores, k)
+        return candidates[top], scores[top]
+
+    def extend(self, new_rows) -> 'IVFIndex':
+        """Index appended rows against the existing centroids"""
+        return IVFIndex(
+            self.centroids,
+            np.concatenate([self.assignments, self.assign(new_rows)]),
+            self.n_probe
+        )
+
+    def subset(self, rows: np.ndarray) -> 'IVFIndex':
+        return IVFIndex(self.centroids, self.assignments[rows], self.n_probe)
+
+    def save(self, directory):
+        directory = Path(directory)
+        np.save(directory / 'ivf_centroids.npy', self.centroids)
+        np.save(directory / 'ivf_assignments.npy', self.assignments)
+
+    @classmethod
+    def load(cls, directory, n_probe: int = RAG_ANN_PROBES) -> 'IVFIndex':
+        directory = Path(directory)
+        return cls(
+            np.load(directory / 'ivf_centroids.npy', mmap_mode='r'),
+            np.load(directory / 'ivf_assignments.npy', mmap_mode='r'),
+            n_probe
+        )
+
+
+def build_ann_index(matrix, backend: Optional[str] = None, min_rows: Optional[int] = None):
+    """Pick the configured backend, using exact search for small corpora"""
+    backend = backend or RAG_ANN_BACKEND
+    min_rows = RAG_ANN_MIN_ROWS if min_rows is None else min_rows
+    if matrix is None or backend == 'exact' or matrix.shape[0] < max(min_rows, 1):
+        return ExactSearchIndex()
+    if backend == 'ivf':
+        return IVFIndex.fit(matrix)
+    raise ValueError(f"Unknown ANN backend: {backend}")
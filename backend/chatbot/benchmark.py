@@ -0,0 +1,578 @@
+"""
+Load benchmark of the chat pipeline against a local fake LLM.
+
+A throwaway database is seeded with a synthetic knowledge base and the chat
+endpoints are driven in-process at a fixed concurrency, while Ollama (and
+OpenAI, if configured) are answered by a deterministic HTTP server with a
+configurable token rate. Each request records its end-to-end latency, time
+to the first streamed token, retrieval time, prompt size and DB queries.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+from unittest import mock
+
+import numpy as np
+import ollama
+import openai
+from django.conf import settings
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .embeddings import HashingEmbeddingBackend, shared_dense_index
+from .faq import shared_faq_index
+from .intents import shared_intent_engine
+from .models import ChatSession, KnowledgeBase
+from .prompts import PromptBuilder, count_tokens
+from .response_cache import response_cache
+from .services import RAGService, circuit_breakers, generation_scheduler, shared_knowledge_index
+from .tasks import link_chat_mentions, summarize_conversation
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ('message', 'stream', 'quick')
+URL_NAMES = {'message': 'chatbot:chat-message-create', 'stream': 'chatbot:chat-message-stream', 'quick': 'chatbot:quick-chat'}
+
+PLACES = (
+    'Algiers', 'Oran', 'Constantine', 'Tlemcen', 'Annaba', 'Bejaia', 'Tipaza', 'Setif', 'Batna', 'Timgad',
+    'Djemila', 'Ghardaia', 'Biskra', 'Tamanrasset', 'Djanet', 'Timimoun', 'Jijel', 'El Oued', 'Skikda', 'Cherchell',
+)
+TOPICS = {
+    'place_info': ('old town', 'viewpoint', 'museum', 'gardens', 'harbour'),
+    'historical_info': ('roman ruins', 'ottoman palace', 'citadel', 'ancient mosque', 'berber village'),
+    'food_culture': ('couscous', 'street food', 'pastries', 'mint tea', 'chakhchoukha'),
+    'transportation': ('train', 'bus station', 'domestic flights', 'taxis', 'car rental'),
+    'accommodation': ('hotels', 'guesthouses', 'desert camps', 'hostels', 'riads'),
+    'events': ('festival', 'music nights', 'crafts fair', 'national holiday', 'date harvest'),
+}
+FILLER = (
+    'visitors', 'often', 'recommend', 'arriving', 'early', 'local', 'guides', 'explain', 'the', 'history', 'of',
+    'region', 'prices', 'are', 'reasonable', 'and', 'families', 'welcome', 'travellers', 'in', 'spring', 'autumn',
+    'weather', 'is', 'mild', 'while', 'summer', 'can', 'be', 'very', 'hot', 'inland', 'bring', 'cash', 'water',
+)
+QUESTIONS = (
+    'What is the best {topic} in {place}?',
+    'Can you recommend {topic} near {place}?',
+    'How do I find good {topic} when visiting {place}?',
+    'Tell me about the {topic} of {place}',
+    'Is {place} worth a visit for its {topic}?',
+)
+
+
+def seed_knowledge_base(entries: int, words: int = 120, seed: int = 0, batch_size: int = 500) -> int:
+    """Bulk-insert ``entries`` synthetic knowledge base entries, returns the number created"""
+    rng = random.Random(seed)
+    content_types = list(TOPICS)
+    rows = []
+    for i in range(entries):
+        content_type = content_types[i % len(content_types)]
+        place = rng.choice(PLACES)
+        topic = rng.choice(TOPICS[content_type])
+        body = ' '.join(rng.choice(FILLER) for _ in range(words))
+        rows.append(KnowledgeBase(
+            title=f'{place} {topic} guide {i}',
+            content=f'{place} is known for its {topic}. {body}.',
+            content_type=content_type,
+            source_type='benchmark',
+            is_verified=True
+        ))
+    # bulk_create skips the signals, so the shared indexes are rebuilt once afterwards
+    KnowledgeBase.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def benchmark_questions(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed + 1)
+    topics = [topic for content_topics in TOPICS.values() for topic in content_topics]
+    return [rng.choice(QUESTIONS).format(place=rng.choice(PLACES), topic=rng.choice(topics)) for _ in range(count)]
+
+
+class _FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        fake = self.server.fake
+        if self.path == '/api/generate':
+            fake.count('generate')
+            self.ollama_generate(fake, body)
+        elif self.path == '/api/embed':
+            fake.count('embed')
+            texts = body.get('input') or []
+            texts = [texts] if isinstance(texts, str) else texts
+            self.send_json({'model': body.get('model'), 'embeddings': fake.embeddings.embed(texts).tolist()})
+        elif self.path.endswith('/chat/completions'):
+            fake.count('chat_completions')
+            self.openai_chat(fake, body)
+        else:
+            self.send_json({'error': f'unknown path {self.path}'}, status=404)
+
+    def send_json(self, payload: Dict[str, Any], status: int = 200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_stream(self, content_type: str):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def ollama_generate(self, fake: 'FakeLLMServer', body: Dict[str, Any]):
+        prompt = f"{body.get('system', '')}\n{body.get('prompt', '')}"
+        tokens = fake.answer(prompt)
+        final = {
+            'model': body.get('model'),
+            'done': True,
+            'done_reason': 'stop',
+            'prompt_eval_count': count_tokens(prompt),
+            'eval_count': len(tokens),
+        }
+        if body.get('stream', True):
+            self.start_stream('application/x-ndjson')
+            for token in fake.generate(tokens):
+                self.write_chunk(json.dumps({'model': body.get('model'), 'response': token, 'done': False}).encode() + b'\n')
+            self.write_chunk(json.dumps({**final, 'response': ''}).encode() + b'\n')
+            self.write_chunk(b'')
+        else:
+            for _ in fake.generate(tokens):
+                pass
+            self.send_json({**final, 'response': ''.join(tokens)})
+
+    def openai_chat(self, fake: 'FakeLLMServer', body: Dict[str, Any]):
+        prompt = '\n'.join(message.get('content', '') for message in body.get('messages', []))
+        tokens = fake.answer(prompt)
+        completion = {'id': 'chatcmpl-benchmark', 'model': body.get('model'), 'created': int(time.time())}
+        if body.get('stream'):
+            self.start_stream('text/event-stream')
+            for token in fake.generate(tokens):
+                chunk = {**completion, 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'content': token}}]}
+                self.write_chunk(f'data: {json.dumps(chunk)}\n\n'.encode())
+            self.write_chunk(b'data: [DONE]\n\n')
+            self.write_chunk(b'')
+        else:
+            for _ in fake.generate(tokens):
+                pass
+            self.send_json({
+                **completion,
+                'object': 'chat.completion',
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                    'finish_reason': 'stop'
+                }],
+                'usage': {'prompt_tokens': count_tokens(prompt), 'completion_tokens': len(tokens)}
+            })
+
+
+class FakeLLMServer:
+    """
+    Local HTTP server speaking enough of the Ollama and OpenAI APIs for the
+    chatbot: completions (streamed or not) and embeddings.
+
+    Answers are derived from a hash of the prompt, so a prompt always gets
+    the same answer. The first token comes after ``first_token_ms`` and the
+    others at ``tokens_per_second``; embeddings are feature-hashed.
+    """
+
+    def __init__(
+        self,
+        tokens_per_second: float = 50.0,
+        first_token_ms: float = 200.0,
+        response_tokens: int = 60,
+        host: str = '127.0.0.1',
+        port: int = 0
+    ):
+        self.token_delay = 1 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.first_token_delay = first_token_ms / 1000
+        self.response_tokens = response_tokens
+        self.embeddings = HashingEmbeddingBackend()
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _FakeLLMHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, route: str):
+        with self._lock:
+            self.calls[route] += 1
+
+    def answer(self, prompt: str) -> List[str]:
+        rng = random.Random(zlib.crc32(prompt.encode()))
+        words = [rng.choice(FILLER) for _ in range(self.response_tokens)]
+        return [words[0].capitalize()] + [f' {word}' for word in words[1:-1]] + [f' {words[-1]}.']
+
+    def generate(self, tokens: List[str]) -> Iterator[str]:
+        """Yield ``tokens`` at the configured pace"""
+        time.sleep(self.first_token_delay)
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.token_delay)
+            yield token
+
+    def start(self) -> 'FakeLLMServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-llm', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'FakeLLMServer':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+# Measurements of the request running on the current thread
+_current = threading.local()
+
+
+def _record(key: str, value: float, add: bool = False):
+    sample = getattr(_current, 'sample', None)
+    if sample is None:
+        return
+    if add:
+        sample[key] = sample.get(key, 0.0) + value
+    else:
+        # Only the chat prompt counts, not a summary prompt built afterwards
+        sample.setdefault(key, value)
+
+
+@contextmanager
+def instrument_pipeline():
+    """Record retrieval time and prompt size of each benchmark request"""
+    get_relevant_context = RAGService.get_relevant_context
+    build = PromptBuilder.build
+
+    def timed_get_relevant_context(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return get_relevant_context(self, *args, **kwargs)
+        finally:
+            _record('retrieval_ms', (time.perf_counter() - start) * 1000, add=True)
+
+    def recorded_build(self, *args, **kwargs):
+        prompt = build(self, *args, **kwargs)
+        _record('prompt_tokens', prompt.token_count)
+        return prompt
+
+    with mock.patch.object(RAGService, 'get_relevant_context', timed_get_relevant_context), \
+            mock.patch.object(PromptBuilder, 'build', recorded_build):
+        yield
+
+
+@contextmanager
+def use_fake_llm(server: FakeLLMServer, response_cache_enabled: bool = False):
+    """Point the chatbot's LLM and embedding clients at ``server``"""
+    with ExitStack() as stack:
+        # ChatbotService and the embedding backend read OLLAMA_BASE_URL when created
+        stack.enter_context(mock.patch.dict(os.environ, {'OLLAMA_BASE_URL': server.url}))
+        # The module-level ollama.generate is bound to a client for OLLAMA_HOST
+        stack.enter_context(mock.patch.object(ollama, 'generate', ollama.Client(host=server.url).generate))
+        stack.enter_context(mock.patch.object(openai, 'api_base', f'{server.url}/v1'))
+        stack.enter_context(mock.patch('chatbot.services.RESPONSE_CACHE_ENABLED', response_cache_enabled))
+        stack.enter_context(override_settings(RAG_INDEX_DIR=None, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']))
+        yield server
+
+
+@contextmanager
+def without_background_tasks():
+    """
+    Drop the tasks chat requests queue for celery workers. Their work is not
+    part of the request path, and without a broker each enqueue would stall
+    the request on the failed connection instead.
+    """
+    with mock.patch.object(link_chat_mentions, 'delay'), mock.patch.object(summarize_conversation, 'delay'):
+        yield
+
+
+def reset_shared_state():
+    """Drop the per-process indexes and caches so they are built from the benchmark data"""
+    shared_knowledge_index.clear()
+    shared_dense_index.clear()
+    shared_faq_index.clear()
+    shared_intent_engine.clear()
+    response_cache.invalidate()
+    circuit_breakers.clear()
+    generation_scheduler.reset_metrics()
+
+
+@contextmanager
+def benchmark_database(keep: bool = False):
+    """
+    Run against a freshly created, migrated test database instead of the
+    configured one. SQLite test databases go to a temporary file, since the
+    benchmark threads can't share an in-memory database while writing.
+    """
+    temp_dir = None
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    if connection.vendor == 'sqlite' and not old_test_name:
+        temp_dir = tempfile.mkdtemp(prefix='chat-benchmark-')
+        test_settings['NAME'] = os.path.join(temp_dir, 'benchmark.sqlite3')
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection.settings_dict['NAME']
+    finally:
+        connections.close_all()
+        if not keep:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        else:
+            connection.settings_dict['NAME'] = old_name
+        test_settings['NAME'] = old_test_name
+        if temp_dir and not keep:
+            for name in os.listdir(temp_dir):
+                os.remove(os.path.join(temp_dir, name))
+            os.rmdir(temp_dir)
+
+
+class RequestSample(NamedTuple):
+    endpoint: str
+    ok: bool
+    latency_ms: float
+    first_token_ms: Optional[float]
+    retrieval_ms: Optional[float]
+    prompt_tokens: Optional[int]
+    queries: int
+
+
+class ChatBenchmark:
+    """
+    Sends benchmark questions to one chat endpoint from ``concurrency``
+    threads, each with its own client and database connection. Message
+    endpoints start a new chat session every ``turns`` questions, so the
+    conversation history stays as long as configured.
+    """
+
+    def __init__(self, user, concurrency: int = 4, turns: int = 2):
+        self.user = user
+        self.concurrency = max(concurrency, 1)
+        self.turns = max(turns, 1)
+        self.token = str(RefreshToken.for_user(user).access_token)
+
+    def request(self, client: APIClient, endpoint: str, question: str, session_id: Optional[int]) -> RequestSample:
+        url = reverse(URL_NAMES[endpoint])
+        if endpoint == 'quick':
+            data = {'message': question}
+        else:
+            data = {'content': question, 'message_type': 'user', 'session': session_id}
+
+        _current.sample = sample = {}
+        first_token = None
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                try:
+                    response = client.post(url, data, format='json')
+                    if endpoint == 'stream':
+                        body = b''
+                        for chunk in response.streaming_content:
+                            if first_token is None and b'event: token' in chunk:
+                                first_token = time.perf_counter()
+                            body += chunk
+                        response.close()
+                        ok = response.status_code == 200 and b'event: done' in body
+                    else:
+                        ok = response.status_code in (200, 201) and 'error' not in response.data
+                except Exception:
+                    logger.exception("Benchmark request to %s failed", endpoint)
+                    ok = False
+                end = time.perf_counter()
+        finally:
+            _current.sample = None
+
+        return RequestSample(
+            endpoint,
+            ok,
+            (end - start) * 1000,
+            (first_token - start) * 1000 if first_token is not None else None,
+            sample.get('retrieval_ms'),
+            sample.get('prompt_tokens'),
+            len(queries)
+        )
+
+    def worker(self, endpoint: str, jobs: queue.Queue, samples: List[RequestSample]):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        session_id = None
+        asked = 0
+        try:
+            while True:
+                try:
+                    question = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                if endpoint != 'quick' and asked % self.turns == 0:
+                    session_id = ChatSession.objects.create(
+                        user=self.user, session_id=f'benchmark_{uuid.uuid4().hex}', title='Benchmark'
+                    ).id
+                asked += 1
+                samples.append(self.request(client, endpoint, question, session_id))
+        finally:
+            connections.close_all()
+
+    def run(self, endpoint: str, questions: List[str]) -> Dict[str, Any]:
+        """Ask every question and summarize the samples with the wall-clock time"""
+        jobs = queue.Queue()
+        for question in questions:
+            jobs.put(question)
+        samples = []
+        threads = [
+            threading.Thread(target=self.worker, args=(endpoint, jobs, samples), name=f'benchmark-{i}')
+            for i in range(min(self.concurrency, len(questions)) or 1)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize_samples(samples, time.perf_counter() - start)
+
+
+def distribution(values: List[float]) -> Optional[Dict[str, float]]:
+    """Mean, percentiles and maximum of ``values``, None if there are none"""
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'mean': float(np.mean(values)),
+        'p50': float(p50),
+        'p95': float(p95),
+        'p99': float(p99),
+        'max': float(max(values)),
+    }
+
+
+def summarize_samples(samples: List[RequestSample], elapsed: float) -> Dict[str, Any]:
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if not sample.ok),
+        'elapsed_s': elapsed,
+        'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+        'latency_ms': distribution([sample.latency_ms for sample in samples]),
+        'first_token_ms': distribution([sample.first_token_ms for sample in samples]),
+        'retrieval_ms': distribution([sample.retrieval_ms for sample in samples]),
+        'prompt_tokens': distribution([sample.prompt_tokens for sample in samples]),
+        'queries': distribution([sample.queries for sample in samples]),
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Plain-text table of a benchmark report, one block per endpoint"""
+    setup = report['settings']
+    lines = [
+        f"{setup['entries']} knowledge base entries, {setup['requests']} requests per endpoint, "
+        f"concurrency {setup['concurrency']}",
+        f"Fake LLM: first token after {setup['first_token_ms']:g} ms, "
+        f"{setup['tokens_per_second']:g} tokens/s, {setup['response_tokens']} tokens per answer",
+    ]
+    rows = (
+        ('end-to-end ms', 'latency_ms'),
+        ('first token ms', 'first_token_ms'),
+        ('retrieval ms', 'retrieval_ms'),
+        ('prompt tokens', 'prompt_tokens'),
+        ('DB queries', 'queries'),
+    )
+    for endpoint, result in report['endpoints'].items():
+        lines.append('')
+        lines.append(
+            f"[{endpoint}] {result['requests']} requests, {result['errors']} errors, "
+            f"{result['throughput_rps']:.1f} req/s"
+        )
+        lines.append(f"  {'':<16}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+        for label, key in rows:
+            values = result[key]
+            if values is None:
+                lines.append(f"  {label:<16}{'n/a':>10}")
+                continue
+            lines.append(f"  {label:<16}" + ''.join(
+                f"{values[stat]:>10.1f}" for stat in ('mean', 'p50', 'p95', 'p99', 'max')
+            ))
+    lines.append('')
+    lines.append(f"LLM calls: {dict(report['llm_calls'])}")
+    queue_metrics = report['generation_queue']
+    lines.append(
+        f"Generation queue: {queue_metrics['started']} started, {queue_metrics['coalesced']} coalesced, "
+        f"average wait {queue_metrics['average_wait_ms']:.1f} ms, max wait {queue_metrics['max_wait_ms']:.1f} ms"
+    )
+    return '\n'.join(lines)
+
+
+def run_benchmark(
+    user,
+    endpoints=ENDPOINTS,
+    requests: int = 100,
+    concurrency: int = 4,
+    turns: int = 2,
+    warmup: int = 4,
+    seed: int = 0,
+    server: Optional[FakeLLMServer] = None
+) -> Dict[str, Any]:
+    """
+    Benchmark ``endpoints`` against the knowledge base already in the
+    database, with the LLM answered by ``server``. Returns the report.
+    """
+    server = server or FakeLLMServer()
+    benchmark = ChatBenchmark(user, concurrency=concurrency, turns=turns)
+    report = {
+        'settings': {
+            'entries': KnowledgeBase.objects.filter(is_active=True).count(),
+            'requests': requests,
+            'concurrency': benchmark.concurrency,
+            'turns': benchmark.turns,
+            'first_token_ms': server.first_token_delay * 1000,
+            'tokens_per_second': 1 / server.token_delay if server.token_delay else 0.0,
+            'response_tokens': server.response_tokens,
+        },
+        'endpoints': {},
+    }
+    with use_fake_llm(server), instrument_pipeline(), without_background_tasks():
+        reset_shared_state()
+        # Build the indexes and open connections before anything is timed
+        if warmup:
+            benchmark.run(endpoints[0], benchmark_questions(warmup, seed=seed + 1000))
+        server.calls.clear()
+        generation_scheduler.reset_metrics()
+        for i, endpoint in enumerate(endpoints):
+            report['endpoints'][endpoint] = benchmark.run(endpoint, benchmark_questions(requests, seed=seed + i))
+        report['llm_calls'] = dict(server.calls)
+        report['generation_queue'] = generation_scheduler.metrics()
+    return report
@@ -0,0 +1,65 @@
+from typing import List, Tuple
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+# CountVectorizer settings that are copied from the fitted TF-IDF vectorizer
+# so both matrices share one vocabulary and tokenisation
+COUNT_VECTORIZER_PARAMS = set(CountVectorizer().get_params()) - {'vocabulary', 'max_features', 'min_df', 'max_df'}
+
+
+class BM25Encoder:
+    """
+    Okapi BM25 weighting over a fixed vocabulary.
+
+    Documents are encoded once into a sparse matrix of per-term BM25 weights,
+    and a query is a binary term vector, so the BM25 score of every document
+    is a single sparse dot product.
+    """
+
+    def __init__(self, counter: CountVectorizer, idf: np.ndarray, avgdl: float, k1: float = 1.5, b: float = 0.75):
+        self.counter = counter
+        self.idf = idf
+        self.avgdl = avgdl
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def fit(cls, vectorizer, texts: List[str], k1: float = 1.5, b: float = 0.75) -> Tuple['BM25Encoder', sparse.csr_matrix]:
+        """Fit document frequencies on ``texts`` and return (encoder, weights)"""
+        params = {
+            name: value for name, value in vectorizer.get_params().items()
+            if name in COUNT_VECTORIZER_PARAMS
+        }
+        params['dtype'] = np.float32
+        counter = CountVectorizer(vocabulary=vectorizer.vocabulary_, **params)
+        counts = counter.transform(texts).tocsr()
+
+        n_docs = counts.shape[0]
+        doc_freq = np.bincount(counts.indices, minlength=counts.shape[1])
+        idf = np.log1p((n_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        doc_lengths = np.asarray(counts.sum(axis=1)).ravel()
+        avgdl = float(doc_lengths.mean()) if n_docs and doc_lengths.mean() > 0 else 1.0
+
+        encoder = cls(counter, idf, avgdl, k1, b)
+        return encoder, encoder._weigh(counts)
+
+    def _weigh(self, counts: sparse.csr_matrix) -> sparse.csr_matrix:
+        counts = counts.tocsr().astype(np.float32)
+        doc_lengths = np.asarray(counts.sum(axis=1)).ravel()
+        rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        tf = counts.data
+        norm = self.k1 * (1 - self.b + self.b * doc_lengths[rows] / self.avgdl)
+        data = self.idf[counts.indices] * tf * (self.k1 + 1) / (tf + norm)
+        return sparse.csr_matrix((data.astype(np.float32), counts.indices, counts.indptr), shape=counts.shape)
+
+    def transform_documents(self, texts: List[str]) -> sparse.csr_matrix:
+        """BM25 weights for new documents, using the fitted statistics"""
+        return self._weigh(self.counter.transform(texts))
+
+    def transform_query(self, query: str) -> sparse.csr_matrix:
+        """Binary term vector of the query"""
+        query_vector = self.counter.transform([query]).tocsr()
+        query_vector.data[:] = 1
+        return query_vector
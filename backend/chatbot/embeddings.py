@@ -0,0 +1,435 @@
+import logging
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+import ollama
+from decouple import config
+from django.db import connections
+from django.db.models import F, Q
+from django.utils import timezone
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from .ann import build_ann_index
+from .facets import FACET_FIELDS, FacetIndex
+from .models import KnowledgeBase
+
+logger = logging.getLogger(__name__)
+
+# 'ollama' calls the local Ollama embeddings endpoint, 'hashing' is a
+# dependency-free local embedding used for development and tests
+EMBEDDING_BACKEND = config('EMBEDDING_BACKEND', default='ollama')
+OLLAMA_EMBED_MODEL = config('OLLAMA_EMBED_MODEL', default='nomic-embed-text')
+HASHING_EMBEDDING_DIM = config('HASHING_EMBEDDING_DIM', default=384, cast=int)
+
+
+def encode_embedding(vector) -> bytes:
+    """Pack an embedding as raw float32 bytes for KnowledgeBase.embedding"""
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def decode_embedding(blob) -> np.ndarray:
+    """Unpack raw float32 bytes stored in KnowledgeBase.embedding"""
+    return np.frombuffer(bytes(blob), dtype=np.float32)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class OllamaEmbeddingBackend:
+    """Embeddings from the Ollama /api/embed endpoint"""
+
+    def __init__(self, model: str = OLLAMA_EMBED_MODEL, host: Optional[str] = None):
+        self.model = model
+        self.client = ollama.Client(host=host or config('OLLAMA_BASE_URL', default='http://localhost:11434'))
+
+    @property
+    def name(self) -> str:
+        return f'ollama:{self.model}'
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        response = self.client.embed(model=self.model, input=texts)
+        return np.asarray(response['embeddings'], dtype=np.float32)
+
+
+class HashingEmbeddingBackend:
+    """Deterministic feature-hashing embeddings that need no model server"""
+
+    def __init__(self, dim: int = HASHING_EMBEDDING_DIM):
+        self.dim = dim
+        self.vectorizer = HashingVectorizer(
+            n_features=dim,
+            ngram_range=(1, 2),
+            alternate_sign=True,
+            norm='l2'
+        )
+
+    @property
+    def name(self) -> str:
+        return f'hashing:{self.dim}'
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.vectorizer.transform(texts).toarray().astype(np.float32)
+
+
+EMBEDDING_BACKENDS = {
+    'ollama': OllamaEmbeddingBackend,
+    'hashing': HashingEmbeddingBackend,
+}
+
+
+class EmbeddingService:
+    """Computes L2-normalised float32 embeddings with the configured backend"""
+
+    def __init__(self, backend=None):
+        if backend is None or isinstance(backend, str):
+            backend = EMBEDDING_BACKENDS[backend or EMBEDDING_BACKEND]()
+        self.backend = backend
+
+    @property
+    def model_name(self) -> str:
+        return self.backend.name
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return normalize_rows(self.backend.embed(texts))
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return self.embed_documents([query])[0]
+
+
+def compute_knowledge_embeddings(
+    embedding_service: Optional[EmbeddingService] = None,
+    batch_size: int = 32,
+    force: bool = False
+) -> int:
+    """
+    Embed knowledge base entries that have no up-to-date embedding.
+
+    An embedding is stale when it is missing, was produced by another model or
+    is older than the entry's last edit. Returns the number of entries embedded.
+    """
+    embedding_service = embedding_service or EmbeddingService()
+    model_name = embedding_service.model_name
+
+    queryset = KnowledgeBase.objects.all()
+    if not force:
+        queryset = queryset.filter(
+            Q(embedding__isnull=True)
+            | Q(embedded_at__isnull=True)
+            | Q(embedded_at__lt=F('updated_at'))
+            | ~Q(embedding_model=model_name)
+        )
+    pending_ids = list(queryset.order_by('id').values_list('id', flat=True))
+
+    embedded = 0
+    for start in range(0, len(pending_ids), batch_size):
+        entries = list(
+            KnowledgeBase.objects.filter(id__in=pending_ids[start:start + batch_size])
+            .only('id', 'title', 'content')
+        )
+        vectors = embedding_service.embed_documents(
+            [f"{entry.title} {entry.content}" for entry in entries]
+        )
+        now = timezone.now()
+        for entry, vector in zip(entries, vectors):
+            entry.embedding = encode_embedding(vector)
+            entry.embedding_model = model_name
+            entry.embedded_at = now
+        # bulk_update leaves updated_at alone, so embedding does not mark rows stale
+        KnowledgeBase.objects.bulk_update(entries, ['embedding', 'embedding_model', 'embedded_at'])
+        embedded += len(entries)
+
+    return embedded
+
+
+def sync_watermark(fingerprint) -> Optional[Any]:
+    """Latest edit or embedding time recorded in a knowledge base fingerprint"""
+    times = [value for value in (fingerprint or ())[2:] if value is not None]
+    return max(times) if times else None
+
+
+class DenseVectorIndex:
+    """
+    In-memory float32 matrix of normalised knowledge base embeddings.
+
+    Like the lexical index, instances are never mutated once published:
+    changed entries are appended (and assigned to the existing IVF clusters)
+    and removed ones masked out, until compaction rebuilds the matrix and
+    refits the clustering.
+    """
+
+    DOCUMENT_FIELDS = ('id', 'title', 'content', *FACET_FIELDS)
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        documents: List[Dict[str, Any]],
+        model_name: str,
+        fingerprint=None,
+        live=None,
+        positions=None,
+        ann=None,
+        facets=None,
+        fitted_rows=None,
+        built_at=None,
+        synced_through=None
+    ):
+        self.matrix = matrix
+        self.documents = documents
+        self.model_name = model_name
+        self.fingerprint = fingerprint
+        self.synced_through = synced_through
+        self.ann = ann if ann is not None else build_ann_index(matrix if len(documents) else None)
+        self.facets = facets if facets is not None else FacetIndex.from_documents(documents)
+        self.live = live if live is not None else np.ones(len(documents), dtype=bool)
+        self.fitted_rows = len(documents) if fitted_rows is None else fitted_rows
+        self.built_at = built_at or time.time()
+        if positions is None:
+            positions = {doc['id']: i for i, doc in enumerate(documents) if self.live[i]}
+        self.positions = positions
+
+    @classmethod
+    def build(cls, model_name: str, fingerprint=None) -> 'DenseVectorIndex':
+        rows = KnowledgeBase.objects.filter(
+            is_active=True,
+            embedding__isnull=False,
+            embedding_model=model_name
+        ).values(*cls.DOCUMENT_FIELDS, 'embedding')
+
+        documents = []
+        vectors = []
+        for row in rows:
+            vectors.append(decode_embedding(row.pop('embedding')))
+            documents.append(row)
+
+        synced_through = sync_watermark(fingerprint)
+        if not vectors:
+            return cls(np.zeros((0, 0), dtype=np.float32), [], model_name, fingerprint, synced_through=synced_through)
+        matrix = normalize_rows(np.vstack(vectors).astype(np.float32, copy=False))
+        return cls(matrix, documents, model_name, fingerprint, synced_through=synced_through)
+
+    def apply_changes(self, upserts=(), removed_ids=()) -> 'DenseVectorIndex':
+        """Return a new index with entries (rows carrying their 'embedding') added/replaced and others removed"""
+        live = self.live.copy()
+        positions = self.positions.copy()
+        for doc_id in removed_ids:
+            position = positions.pop(doc_id, None)
+            if position is not None:
+                live[position] = False
+
+        appended = {}
+        for row in upserts:
+            doc = {field: row[field] for field in self.DOCUMENT_FIELDS}
+            vector = normalize_rows(decode_embedding(row['embedding']))
+            position = positions.get(doc['id'])
+            if position is not None:
+                if self.documents[position] == doc and np.allclose(self.matrix[position], vector):
+                    continue
+                del positions[doc['id']]
+                live[position] = False
+            appended[doc['id']] = (doc, vector)
+
+        if not appended:
+            if len(positions) == len(self.positions):
+                # Nothing removed either, keep sharing this index
+                return self
+            return self._derive(self.matrix, self.documents, live, positions, self.ann, self.facets)
+
+        new_documents = [doc for doc, _ in appended.values()]
+        new_rows = np.vstack([vector for _, vector in appended.values()])
+        if not self.documents:
+            # Nothing indexed yet, so there is no matrix or clustering to extend
+            return DenseVectorIndex(
+                new_rows, new_documents, self.model_name, self.fingerprint, synced_through=self.synced_through
+            )
+
+        for offset, doc in enumerate(new_documents):
+            positions[doc['id']] = len(self.documents) + offset
+        return self._derive(
+            np.vstack([self.matrix, new_rows]),
+            self.documents + new_documents,
+            np.concatenate([live, np.ones(len(new_documents), dtype=bool)]),
+            positions,
+            self.ann.extend(new_rows),
+            self.facets.extend(new_documents)
+        )
+
+    def _derive(self, matrix, documents, live, positions, ann, facets) -> 'DenseVectorIndex':
+        return DenseVectorIndex(
+            matrix, documents, self.model_name, self.fingerprint,
+            live=live,
+            positions=positions,
+            ann=ann,
+            facets=facets,
+            fitted_rows=self.fitted_rows,
+            built_at=self.built_at,
+            synced_through=self.synced_through
+        )
+
+    @property
+    def pending_changes(self) -> int:
+        """Rows appended or masked out since the matrix was last built"""
+        appended = len(self.documents) - self.fitted_rows
+        removed = int(self.fitted_rows - self.live[:self.fitted_rows].sum())
+        return appended + removed
+
+    def needs_compaction(self) -> bool:
+        from .services import RAG_INDEX_COMPACT_INTERVAL, RAG_INDEX_COMPACT_RATIO
+
+        pending = self.pending_changes
+        if not pending:
+            return False
+        if pending >= max(self.fitted_rows, 1) * RAG_INDEX_COMPACT_RATIO:
+            return True
+        return time.time() - self.built_at >= RAG_INDEX_COMPACT_INTERVAL
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class SharedDenseIndex:
+    """
+    Process-wide dense index.
+
+    Built once per embedding model. After that, rows changed since the last
+    sync (by any worker, spotted through the knowledge base fingerprint) are
+    applied to the current index, and the matrix is rebuilt and its IVF
+    clustering refitted in a background thread once enough changes pile up,
+    so no request waits on k-means.
+    """
+
+    def __init__(self, check_interval: Optional[float] = None, compact_in_background: bool = True):
+        self.check_interval = check_interval
+        self.compact_in_background = compact_in_background
+        self._index = None
+        self._checked_at = 0.0
+        self._compacting = False
+        self._lock = threading.Lock()
+
+    def _fresh(self, index, model_name: str, interval: float) -> bool:
+        return (
+            index is not None
+            and index.model_name == model_name
+            and time.monotonic() - self._checked_at < interval
+        )
+
+    def get(self, model_name: str) -> DenseVectorIndex:
+        from .services import RAG_INDEX_CHECK_INTERVAL, in_sync_window, knowledge_base_fingerprint
+
+        interval = self.check_interval if self.check_interval is not None else RAG_INDEX_CHECK_INTERVAL
+        index = self._index
+        if self._fresh(index, model_name, interval):
+            return index
+
+        with self._lock:
+            # Another thread may have refreshed the index while we waited
+            if self._fresh(self._index, model_name, interval):
+                return self._index
+
+            fingerprint = knowledge_base_fingerprint()
+            if self._index is None or self._index.model_name != model_name:
+                self._index = DenseVectorIndex.build(model_name, fingerprint)
+            elif self._index.fingerprint != fingerprint or in_sync_window(self._index.synced_through):
+                self._index = self._sync(self._index, fingerprint)
+            self._checked_at = time.monotonic()
+            index = self._index
+
+        if self._maybe_compact(index):
+            # Compaction ran inline, hand out the rebuilt index
+            index = self._index or index
+        return index
+
+    @staticmethod
+    def _sync(index: DenseVectorIndex, fingerprint: tuple) -> DenseVectorIndex:
+        """Bring the index up to date with rows edited or embedded since it was last synced"""
+        from .services import sync_window_start
+
+        changed = KnowledgeBase.objects.all()
+        if index.synced_through is not None:
+            since = sync_window_start(index.synced_through)
+            changed = changed.filter(Q(updated_at__gte=since) | Q(embedded_at__gte=since))
+
+        upserts = []
+        removed_ids = []
+        for row in changed.values(*DenseVectorIndex.DOCUMENT_FIELDS, 'is_active', 'embedding', 'embedding_model'):
+            if row['is_active'] and row['embedding'] is not None and row['embedding_model'] == index.model_name:
+                upserts.append(row)
+            else:
+                removed_ids.append(row['id'])
+
+        # Deleted rows leave no trace behind, so diff the indexable ids
+        indexable_ids = set(
+            KnowledgeBase.objects.filter(
+                is_active=True,
+                embedding__isnull=False,
+                embedding_model=index.model_name
+            ).values_list('id', flat=True)
+        )
+        removed_ids.extend(doc_id for doc_id in index.positions if doc_id not in indexable_ids)
+
+        synced = index.apply_changes(upserts, removed_ids)
+        if synced is index:
+            if index.fingerprint == fingerprint:
+                # Nothing changed, e.g. a re-read within the sync margin
+                return index
+            synced = index._derive(index.matrix, index.documents, index.live, index.positions, index.ann, index.facets)
+        synced.fingerprint = fingerprint
+        synced.synced_through = sync_watermark(fingerprint)
+        return synced
+
+    def _maybe_compact(self, index: DenseVectorIndex) -> bool:
+        """Start compaction if needed, returns True if it already finished"""
+        if self._compacting or not index.needs_compaction():
+            return False
+        self._compacting = True
+        if not self.compact_in_background:
+            self.compact(index.model_name)
+            return True
+        threading.Thread(
+            target=self._compact_in_thread,
+            args=(index.model_name,),
+            name='dense-index-compaction',
+            daemon=True
+        ).start()
+        return False
+
+    def _compact_in_thread(self, model_name: str):
+        try:
+            self.compact(model_name)
+        finally:
+            connections.close_all()
+
+    def compact(self, model_name: str):
+        """Rebuild the matrix and its clustering from the current rows and swap it in"""
+        from .services import knowledge_base_fingerprint
+
+        self._compacting = True
+        try:
+            index = DenseVectorIndex.build(model_name, knowledge_base_fingerprint())
+            with self._lock:
+                # Leave an index cleared or switched to another model meanwhile alone
+                if self._index is not None and self._index.model_name == model_name:
+                    self._index = index
+                    # Changes committed while we were building are caught by the next sync
+                    self._checked_at = 0.0
+        except Exception:
+            logger.exception("Dense index compaction failed")
+        finally:
+            self._compacting = False
+
+    def invalidate(self):
+        self._checked_at = 0.0
+
+    def clear(self):
+        with self._lock:
+            self._index = None
+            self._checked_at = 0.0
+
+
+shared_dense_index = SharedDenseIndex()
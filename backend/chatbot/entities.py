@@ -0,0 +1,183 @@
+import threading
+import time
+import unicodedata
+from collections import deque
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from decouple import config
+
+from tourism.models import Place, Province
+
+from .models import ChatMessage
+
+# Seconds a worker reuses its name automaton before reloading place names
+ENTITY_LINKER_TTL = config('ENTITY_LINKER_TTL', default=300.0, cast=float)
+# Shorter names match inside too many unrelated words
+MIN_NAME_LENGTH = 3
+
+APOSTROPHES = str.maketrans({'’': "'", '‘': "'", '`': "'"})
+
+
+def normalize_name(text: str) -> str:
+    """Casefold and strip accents, Arabic diacritics and tatweel"""
+    decomposed = unicodedata.normalize('NFKD', (text or '').translate(APOSTROPHES).casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char) and char != 'ـ')
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a fixed set of patterns.
+
+    Every pattern is found in one pass over the text, however many patterns
+    there are, so matching costs O(len(text) + matches).
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[Tuple[int, Hashable]]] = [[]]
+        self._built = False
+
+    def add(self, pattern: str, value: Hashable):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            state = next_state
+        self._outputs[state].append((len(pattern), value))
+        self._built = False
+
+    def build(self):
+        """Compute failure links breadth-first"""
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Hashable]]:
+        """Yield (start, end, value) for every pattern occurrence in ``text``"""
+        if not self._built:
+            self.build()
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, value in self._outputs[state]:
+                yield end - length, end, value
+
+
+class EntityLinker:
+    """
+    Finds mentions of places and provinces in chat messages.
+
+    Latin and Arabic names are matched case- and accent-insensitively on whole
+    words. Where names overlap the longest wins, so "Oran Cathedral" is
+    linked to the place and not also to the province of Oran.
+    """
+
+    def __init__(self, names: Iterable[Tuple[str, str, int]]):
+        self.automaton = AhoCorasick()
+        self.size = 0
+        for kind, name, entity_id in names:
+            pattern = normalize_name(name).strip()
+            if len(pattern) >= MIN_NAME_LENGTH:
+                self.automaton.add(pattern, (kind, entity_id))
+                self.size += 1
+        self.automaton.build()
+
+    @classmethod
+    def from_database(cls) -> 'EntityLinker':
+        def names():
+            for model, kind in ((Place.objects.filter(is_active=True), 'place'), (Province.objects.all(), 'province')):
+                for entity_id, name, name_ar in model.order_by().values_list('id', 'name', 'name_ar').iterator():
+                    yield kind, name, entity_id
+                    if name_ar:
+                        yield kind, name_ar, entity_id
+        return cls(names())
+
+    @staticmethod
+    def _is_boundary(text: str, index: int) -> bool:
+        return index < 0 or index >= len(text) or not text[index].isalnum()
+
+    def link(self, text: str) -> Tuple[Set[int], Set[int]]:
+        """Return the (place ids, province ids) mentioned in ``text``"""
+        text = normalize_name(text)
+        matches = [
+            (start, end, value) for start, end, value in self.automaton.iter_matches(text)
+            if self._is_boundary(text, start - 1) and self._is_boundary(text, end)
+        ]
+        # Leftmost-longest, non-overlapping
+        matches.sort(key=lambda match: (match[0], match[0] - match[1]))
+        places, provinces = set(), set()
+        covered_until = 0
+        kept_span = None
+        for start, end, (kind, entity_id) in matches:
+            if start < covered_until and (start, end) != kept_span:
+                continue
+            covered_until, kept_span = end, (start, end)
+            (places if kind == 'place' else provinces).add(entity_id)
+        return places, provinces
+
+
+class SharedEntityLinker:
+    """Lazily built, per-process EntityLinker, rebuilt after ENTITY_LINKER_TTL"""
+
+    def __init__(self, ttl: float = ENTITY_LINKER_TTL):
+        self.ttl = ttl
+        self._linker: Optional[EntityLinker] = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> EntityLinker:
+        with self._lock:
+            if self._linker is None or time.monotonic() - self._built_at > self.ttl:
+                self._linker = EntityLinker.from_database()
+                self._built_at = time.monotonic()
+            return self._linker
+
+    def clear(self):
+        with self._lock:
+            self._linker = None
+
+
+shared_entity_linker = SharedEntityLinker()
+
+
+def link_messages(messages: Iterable[ChatMessage], linker: Optional[EntityLinker] = None) -> Tuple[int, int]:
+    """
+    Tag messages with the places and provinces they mention.
+
+    The M2M rows for the whole batch are written with one bulk insert per
+    relation; existing rows are left alone. Returns the number of place and
+    province mentions found.
+    """
+    linker = linker or shared_entity_linker.get()
+    PlaceMention = ChatMessage.mentioned_places.through
+    ProvinceMention = ChatMessage.mentioned_provinces.through
+
+    place_rows, province_rows = [], []
+    for message in messages:
+        places, provinces = linker.link(message.content)
+        place_rows.extend(PlaceMention(chatmessage_id=message.id, place_id=place_id) for place_id in places)
+        province_rows.extend(
+            ProvinceMention(chatmessage_id=message.id, province_id=province_id) for province_id in provinces
+        )
+
+    PlaceMention.objects.bulk_create(place_rows, ignore_conflicts=True)
+    ProvinceMention.objects.bulk_create(province_rows, ignore_conflicts=True)
+    return len(place_rows), len(province_rows)
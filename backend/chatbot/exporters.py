@@ -0,0 +1,167 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from django.db.models import Count, F, IntegerField, OuterRef, QuerySet, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .analytics import NEGATIVE_FEEDBACK, POSITIVE_FEEDBACK
+from .models import ChatFeedback, ChatMessage
+
+# Rows fetched per round trip; on PostgreSQL iterator() uses a server-side
+# cursor, so only one chunk is held in memory at a time
+EXPORT_CHUNK_SIZE = 2000
+
+MESSAGE_COLUMNS = [
+    'id', 'session_id', 'session_key', 'user_email', 'message_type', 'status', 'content',
+    'confidence_score', 'processing_time_ms', 'prompt_tokens', 'model_used', 'created_at'
+]
+FEEDBACK_COLUMNS = ['helpful_feedback', 'not_helpful_feedback']
+
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def _feedback_count(feedback_types: List[str]) -> Coalesce:
+    counts = ChatFeedback.objects.filter(
+        message=OuterRef('pk'),
+        feedback_type__in=feedback_types
+    ).order_by().values('message').annotate(count=Count('id')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def export_queryset(
+    session_ids: Optional[List[int]] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    include_feedback: bool = True
+) -> QuerySet:
+    """Chat messages with their session details, as flat value rows"""
+    queryset = ChatMessage.objects.order_by('id')
+    if session_ids:
+        queryset = queryset.filter(session_id__in=session_ids)
+    if start_date:
+        queryset = queryset.filter(created_at__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(created_at__lte=end_date)
+
+    expressions = {'session_key': F('session__session_id'), 'user_email': F('session__user__email')}
+    if include_feedback:
+        # Correlated counts, so the export is not grouped by every column
+        expressions['helpful_feedback'] = _feedback_count(POSITIVE_FEEDBACK)
+        expressions['not_helpful_feedback'] = _feedback_count(NEGATIVE_FEEDBACK)
+    fields = [column for column in MESSAGE_COLUMNS if column not in expressions]
+    return queryset.values(*fields, **expressions)
+
+
+def export_columns(include_feedback: bool = True) -> List[str]:
+    return MESSAGE_COLUMNS + (FEEDBACK_COLUMNS if include_feedback else [])
+
+
+def _batches(rows: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_jsonl(rows: Iterable[Dict], columns: List[str], chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """One JSON object per line"""
+    for batch in _batches(rows, chunk_size):
+        yield ''.join(json.dumps({column: row[column] for column in columns}, default=str) + '\n' for row in batch)
+
+
+def stream_json(rows: Iterable[Dict], columns: List[str], chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """A single JSON array, written out element by element"""
+    yield '['
+    separator = '\n'
+    for batch in _batches(rows, chunk_size):
+        chunk = []
+        for row in batch:
+            chunk.append(separator + json.dumps({column: row[column] for column in columns}, default=str))
+            separator = ',\n'
+        yield ''.join(chunk)
+    yield '\n]\n'
+
+
+def stream_csv(rows: Iterable[Dict], columns: List[str], chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """CSV with a header row"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    for batch in _batches(rows, chunk_size):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _ParquetSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_parquet(rows: Iterable[Dict], columns: List[str], chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Parquet, one row group per chunk of rows"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {
+        'id': pa.int64(), 'session_id': pa.int64(), 'confidence_score': pa.float64(),
+        'processing_time_ms': pa.int64(), 'prompt_tokens': pa.int64(), 'created_at': pa.timestamp('us', tz='UTC'),
+        'helpful_feedback': pa.int64(), 'not_helpful_feedback': pa.int64(),
+    }
+    schema = pa.schema([(column, types.get(column, pa.string())) for column in columns])
+
+    sink = _ParquetSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for batch in _batches(rows, chunk_size):
+            writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+STREAM_WRITERS = {
+    'json': stream_json,
+    'jsonl': stream_jsonl,
+    'csv': stream_csv,
+    'parquet': stream_parquet,
+}
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
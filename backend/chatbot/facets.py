@@ -0,0 +1,68 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .languages import normalize_language
+
+# Knowledge base columns that searches can be filtered on
+FACET_FIELDS = ('content_type', 'source_type', 'language', 'related_province_id')
+# Facets compared by their normalised value, the same way the knowledge
+# index routes languages to partitions ('fr-FR' and 'fr' are one value)
+FACET_NORMALIZERS = {'language': normalize_language}
+
+
+def facet_value(field: str, value: Any) -> Any:
+    normalize = FACET_NORMALIZERS.get(field)
+    return normalize(value) if normalize else value
+
+
+class FacetIndex:
+    """
+    Per-facet integer codes for every row of a search matrix.
+
+    Each facet value gets a small integer code and every row stores the code
+    of its value, so a filter becomes one vectorised comparison per facet
+    instead of a Python scan over the documents.
+    """
+
+    def __init__(self, codes: Dict[str, np.ndarray], values: Dict[str, Dict[Any, int]], size: int):
+        self.codes = codes
+        self.values = values
+        self.size = size
+
+    @classmethod
+    def from_documents(cls, documents: List[Dict[str, Any]]) -> 'FacetIndex':
+        return cls({field: np.zeros(0, dtype=np.int32) for field in FACET_FIELDS},
+                   {field: {} for field in FACET_FIELDS}, 0).extend(documents)
+
+    def extend(self, documents: List[Dict[str, Any]]) -> 'FacetIndex':
+        """Return a new facet index with codes for appended rows"""
+        codes = {}
+        values = {}
+        for field in FACET_FIELDS:
+            field_values = dict(self.values[field])
+            new_codes = np.fromiter(
+                (field_values.setdefault(facet_value(field, doc.get(field)), len(field_values)) for doc in documents),
+                dtype=np.int32,
+                count=len(documents)
+            )
+            codes[field] = np.concatenate([self.codes[field], new_codes])
+            values[field] = field_values
+        return FacetIndex(codes, values, self.size + len(documents))
+
+    def mask(self, **filters) -> Optional[np.ndarray]:
+        """
+        Boolean row mask for the given ``field=value`` filters.
+
+        Empty filters are ignored; returns None when nothing is filtered.
+        """
+        mask = None
+        for field, value in filters.items():
+            if value is None or value == '':
+                continue
+            code = self.values[field].get(facet_value(field, value))
+            if code is None:
+                return np.zeros(self.size, dtype=bool)
+            field_mask = self.codes[field] == code
+            mask = field_mask if mask is None else mask & field_mask
+        return mask
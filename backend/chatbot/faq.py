@@ -0,0 +1,210 @@
+import atexit
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from decouple import config
+from django.db import transaction
+from django.db.models import F
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, TfidfVectorizer
+
+from .entities import normalize_name
+from .languages import ARABIC_STOP_WORDS, FRENCH_STOP_WORDS
+from .models import FrequentlyAskedQuestion
+
+logger = logging.getLogger(__name__)
+
+# Answer matching questions from the FAQ without retrieval or an LLM call
+FAQ_FAST_PATH_ENABLED = config('FAQ_FAST_PATH_ENABLED', default=True, cast=bool)
+# Similarity (character n-gram cosine scaled by word coverage) needed to match
+FAQ_MATCH_THRESHOLD = config('FAQ_MATCH_THRESHOLD', default=0.8, cast=float)
+# Seconds a worker reuses its FAQ index before reloading the questions
+FAQ_INDEX_TTL = config('FAQ_INDEX_TTL', default=300.0, cast=float)
+# Seconds view counts of FAQ answers are buffered before being written
+FAQ_VIEW_FLUSH_INTERVAL = config('FAQ_VIEW_FLUSH_INTERVAL', default=30.0, cast=float)
+
+# Best character n-gram candidates re-scored by word coverage
+FAQ_CANDIDATES = 5
+# Spelling similarity at which a question word counts as present in the FAQ
+WORD_SIMILARITY = 0.8
+
+NON_WORD = re.compile(r'[\W_]+')
+STOP_WORDS = frozenset(ENGLISH_STOP_WORDS) | frozenset(FRENCH_STOP_WORDS) | frozenset(ARABIC_STOP_WORDS)
+
+
+def normalize_question(text: str) -> str:
+    """Casefold, strip accents and diacritics, and reduce punctuation to spaces"""
+    return NON_WORD.sub(' ', normalize_name(text)).strip()
+
+
+def content_words(normalized: str) -> Set[str]:
+    return {word for word in normalized.split() if len(word) > 2 and word not in STOP_WORDS}
+
+
+def word_coverage(words: Set[str], faq_words: Set[str]) -> float:
+    """Share of ``words`` found in ``faq_words``, allowing for small misspellings"""
+    if not words:
+        return 1.0
+    covered = sum(
+        1 for word in words
+        if word in faq_words or any(SequenceMatcher(None, word, other).ratio() >= WORD_SIMILARITY for other in faq_words)
+    )
+    return covered / len(words)
+
+
+class FAQIndex:
+    """
+    Character n-gram TF-IDF index over the active FAQ questions.
+
+    Character n-grams tolerate typos, plurals and small rewordings in any
+    script. Their cosine similarity is scaled by the share of the question's
+    content words found in the FAQ question, so "best time to visit Oran"
+    does not match "best time to visit Algeria". Identical questions (after
+    normalization) are looked up directly.
+    """
+
+    def __init__(self, faqs: List[Dict[str, Any]]):
+        self.faqs = [faq for faq in faqs if normalize_question(faq['question'])]
+        questions = [normalize_question(faq['question']) for faq in self.faqs]
+        self.exact = {question: i for i, question in enumerate(questions)}
+        self.words = [content_words(question) for question in questions]
+        self.vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=(3, 5), sublinear_tf=True)
+        self.vectors = self.vectorizer.fit_transform(questions) if questions else None
+
+    @classmethod
+    def from_database(cls) -> 'FAQIndex':
+        return cls(list(
+            FrequentlyAskedQuestion.objects.filter(is_active=True).order_by('id').values('id', 'question', 'answer')
+        ))
+
+    def match(self, question: str, threshold: float = FAQ_MATCH_THRESHOLD) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Best matching FAQ entry and its similarity, None below ``threshold``"""
+        normalized = normalize_question(question)
+        if not normalized or self.vectors is None:
+            return None
+        position = self.exact.get(normalized)
+        if position is not None:
+            return self.faqs[position], 1.0
+
+        # Rows and query are L2-normalised, so the dot product is the cosine
+        scores = (self.vectors @ self.vectorizer.transform([normalized]).T).toarray().ravel()
+        words = content_words(normalized)
+        candidates = np.argsort(-scores)[:FAQ_CANDIDATES]
+        best, similarity = max(
+            ((int(i), scores[i] * word_coverage(words, self.words[i])) for i in candidates if scores[i] >= threshold),
+            key=lambda candidate: candidate[1],
+            default=(None, 0.0)
+        )
+        if best is None or similarity < threshold:
+            return None
+        return self.faqs[best], float(similarity)
+
+    def __len__(self):
+        return len(self.faqs)
+
+
+class SharedFAQIndex:
+    """Lazily built, per-process FAQIndex, rebuilt after FAQ_INDEX_TTL"""
+
+    def __init__(self, ttl: float = FAQ_INDEX_TTL):
+        self.ttl = ttl
+        self._index: Optional[FAQIndex] = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> FAQIndex:
+        with self._lock:
+            if self._index is None or time.monotonic() - self._built_at > self.ttl:
+                self._index = FAQIndex.from_database()
+                self._built_at = time.monotonic()
+            return self._index
+
+    def clear(self):
+        with self._lock:
+            self._index = None
+
+
+class ViewCountBuffer:
+    """
+    View counts of FAQ answers served by the chatbot, written in batches.
+
+    Counts are collected in memory and flushed at most every
+    ``flush_interval`` seconds, with one UPDATE per distinct increment rather
+    than one per answer. Counts of a failed flush are kept for the next one.
+    """
+
+    def __init__(self, flush_interval: float = FAQ_VIEW_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._counts = Counter()
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, faq_id: int):
+        with self._lock:
+            self._counts[faq_id] += 1
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write the buffered counts, returns the number of FAQ entries updated"""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._flushed_at = time.monotonic()
+        if not counts:
+            return 0
+
+        by_increment = defaultdict(list)
+        for faq_id, count in counts.items():
+            by_increment[count].append(faq_id)
+        try:
+            with transaction.atomic():
+                for count, faq_ids in by_increment.items():
+                    FrequentlyAskedQuestion.objects.filter(id__in=faq_ids).update(view_count=F('view_count') + count)
+        except Exception as e:
+            logger.warning("Writing FAQ view counts failed, keeping them for the next flush: %s", e)
+            with self._lock:
+                self._counts.update(counts)
+            return 0
+        return len(counts)
+
+    def pending(self) -> Dict[int, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+shared_faq_index = SharedFAQIndex()
+faq_view_counts = ViewCountBuffer()
+atexit.register(faq_view_counts.flush)
+
+
+def answer_from_faq(question: str) -> Optional[Dict[str, Any]]:
+    """
+    FAQ answer to ``question`` in the shape of ChatbotService responses, or
+    None when no FAQ entry matches confidently enough.
+    """
+    if not FAQ_FAST_PATH_ENABLED:
+        return None
+    try:
+        match = shared_faq_index.get().match(question)
+    except Exception as e:
+        logger.warning("FAQ matching unavailable: %s", e)
+        return None
+    if match is None:
+        return None
+
+    faq, similarity = match
+    faq_view_counts.add(faq['id'])
+    return {
+        'response': faq['answer'],
+        'confidence': similarity,
+        'sources': [{'title': faq['question'], 'type': 'faq', 'relevance': similarity}],
+        'suggestions': [],
+        'model_used': 'faq',
+        'prompt_tokens': 0
+    }
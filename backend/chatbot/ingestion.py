@@ -0,0 +1,261 @@
+"""
+Bulk knowledge base ingestion.
+
+Long documents are split into overlapping chunks of whole sentences, each
+stored as its own KnowledgeBase row (``chunk_index`` is its position in the
+document), so retrieval returns the passage that answers a question rather
+than the first few hundred characters of a long article and the prompt
+carries fewer tokens. Chunks whose 64-bit SimHash is within
+INGEST_DUPLICATE_DISTANCE bits of an already stored or ingested chunk are
+dropped as near-duplicates; the rest are written with ``bulk_create``.
+"""
+import hashlib
+import logging
+import re
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+from decouple import config
+from django.db import transaction
+
+from .embeddings import shared_dense_index
+from .languages import WORD_PATTERN, detect_language
+from .models import KnowledgeBase
+from .prompts import count_tokens
+from .response_cache import response_cache
+from .services import KnowledgeIndex, shared_knowledge_index
+
+logger = logging.getLogger(__name__)
+
+# Chunk size in tokens; search results are cut at 500 characters, about 125 tokens
+INGEST_CHUNK_TOKENS = config('INGEST_CHUNK_TOKENS', default=120, cast=int)
+# Tokens of trailing sentences repeated at the start of the next chunk
+INGEST_CHUNK_OVERLAP = config('INGEST_CHUNK_OVERLAP', default=20, cast=int)
+# Chunks whose SimHashes differ in at most this many bits are near-duplicates
+INGEST_DUPLICATE_DISTANCE = config('INGEST_DUPLICATE_DISTANCE', default=3, cast=int)
+INGEST_BATCH_SIZE = config('INGEST_BATCH_SIZE', default=500, cast=int)
+
+# Document keys copied onto every chunk as they are
+DOCUMENT_FIELDS = ('content_type', 'source_type', 'source_url', 'related_place_id', 'related_province_id')
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?؟])\s+|\n\s*\n')
+SHINGLE_SIZE = 3
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+
+
+class IngestionReport(NamedTuple):
+    documents: int
+    chunks: int  # Chunks the documents were split into
+    created: int
+    duplicates: int  # Chunks dropped as near-duplicates
+    replaced: int  # Chunks of earlier ingestions deleted first
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text or '') if sentence.strip()]
+
+
+def _split_words(sentence: str, max_tokens: int) -> List[str]:
+    """Cut a sentence longer than a whole chunk into runs of words"""
+    pieces = []
+    words = []
+    used = 0
+    for word in sentence.split():
+        tokens = count_tokens(word)
+        if words and used + tokens > max_tokens:
+            pieces.append(' '.join(words))
+            words = []
+            used = 0
+        words.append(word)
+        used += tokens
+    if words:
+        pieces.append(' '.join(words))
+    return pieces
+
+
+def chunk_text(text: str, chunk_tokens: int = INGEST_CHUNK_TOKENS, overlap_tokens: int = INGEST_CHUNK_OVERLAP) -> List[str]:
+    """
+    Split ``text`` into chunks of at most ``chunk_tokens`` tokens.
+
+    Chunks end on sentence boundaries and each starts with the trailing
+    sentences of the previous one that fit in ``overlap_tokens``, so a fact
+    spread over a boundary is still whole in one chunk. Only sentences
+    longer than a chunk are cut between words.
+    """
+    units = []
+    for sentence in split_sentences(text):
+        tokens = count_tokens(sentence)
+        if tokens <= chunk_tokens:
+            units.append((sentence, tokens))
+        else:
+            units.extend((piece, count_tokens(piece)) for piece in _split_words(sentence, chunk_tokens))
+
+    chunks = []
+    window = []
+    used = 0
+    for unit in units:
+        if window and used + unit[1] > chunk_tokens:
+            chunks.append(' '.join(sentence for sentence, _ in window))
+            carried = []
+            carried_tokens = 0
+            for sentence, tokens in reversed(window):
+                if carried_tokens + tokens > overlap_tokens or carried_tokens + tokens + unit[1] > chunk_tokens:
+                    break
+                carried.insert(0, (sentence, tokens))
+                carried_tokens += tokens
+            window = carried
+            used = carried_tokens
+        window.append(unit)
+        used += unit[1]
+    if window:
+        chunks.append(' '.join(sentence for sentence, _ in window))
+    return chunks
+
+
+def simhash(text: str) -> int:
+    """
+    64-bit SimHash of the word shingles of ``text``.
+
+    Texts that share most of their shingles get hashes that differ in only
+    a few bits, whatever the case, punctuation or spacing.
+    """
+    words = WORD_PATTERN.findall(text.casefold())
+    if not words:
+        return 0
+    shingles = {
+        ' '.join(words[i:i + SHINGLE_SIZE])
+        for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))
+    }
+    digests = b''.join(hashlib.blake2b(shingle.encode(), digest_size=8).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(shingles), HASH_BITS)
+    # Each bit is set when most shingle hashes have it set
+    majority = bits.sum(axis=0) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(majority).tobytes(), 'big')
+
+
+def to_signed(value: int) -> int:
+    """Unsigned 64-bit hash as stored in a BigIntegerField"""
+    return value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value
+
+
+class SimHashIndex:
+    """
+    Near-duplicate lookup over 64-bit SimHashes.
+
+    Hashes are cut into ``max_distance + 1`` bands; two hashes differing in
+    at most ``max_distance`` bits agree on at least one whole band, so only
+    hashes sharing a band with the query are compared bit by bit.
+    """
+
+    def __init__(self, max_distance: int = INGEST_DUPLICATE_DISTANCE):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError(f'max_distance must be between 0 and {HASH_BITS - 1}')
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        bounds = [HASH_BITS * i // bands for i in range(bands + 1)]
+        self.bands = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self.buckets = [defaultdict(list) for _ in self.bands]
+
+    def __len__(self):
+        return sum(len(hashes) for hashes in self.buckets[0].values())
+
+    def add(self, value: int):
+        value &= HASH_MASK
+        for (start, mask), bucket in zip(self.bands, self.buckets):
+            bucket[(value >> start) & mask].append(value)
+
+    def find(self, value: int) -> Optional[int]:
+        """A stored hash within ``max_distance`` bits of ``value``, if any"""
+        value &= HASH_MASK
+        for (start, mask), bucket in zip(self.bands, self.buckets):
+            for candidate in bucket.get((value >> start) & mask, ()):
+                if (candidate ^ value).bit_count() <= self.max_distance:
+                    return candidate
+        return None
+
+
+def ingest_documents(
+    documents: Iterable[Dict[str, Any]],
+    chunk_tokens: int = INGEST_CHUNK_TOKENS,
+    overlap_tokens: int = INGEST_CHUNK_OVERLAP,
+    max_distance: int = INGEST_DUPLICATE_DISTANCE,
+    batch_size: int = INGEST_BATCH_SIZE,
+    replace: bool = False,
+    created_by=None
+) -> IngestionReport:
+    """
+    Chunk, deduplicate and bulk-insert ``documents`` into the knowledge base.
+
+    Each document is a dict with ``title`` and ``content`` and optionally
+    ``language`` (detected when missing) and the keys in DOCUMENT_FIELDS.
+    With ``replace``, chunks of earlier ingestions of a document (same title
+    and source URL) are deleted first. Runs in one transaction; the search
+    indexes and the response cache pick up the new chunks on commit.
+    """
+    if not 0 <= overlap_tokens < chunk_tokens:
+        raise ValueError('overlap_tokens must be smaller than chunk_tokens')
+    documents = list(documents)
+
+    with transaction.atomic():
+        replaced = 0
+        if replace:
+            for document in documents:
+                # Deleted chunks leave the index through the post_delete signal
+                stale = KnowledgeBase.objects.filter(
+                    chunk_index__isnull=False,
+                    title=document['title'],
+                    source_url=document.get('source_url') or None
+                )
+                replaced += stale.count()
+                stale.delete()
+
+        seen = SimHashIndex(max_distance)
+        stored = KnowledgeBase.objects.filter(simhash__isnull=False).values_list('simhash', flat=True)
+        for value in stored.iterator(chunk_size=batch_size):
+            seen.add(value)
+
+        chunks = 0
+        duplicates = 0
+        created = []
+        pending = []
+        for document in documents:
+            fields = {field: document[field] for field in DOCUMENT_FIELDS if document.get(field)}
+            fields.setdefault('content_type', 'general')
+            language = document.get('language') or detect_language(document['content'])
+            for position, text in enumerate(chunk_text(document['content'], chunk_tokens, overlap_tokens)):
+                chunks += 1
+                value = simhash(text)
+                if seen.find(value) is not None:
+                    duplicates += 1
+                    continue
+                seen.add(value)
+                pending.append(KnowledgeBase(
+                    title=document['title'],
+                    content=text,
+                    language=language,
+                    chunk_index=position,
+                    simhash=to_signed(value),
+                    created_by=created_by,
+                    **fields
+                ))
+                if len(pending) >= batch_size:
+                    created.extend(KnowledgeBase.objects.bulk_create(pending))
+                    pending = []
+        if pending:
+            created.extend(KnowledgeBase.objects.bulk_create(pending))
+
+        # bulk_create sends no post_save, so refresh this process's indexes here;
+        # other workers see the new rows through the knowledge base fingerprint
+        if created:
+            upserts = [{field: getattr(entry, field) for field in KnowledgeIndex.DOCUMENT_FIELDS} for entry in created]
+            transaction.on_commit(shared_dense_index.invalidate)
+            transaction.on_commit(response_cache.invalidate)
+            transaction.on_commit(lambda: shared_knowledge_index.apply_changes(upserts=upserts))
+
+    logger.info(
+        "Ingested %d documents: %d chunks, %d created, %d near-duplicates, %d replaced",
+        len(documents), chunks, len(created), duplicates, replaced
+    )
+    return IngestionReport(len(documents), chunks, len(created), duplicates, replaced)
@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from decouple import config
+from django.core.exceptions import SynchronousOnlyOperation
+from django.db import DatabaseError
+
+from .entities import AhoCorasick
+from .models import ChatIntent
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker reuses its compiled intents before reloading admin changes
+INTENT_ENGINE_TTL = config('INTENT_ENGINE_TTL', default=300.0, cast=float)
+
+# Intents that score the tone of a message rather than its topic; their
+# keywords are whole words, counted once per occurrence
+SENTIMENT_INTENTS = ('positive', 'negative')
+# Keywords longer than three letters also match their plural
+PLURAL_SUFFIXES = ('s', 'es')
+
+
+class Intent(NamedTuple):
+    name: str
+    keywords: Tuple[str, ...]
+    weight: float = 1.0
+    response: str = ''
+    suggestions: Tuple[str, ...] = ()
+
+
+# Intents with a response answer the fallback (best score wins); intents with
+# suggestions give the follow-ups for LLM answers (first match in order wins)
+BUILTIN_INTENTS = (
+    Intent(
+        'greeting',
+        ('hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening'),
+        response="Hello! I'm here to help you discover the beauty of Algeria. What would you like to know about our amazing country?"
+    ),
+    Intent(
+        'places',
+        ('places', 'visit', 'attractions', 'destinations', 'where to go'),
+        response="Algeria has many incredible places to visit! Some highlights include the Casbah of Algiers (UNESCO World Heritage site), the Roman ruins of Timgad and Djémila, the stunning Sahara Desert, and the beautiful Mediterranean coastline. What type of experience interests you most?"
+    ),
+    Intent(
+        'gorillas',
+        ('gorilla', 'gorillas', 'mountain gorilla', 'trekking'),
+        response="The Sahara Desert is Algeria's most famous attraction! You can experience camel trekking, visit ancient rock art at Tassili n'Ajjer, and enjoy stunning desert landscapes. Desert tours can be arranged from cities like Tamanrasset. Would you like to know more about desert excursions?"
+    ),
+    Intent(
+        'culture',
+        ('culture', 'tradition', 'people', 'customs', 'history'),
+        response="Algerian culture is rich and diverse! Known as the 'Gateway to Africa,' Algeria has a blend of Berber, Arab, and Mediterranean influences, beautiful traditional music like Raï, and delicious cuisine including couscous and tagines. The people are incredibly hospitable and proud of their heritage. What aspect of culture interests you?"
+    ),
+    Intent(
+        'weather',
+        ('weather', 'climate', 'temperature', 'rain', 'season'),
+        response="Algeria has a Mediterranean climate along the coast and a desert climate in the south. The best time to visit the coast is spring (March-May) and fall (September-November), while winter is ideal for the Sahara. Summer can be very hot, especially inland. The best time depends on your destinations and activities!"
+    ),
+    Intent(
+        'visa',
+        ('visa', 'entry', 'passport', 'requirements', 'border'),
+        response="Most visitors can get a visa on arrival or apply online for an e-visa. Many nationalities can also get a 30-day visa-free entry. Make sure your passport is valid for at least 6 months. Check the latest requirements based on your nationality before traveling."
+    ),
+    Intent(
+        'desert_suggestions',
+        ('desert', 'sahara', 'trekking'),
+        suggestions=(
+            "What should I bring for desert trekking?",
+            "How much does a Sahara tour cost?",
+            "What other activities are available in the desert?"
+        )
+    ),
+    Intent(
+        'places_suggestions',
+        ('places', 'visit', 'attractions'),
+        suggestions=(
+            "Tell me about the Casbah of Algiers",
+            "What can I do in Constantine?",
+            "How many days should I spend in Algeria?"
+        )
+    ),
+    Intent(
+        'culture_suggestions',
+        ('culture', 'people', 'tradition'),
+        suggestions=(
+            "What is traditional Algerian food like?",
+            "Tell me about Algerian music and dance",
+            "What languages are spoken in Algeria?"
+        )
+    ),
+    Intent('positive', ('good', 'great', 'excellent', 'amazing', 'wonderful', 'love', 'like', 'best', 'fantastic')),
+    Intent('negative', ('bad', 'terrible', 'awful', 'hate', 'dislike', 'worst', 'horrible', 'disappointing')),
+)
+
+DEFAULT_RESPONSE = "I'd be happy to help you learn about Algeria! You can ask me about places to visit, culture, desert excursions, weather, visa requirements, or any other travel-related questions."
+DEFAULT_SUGGESTIONS = (
+    "What's the best time to visit Algeria?",
+    "How do I get around Algeria?",
+    "What are the must-see attractions?"
+)
+# Offered with every rule-based fallback answer, whatever the intent
+FALLBACK_SUGGESTIONS = (
+    "What are the best places to visit in Algeria?",
+    "Tell me about the Sahara Desert",
+    "What's the weather like in Algeria?",
+    "What should I know about Algerian culture?"
+)
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(text.casefold().split())
+
+
+def _is_boundary(text: str, index: int) -> bool:
+    return index < 0 or index >= len(text) or not text[index].isalnum()
+
+
+class IntentAnalysis(NamedTuple):
+    scores: Dict[str, float]  # Answering intents that matched
+    intent: Optional[str]  # Best scoring answering intent
+    response: str
+    suggestions: List[str]
+    sentiment: Dict[str, float]
+
+
+class IntentEngine:
+    """
+    Keyword intents compiled into a single Aho-Corasick automaton.
+
+    One pass over the message finds every keyword of every intent on word
+    boundaries (plurals included, overlapping phrases too), so the cost does
+    not grow with the number of intents. An intent scores its weight for
+    each distinct keyword found; the best scoring intent with a response
+    answers, the first intent in order with suggestions gives the
+    follow-ups, and the sentiment words give the message's tone.
+    """
+
+    def __init__(self, intents: Iterable[Intent]):
+        self.intents = {intent.name: intent for intent in intents}
+        self.order = {name: i for i, name in enumerate(self.intents)}
+        self.automaton = AhoCorasick()
+        self.sentiment_words = defaultdict(list)
+        for intent in self.intents.values():
+            for keyword in intent.keywords:
+                keyword = _normalize(keyword)
+                if not keyword:
+                    continue
+                if intent.name in SENTIMENT_INTENTS:
+                    self.sentiment_words[keyword].append((intent.name, intent.weight))
+                else:
+                    self.automaton.add(keyword, (intent.name, keyword))
+        self.automaton.build()
+
+    @classmethod
+    def from_database(cls) -> 'IntentEngine':
+        """Built-in intents, replaced or extended by the active admin-managed ones"""
+        intents = {intent.name: intent for intent in BUILTIN_INTENTS}
+        for row in ChatIntent.objects.filter(is_active=True).order_by('id'):
+            intents[row.name] = Intent(
+                row.name,
+                tuple(line.strip() for line in row.keywords.splitlines() if line.strip()),
+                row.weight,
+                row.response,
+                tuple(line.strip() for line in row.suggestions.splitlines() if line.strip())
+            )
+        return cls(intents.values())
+
+    def _ends_word(self, text: str, end: int, keyword: str) -> bool:
+        if _is_boundary(text, end):
+            return True
+        return len(keyword) > 3 and any(
+            text.startswith(suffix, end) and _is_boundary(text, end + len(suffix)) for suffix in PLURAL_SUFFIXES
+        )
+
+    def scores(self, text: str) -> Dict[str, float]:
+        text = _normalize(text)
+        found = {
+            value for start, end, value in self.automaton.iter_matches(text)
+            if _is_boundary(text, start - 1) and self._ends_word(text, end, value[1])
+        }
+        scores = defaultdict(float)
+        for name, _ in found:
+            scores[name] += self.intents[name].weight
+        return dict(scores)
+
+    def sentiment(self, text: str) -> Dict[str, float]:
+        """Share of the message's words that are positive and negative"""
+        words = text.casefold().split()
+        if not words:
+            return {'positive': 0.5, 'negative': 0.5, 'neutral': 0.0}
+        counts = defaultdict(float)
+        for word in words:
+            for name, weight in self.sentiment_words.get(word, ()):
+                counts[name] += weight
+        positive = counts['positive'] / len(words)
+        negative = counts['negative'] / len(words)
+        return {'positive': positive, 'negative': negative, 'neutral': 1 - positive - negative}
+
+    def analyze(self, text: str) -> IntentAnalysis:
+        scores = self.scores(text)
+        topics = sorted(
+            (name for name, score in scores.items() if score > 0 and self.intents[name].response),
+            key=lambda name: (-scores[name], self.order[name])
+        )
+        with_suggestions = min(
+            (name for name in scores if self.intents[name].suggestions), key=self.order.get, default=None
+        )
+        return IntentAnalysis(
+            {name: scores[name] for name in topics},
+            topics[0] if topics else None,
+            self.intents[topics[0]].response if topics else DEFAULT_RESPONSE,
+            list(self.intents[with_suggestions].suggestions if with_suggestions else DEFAULT_SUGGESTIONS),
+            self.sentiment(text)
+        )
+
+
+# Compiled once at import; used whenever the admin intents can't be read
+builtin_intent_engine = IntentEngine(BUILTIN_INTENTS)
+
+
+class SharedIntentEngine:
+    """Lazily built, per-process IntentEngine, rebuilt after INTENT_ENGINE_TTL"""
+
+    def __init__(self, ttl: float = INTENT_ENGINE_TTL):
+        self.ttl = ttl
+        self._engine: Optional[IntentEngine] = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> IntentEngine:
+        with self._lock:
+            if self._engine is None or time.monotonic() - self._built_at > self.ttl:
+                try:
+                    self._engine = IntentEngine.from_database()
+                except SynchronousOnlyOperation:
+                    # Called from the event loop: keep what we have, reload on the next sync call
+                    return self._engine or builtin_intent_engine
+                except DatabaseError as e:
+                    logger.warning("Admin intents unavailable, using the built-in ones: %s", e)
+                    self._engine = builtin_intent_engine
+                self._built_at = time.monotonic()
+            return self._engine
+
+    def clear(self):
+        with self._lock:
+            self._engine = None
+
+
+shared_intent_engine = SharedIntentEngine()
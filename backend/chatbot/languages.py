@@ -0,0 +1,121 @@
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from decouple import config
+
+# Language assumed for entries and queries that give no clear signal
+RAG_DEFAULT_LANGUAGE = config('RAG_DEFAULT_LANGUAGE', default='en')
+
+ARABIC_LETTERS = re.compile('[\u0600-\u06ff\u0750-\u077f\u08a0-\u08ff\ufb50-\ufdff\ufe70-\ufeff]')
+ARABIC_DIACRITICS = re.compile('[\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+# Spelling variants folded together: hamza forms of alef, taa marbuta, alef maqsura
+ARABIC_LETTER_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه', 'ى': 'ي', 'ؤ': 'و', 'ئ': 'ي',
+})
+# Definite article, optionally behind a one-letter conjunction or preposition
+ARABIC_PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+WORD_PATTERN = re.compile(r'(?u)\b\w\w+\b')
+LATIN_WORD = re.compile(r"[^\W\d_]+")
+
+FRENCH_ACCENTS = set('éèêëàâçùûüôîïœ')
+
+ENGLISH_MARKERS = frozenset("""
+    the is are was what where which who how when why and of to in for with on from can should
+    i you my your best there this that these those do does visit near about
+""".split())
+
+FRENCH_MARKERS = frozenset("""
+    le la les un une des du de au aux et est sont que qui quoi quel quelle quels quelles où ou
+    pour dans avec sur par je tu il elle nous vous ils mon ma mes ton ta votre vos ce cette ces
+    pas plus peut faut comment quand pourquoi meilleur meilleure visiter près
+""".split())
+
+FRENCH_STOP_WORDS = """
+    a au aux avec ce ces cette dans de des du elle en et eux il ils je la le les leur leurs lui
+    ma mais me meme mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur
+    ta te tes toi ton tu un une vos votre vous est sont etait ete etre avoir ai as avons avez ont
+    cet cela ca ici la ou quel quelle quels quelles comment quand pourquoi tres plus
+""".split()
+
+ARABIC_STOP_WORDS_RAW = """
+    في من على الى إلى عن مع هذا هذه ذلك تلك التي الذي الذين هو هي هم نحن انا أنا انت أنت ما ماذا
+    متى اين أين كيف هل لا لم لن قد كان كانت يكون ثم او أو و ف ب ل ك كل بعض عند بين حتى اذا إذا
+    ان إن أن الا إلا غير ايضا أيضا فقط جدا
+""".split()
+
+
+def normalize_arabic(text: str) -> str:
+    """Lowercase, drop diacritics and tatweel, and fold Arabic letter variants"""
+    return ARABIC_DIACRITICS.sub('', text.lower()).translate(ARABIC_LETTER_MAP)
+
+
+def _strip_prefix(token: str) -> str:
+    for prefix in ARABIC_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+
+def arabic_tokens(text: str) -> List[str]:
+    """Words of at least two letters, with the definite article stripped"""
+    return [_strip_prefix(token) for token in WORD_PATTERN.findall(text)]
+
+
+def _strip_accents(text: str) -> str:
+    return ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+
+
+# Stop words have to look like the analyzer's own tokens to be removed
+ARABIC_STOP_WORDS = sorted(set(arabic_tokens(normalize_arabic(' '.join(ARABIC_STOP_WORDS_RAW)))))
+FRENCH_STOP_WORDS = sorted({_strip_accents(word) for word in FRENCH_STOP_WORDS})
+
+ANALYZERS: Dict[str, Dict[str, Any]] = {
+    'en': {'stop_words': 'english'},
+    'fr': {'stop_words': FRENCH_STOP_WORDS, 'strip_accents': 'unicode'},
+    'ar': {
+        'stop_words': ARABIC_STOP_WORDS,
+        'preprocessor': normalize_arabic,
+        'tokenizer': arabic_tokens,
+        'token_pattern': None,
+    },
+}
+# Languages without their own analyzer are tokenised without stop words
+GENERIC_ANALYZER = {'strip_accents': 'unicode'}
+
+
+def analyzer_options(language: str) -> Dict[str, Any]:
+    """TfidfVectorizer options for ``language``"""
+    return dict(ANALYZERS.get(language, GENERIC_ANALYZER))
+
+
+def normalize_language(language: Optional[str]) -> str:
+    """Primary subtag of a language code ('fr-FR' -> 'fr'), or the default"""
+    language = re.split('[-_]', (language or '').strip().lower())[0]
+    return re.sub('[^a-z]', '', language) or RAG_DEFAULT_LANGUAGE
+
+
+def detect_language(text: str, default: Optional[str] = None) -> str:
+    """
+    Guess whether ``text`` is Arabic, French or English.
+
+    Arabic is recognised by its script; French and English by common
+    function words and French accents. Text that is too short or ambiguous
+    gets ``default`` (RAG_DEFAULT_LANGUAGE).
+    """
+    default = default or RAG_DEFAULT_LANGUAGE
+    letters = sum(1 for char in text if char.isalpha())
+    if not letters:
+        return default
+    if len(ARABIC_LETTERS.findall(text)) / letters >= 0.3:
+        return 'ar'
+
+    words = LATIN_WORD.findall(text.lower())
+    french = sum(word in FRENCH_MARKERS for word in words) + sum(char in FRENCH_ACCENTS for char in text.lower())
+    english = sum(word in ENGLISH_MARKERS for word in words)
+    if french > english:
+        return 'fr'
+    if english > french:
+        return 'en'
+    return default
@@ -0,0 +1,74 @@
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from chatbot.benchmark import (
+    ENDPOINTS, FakeLLMServer, benchmark_database, format_report, run_benchmark, seed_knowledge_base, use_fake_llm
+)
+from chatbot.embeddings import compute_knowledge_embeddings
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the chat endpoints against a synthetic knowledge base and a local fake LLM, '
+        'in a throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=1000, help='Number of knowledge base entries to seed')
+        parser.add_argument('--entry-words', type=int, default=120, help='Words of filler text per entry')
+        parser.add_argument('--requests', type=int, default=100, help='Requests sent to each endpoint')
+        parser.add_argument('--concurrency', type=int, default=4, help='Requests in flight at once')
+        parser.add_argument(
+            '--endpoint',
+            action='append',
+            choices=ENDPOINTS,
+            help='Endpoint to benchmark, may be repeated (default: all of them)'
+        )
+        parser.add_argument('--turns', type=int, default=2, help='Questions asked per chat session')
+        parser.add_argument('--warmup', type=int, default=4, help='Untimed requests sent first')
+        parser.add_argument('--tokens-per-second', type=float, default=50.0, help='Fake LLM generation rate')
+        parser.add_argument('--first-token-ms', type=float, default=200.0, help='Fake LLM delay before the first token')
+        parser.add_argument('--response-tokens', type=int, default=60, help='Tokens in each fake LLM answer')
+        parser.add_argument('--no-embeddings', action='store_true', help='Skip embedding the seeded entries')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic entries and questions')
+        parser.add_argument('--json', dest='json_path', help='Also write the report as JSON to this file')
+        parser.add_argument('--keep-database', action='store_true', help="Don't drop the benchmark database")
+
+    def handle(self, *args, **options):
+        server = FakeLLMServer(
+            tokens_per_second=options['tokens_per_second'],
+            first_token_ms=options['first_token_ms'],
+            response_tokens=options['response_tokens']
+        )
+        with server, benchmark_database(keep=options['keep_database']) as database:
+            self.stdout.write(f'Seeding {options["entries"]} knowledge base entries into {database}...')
+            start_time = time.time()
+            seed_knowledge_base(options['entries'], words=options['entry_words'], seed=options['seed'])
+            if not options['no_embeddings']:
+                with use_fake_llm(server):
+                    compute_knowledge_embeddings()
+            self.stdout.write(f'Seeded in {time.time() - start_time:.2f}s, sending requests...')
+
+            user = get_user_model().objects.create_user(
+                username='benchmark', email='benchmark@example.com', password=None
+            )
+            report = run_benchmark(
+                user,
+                endpoints=tuple(options['endpoint'] or ENDPOINTS),
+                requests=options['requests'],
+                concurrency=options['concurrency'],
+                turns=options['turns'],
+                warmup=options['warmup'],
+                seed=options['seed'],
+                server=server
+            )
+
+        self.stdout.write('')
+        self.stdout.write(format_report(report))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Report written to {options["json_path"]}'))
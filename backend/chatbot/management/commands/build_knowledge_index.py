@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot.services import KnowledgeIndex, knowledge_base_fingerprint
+
+
+class Command(BaseCommand):
+    help = 'Build the knowledge base search index and write it as an on-disk artifact'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default=settings.RAG_INDEX_DIR,
+            help='Directory to write the index artifact to (default: RAG_INDEX_DIR)'
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=2,
+            help='Number of previous builds to keep on disk'
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        index = KnowledgeIndex.build(knowledge_base_fingerprint())
+        build_dir = index.save(options['output'], keep=max(options['keep'], 1))
+        elapsed = time.time() - start_time
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Indexed {len(index)} documents into {build_dir} in {elapsed:.2f}s'
+            )
+        )
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot.embeddings import EmbeddingService, EMBEDDING_BACKENDS, compute_knowledge_embeddings
+
+
+class Command(BaseCommand):
+    help = 'Compute dense embeddings for knowledge base entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend',
+            choices=sorted(EMBEDDING_BACKENDS),
+            help='Embedding backend to use (default: EMBEDDING_BACKEND)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=32,
+            help='Number of entries embedded per request'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-embed every entry, not only missing or stale ones'
+        )
+
+    def handle(self, *args, **options):
+        embedding_service = EmbeddingService(options['backend'])
+        self.stdout.write(f'Embedding knowledge base with {embedding_service.model_name}...')
+
+        start_time = time.time()
+        embedded = compute_knowledge_embeddings(
+            embedding_service,
+            batch_size=max(options['batch_size'], 1),
+            force=options['force']
+        )
+        elapsed = time.time() - start_time
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Embedded {embedded} entries in {elapsed:.2f}s')
+        )
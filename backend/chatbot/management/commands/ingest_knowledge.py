@@ -0,0 +1,108 @@
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.embeddings import compute_knowledge_embeddings
+from chatbot.ingestion import (
+    INGEST_BATCH_SIZE, INGEST_CHUNK_OVERLAP, INGEST_CHUNK_TOKENS, INGEST_DUPLICATE_DISTANCE, ingest_documents
+)
+from chatbot.models import KnowledgeBase
+
+
+def read_documents(path: Path):
+    """Documents from a .jsonl or .json file, or a text file as one document"""
+    if path.suffix == '.jsonl':
+        with path.open(encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    if path.suffix == '.json':
+        documents = json.loads(path.read_text(encoding='utf-8'))
+        return documents if isinstance(documents, list) else [documents]
+
+    text = path.read_text(encoding='utf-8')
+    first_line, _, rest = text.lstrip().partition('\n')
+    if first_line.startswith('#'):
+        # Markdown heading as the title
+        return [{'title': first_line.lstrip('#').strip(), 'content': rest}]
+    return [{'title': path.stem.replace('_', ' ').replace('-', ' ').strip().capitalize(), 'content': text}]
+
+
+class Command(BaseCommand):
+    help = (
+        'Ingest documents into the knowledge base as overlapping chunks, '
+        'skipping chunks that nearly duplicate stored ones'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='+',
+            help='.jsonl/.json files of {"title", "content", ...} documents, or text/markdown files'
+        )
+        parser.add_argument(
+            '--content-type',
+            choices=[choice for choice, _ in KnowledgeBase.CONTENT_TYPES],
+            help='Content type of documents that do not set one (default: general)'
+        )
+        parser.add_argument('--source-type', help='Source type of documents that do not set one')
+        parser.add_argument('--chunk-tokens', type=int, default=INGEST_CHUNK_TOKENS, help='Tokens per chunk')
+        parser.add_argument(
+            '--overlap-tokens',
+            type=int,
+            default=INGEST_CHUNK_OVERLAP,
+            help='Tokens of each chunk repeated at the start of the next'
+        )
+        parser.add_argument(
+            '--max-distance',
+            type=int,
+            default=INGEST_DUPLICATE_DISTANCE,
+            help='SimHash bits two chunks may differ in and still count as duplicates'
+        )
+        parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE, help='Rows per bulk insert')
+        parser.add_argument(
+            '--replace',
+            action='store_true',
+            help='Delete chunks of earlier ingestions of the same documents first'
+        )
+        parser.add_argument('--embed', action='store_true', help='Compute embeddings for the new chunks afterwards')
+
+    def handle(self, *args, **options):
+        documents = []
+        for name in options['paths']:
+            path = Path(name)
+            if not path.is_file():
+                raise CommandError(f'{path} is not a file')
+            documents.extend(read_documents(path))
+
+        defaults = {'content_type': options['content_type'], 'source_type': options['source_type']}
+        for document in documents:
+            if not document.get('title') or not document.get('content'):
+                raise CommandError('Every document needs a title and content')
+            for field, value in defaults.items():
+                if value and not document.get(field):
+                    document[field] = value
+
+        start_time = time.time()
+        try:
+            report = ingest_documents(
+                documents,
+                chunk_tokens=options['chunk_tokens'],
+                overlap_tokens=options['overlap_tokens'],
+                max_distance=options['max_distance'],
+                batch_size=max(options['batch_size'], 1),
+                replace=options['replace']
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        elapsed = time.time() - start_time
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Ingested {report.documents} documents as {report.created} chunks in {elapsed:.2f}s '
+                f'({report.chunks} chunks, {report.duplicates} near-duplicates skipped, {report.replaced} replaced)'
+            )
+        )
+        if options['embed'] and report.created:
+            embedded = compute_knowledge_embeddings()
+            self.stdout.write(self.style.SUCCESS(f'Embedded {embedded} entries'))
@@ -0,0 +1,55 @@
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from chatbot.entities import EntityLinker, link_messages
+from chatbot.models import ChatMessage
+
+
+class Command(BaseCommand):
+    help = 'Tag chat messages with the places and provinces they mention'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of messages linked per bulk insert'
+        )
+        parser.add_argument(
+            '--relink',
+            action='store_true',
+            help='Drop existing mentions first instead of only adding missing ones'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        linker = EntityLinker.from_database()
+        self.stdout.write(f'Linking chat messages against {linker.size} place and province names...')
+
+        if options['relink']:
+            ChatMessage.mentioned_places.through.objects.all().delete()
+            ChatMessage.mentioned_provinces.through.objects.all().delete()
+
+        start_time = time.time()
+        messages = (
+            ChatMessage.objects.exclude(message_type='system').exclude(content='')
+            .only('id', 'content').order_by('id').iterator(chunk_size=batch_size)
+        )
+        linked = places = provinces = 0
+        while True:
+            batch = list(islice(messages, batch_size))
+            if not batch:
+                break
+            batch_places, batch_provinces = link_messages(batch, linker)
+            linked += len(batch)
+            places += batch_places
+            provinces += batch_provinces
+        elapsed = time.time() - start_time
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Linked {linked} messages ({places} place and {provinces} province mentions) in {elapsed:.2f}s'
+            )
+        )
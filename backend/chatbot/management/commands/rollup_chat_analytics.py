@@ -0,0 +1,31 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.analytics import rollup_chat_analytics
+
+
+class Command(BaseCommand):
+    help = 'Aggregate chat activity into daily ChatAnalytics rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='First day to recompute (YYYY-MM-DD); default is the latest rolled-up day'
+        )
+        parser.add_argument(
+            '--until',
+            help='Last day to recompute (YYYY-MM-DD); default is today'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options['since']) if options['since'] else None
+            until = date.fromisoformat(options['until']) if options['until'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        rows = rollup_chat_analytics(since, until)
+        self.stdout.write(
+            self.style.SUCCESS(f'Rolled up {len(rows)} day(s) of chat analytics')
+        )
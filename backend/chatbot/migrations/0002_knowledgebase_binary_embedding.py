@@ -0,0 +1,56 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:48
+
+import numpy as np
+from django.db import migrations, models
+
+
+def pack_json_embeddings(apps, schema_editor):
+    """Convert JSON float lists into raw float32 blobs"""
+    KnowledgeBase = apps.get_model('chatbot', 'KnowledgeBase')
+    entries = KnowledgeBase.objects.filter(embedding_vector__isnull=False).only('id', 'embedding_vector')
+    for entry in entries.iterator():
+        if isinstance(entry.embedding_vector, list) and entry.embedding_vector:
+            entry.embedding = np.asarray(entry.embedding_vector, dtype=np.float32).tobytes()
+            entry.save(update_fields=['embedding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='embedded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='embedding_model',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.RunPython(pack_json_embeddings, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='knowledgebase',
+            name='embedding_vector',
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['user', '-updated_at'], name='chatbot_cha_user_id_52c956_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['session_id'], name='chatbot_cha_session_9384e5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['is_active'], name='chatbot_cha_is_acti_5622bd_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0002_knowledgebase_binary_embedding"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="time_to_first_token_ms",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
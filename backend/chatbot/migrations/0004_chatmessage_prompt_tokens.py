@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0003_chatmessage_time_to_first_token"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="prompt_tokens",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0004_chatmessage_prompt_tokens"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("complete", "Complete"),
+                    ("failed", "Failed"),
+                ],
+                default="complete",
+                max_length=10,
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0005_chatmessage_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatanalytics",
+            name="active_sessions",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="chatanalytics",
+            name="scored_responses",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="chatanalytics",
+            name="timed_responses",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="chatanalytics",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(
+                fields=["created_at"], name="chatbot_cha_created_7c236e_idx"
+            ),
+        ),
+    ]
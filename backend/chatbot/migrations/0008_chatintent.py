@@ -0,0 +1,51 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0007_chatsession_summary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatIntent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                (
+                    "keywords",
+                    models.TextField(help_text="One keyword or phrase per line"),
+                ),
+                ("weight", models.FloatField(default=1.0)),
+                (
+                    "response",
+                    models.TextField(
+                        blank=True,
+                        help_text="Answer given when this is the best matching intent",
+                    ),
+                ),
+                (
+                    "suggestions",
+                    models.TextField(
+                        blank=True, help_text="Follow-up questions, one per line"
+                    ),
+                ),
+                ("is_active", models.BooleanField(default=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["name"],
+            },
+        ),
+    ]
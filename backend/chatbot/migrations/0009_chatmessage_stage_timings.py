@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0008_chatintent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="stage_timings",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
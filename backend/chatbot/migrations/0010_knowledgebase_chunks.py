@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0009_chatmessage_stage_timings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="knowledgebase",
+            name="chunk_index",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="knowledgebase",
+            name="simhash",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:24
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Min
+from django.utils import timezone
+
+
+def count_new_active_sessions(apps, schema_editor):
+    """Fill in the new field on rollups that already exist"""
+    ChatAnalytics = apps.get_model('chatbot', 'ChatAnalytics')
+    ChatMessage = apps.get_model('chatbot', 'ChatMessage')
+    if not ChatAnalytics.objects.exists():
+        return
+    first_messages = ChatMessage.objects.values('session').annotate(first_message_at=Min('created_at'))
+    counts = Counter(timezone.localdate(row['first_message_at']) for row in first_messages.iterator())
+    for analytics in ChatAnalytics.objects.filter(date__in=list(counts)).iterator():
+        analytics.new_active_sessions = counts[analytics.date]
+        analytics.save(update_fields=['new_active_sessions'])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0010_knowledgebase_chunks"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatanalytics",
+            name="new_active_sessions",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_new_active_sessions, migrations.RunPython.noop),
+    ]
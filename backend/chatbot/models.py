@@ -30,13 +30,19 @@ class KnowledgeBase(models.Model):
     related_province = models.ForeignKey(Province, on_delete=models.CASCADE, blank=True, null=True, related_name='knowledge_entries')
     
     # Vector embeddings for RAG
-    embedding_vector = models.JSONField(blank=True, null=True)  # Store embeddings as JSON
+    embedding = models.BinaryField(blank=True, null=True, editable=False)  # Raw float32 bytes
+    embedding_model = models.CharField(max_length=100, blank=True, null=True)
+    embedded_at = models.DateTimeField(blank=True, null=True)
     
     # Metadata
     source_url = models.URLField(blank=True, null=True)
     source_type = models.CharField(max_length=100, blank=True, null=True)
     language = models.CharField(max_length=10, default='en')
     
+    # Ingested chunks: position within the source document and SimHash of the text
+    chunk_index = models.PositiveIntegerField(blank=True, null=True)
+    simhash = models.BigIntegerField(blank=True, null=True, editable=False)  # Signed 64-bit
+    
     # Status
     is_active = models.BooleanField(default=True)
     is_verified = models.BooleanField(default=False)
@@ -57,6 +63,29 @@ class KnowledgeBase(models.Model):
     def __str__(self):
         return self.title
 
+class ChatSessionQuerySet(models.QuerySet):
+    def with_message_stats(self):
+        """
+        Annotate each session with its message statistics.
+        
+        Lets session lists show counts, previews and titles without a query
+        per session; the matching ChatSession properties and serializer
+        fields use these annotations when they are present.
+        """
+        messages = ChatMessage.objects.filter(session=models.OuterRef('pk'))
+        return self.annotate(
+            messages_count=models.Count('messages'),
+            last_message_at=models.Max('messages__created_at'),
+            total_response_time=models.Sum('messages__processing_time_ms'),
+            average_confidence=models.Avg('messages__confidence_score'),
+            last_message_content=models.Subquery(
+                messages.order_by('-created_at').values('content')[:1]
+            ),
+            first_user_message_content=models.Subquery(
+                messages.filter(message_type='user').order_by('created_at').values('content')[:1]
+            ),
+        )
+
 class ChatSession(models.Model):
     """Chat sessions for users"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_sessions', blank=True, null=True)
@@ -70,9 +99,15 @@ class ChatSession(models.Model):
     # Status
     is_active = models.BooleanField(default=True)
     
+    # Rolling summary of the turns older than the ones sent to the LLM verbatim
+    summary = models.TextField(blank=True, default='')
+    summary_message_id = models.IntegerField(blank=True, null=True)  # Last message folded into the summary
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ChatSessionQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-updated_at']
         indexes = [
@@ -88,15 +123,21 @@ class ChatSession(models.Model):
     
     @property
     def message_count(self):
+        if hasattr(self, 'messages_count'):
+            return self.messages_count
         return self.messages.count()
     
     @property
     def last_message_preview(self):
         """Get preview of the last message"""
-        last_message = self.messages.order_by('-created_at').first()
-        if last_message:
-            preview = last_message.content[:100]
-            return preview + "..." if len(last_message.content) > 100 else preview
+        if hasattr(self, 'last_message_content'):
+            content = self.last_message_content
+        else:
+            last_message = self.messages.order_by('-created_at').first()
+            content = last_message.content if last_message else None
+        if content is not None:
+            preview = content[:100]
+            return preview + "..." if len(content) > 100 else preview
         return "No messages yet"
     
     @property
@@ -105,26 +146,52 @@ class ChatSession(models.Model):
         if self.title:
             return self.title
         
-        first_user_message = self.messages.filter(message_type='user').order_by('created_at').first()
-        if first_user_message:
+        if hasattr(self, 'first_user_message_content'):
+            content = self.first_user_message_content
+        else:
+            first_user_message = self.messages.filter(message_type='user').order_by('created_at').first()
+            content = first_user_message.content if first_user_message else None
+        if content is not None:
             # Create title from first 50 characters of first message
-            title = first_user_message.content[:50].strip()
-            if len(first_user_message.content) > 50:
+            title = content[:50].strip()
+            if len(content) > 50:
                 title += "..."
             return title
         
         return f"Chat {self.created_at.strftime('%b %d, %Y')}"
     
+    def _unsummarized_messages(self):
+        return self.messages.exclude(status='pending').filter(
+            id__gt=self.summary_message_id or 0
+        ).order_by('-created_at')
+    
+    def _summary_history(self):
+        return [{'role': 'system', 'content': self.summary}] if self.summary else []
+    
     def get_conversation_history(self, limit=10):
-        """Get recent conversation history for context"""
-        messages = self.messages.order_by('-created_at')[:limit]
-        history = []
+        """
+        Get recent conversation history for context: the rolling summary of
+        older turns, if any, followed by the messages it doesn't cover yet
+        """
+        messages = self._unsummarized_messages()[:limit]
+        history = self._summary_history()
         for msg in reversed(messages):
             history.append({
                 'role': 'user' if msg.message_type == 'user' else 'assistant',
                 'content': msg.content
             })
         return history
+    
+    async def aget_conversation_history(self, limit=10):
+        """Async variant of get_conversation_history"""
+        history = []
+        async for msg in self._unsummarized_messages()[:limit]:
+            history.append({
+                'role': 'user' if msg.message_type == 'user' else 'assistant',
+                'content': msg.content
+            })
+        history.reverse()
+        return self._summary_history() + history
 
 class ChatMessage(models.Model):
     """Individual chat messages"""
@@ -134,9 +201,17 @@ class ChatMessage(models.Model):
         ('system', 'System Message'),
     ]
     
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('complete', 'Complete'),
+        ('failed', 'Failed'),
+    ]
+    
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPES)
     content = models.TextField()
+    # Queued assistant replies stay pending until a worker fills them in
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='complete')
     
     # RAG context
     retrieved_context = models.JSONField(blank=True, null=True)  # Retrieved knowledge base entries
@@ -148,12 +223,16 @@ class ChatMessage(models.Model):
     
     # Metadata
     processing_time_ms = models.IntegerField(blank=True, null=True)
+    time_to_first_token_ms = models.IntegerField(blank=True, null=True)  # Streamed responses only
+    prompt_tokens = models.IntegerField(blank=True, null=True)  # Estimated size of the LLM prompt
+    stage_timings = models.JSONField(blank=True, null=True)  # Milliseconds per pipeline stage, see tracing.py
     model_used = models.CharField(max_length=100, blank=True, null=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['created_at']
+        indexes = [models.Index(fields=['created_at'])]  # Daily analytics rollups
     
     def __str__(self):
         content_preview = self.content[:50] + "..." if len(self.content) > 50 else self.content
@@ -212,14 +291,18 @@ class ChatAnalytics(models.Model):
     date = models.DateField()
     
     # Usage metrics
-    total_sessions = models.IntegerField(default=0)
+    total_sessions = models.IntegerField(default=0)  # Sessions started that day
+    active_sessions = models.IntegerField(default=0)  # Sessions with messages that day
+    new_active_sessions = models.IntegerField(default=0)  # Sessions whose first message was that day
     total_messages = models.IntegerField(default=0)
     unique_users = models.IntegerField(default=0)
     anonymous_sessions = models.IntegerField(default=0)
     
-    # Performance metrics
+    # Performance metrics, with the number of responses behind each average
     avg_response_time_ms = models.FloatField(blank=True, null=True)
+    timed_responses = models.IntegerField(default=0)
     avg_confidence_score = models.FloatField(blank=True, null=True)
+    scored_responses = models.IntegerField(default=0)
     
     # Feedback metrics
     helpful_responses = models.IntegerField(default=0)
@@ -230,6 +313,7 @@ class ChatAnalytics(models.Model):
     top_places_mentioned = models.JSONField(default=dict, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Last rollup
     
     class Meta:
         unique_together = ['date']
@@ -237,3 +321,21 @@ class ChatAnalytics(models.Model):
     
     def __str__(self):
         return f"Chat Analytics - {self.date}"
+
+class ChatIntent(models.Model):
+    """Keyword intent recognised by the rule-based fallback, managed in the admin"""
+    name = models.CharField(max_length=50, unique=True)  # Replaces the built-in intent of the same name
+    keywords = models.TextField(help_text='One keyword or phrase per line')
+    weight = models.FloatField(default=1.0)  # Score added per distinct keyword found
+    response = models.TextField(blank=True, help_text='Answer given when this is the best matching intent')
+    suggestions = models.TextField(blank=True, help_text='Follow-up questions, one per line')
+    is_active = models.BooleanField(default=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        return self.name
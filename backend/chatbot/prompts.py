@@ -0,0 +1,179 @@
+"""
+Prompt assembly for the chatbot LLM backends.
+
+The system prompt is a constant, so every request starts with the same bytes
+and a model server that keeps the model loaded can reuse the cached prefix
+instead of re-reading the instructions. Retrieved context, conversation
+history and the question follow it and are fitted to a token budget.
+"""
+import math
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+from decouple import config
+
+# Context window requested from Ollama and tokens reserved for the answer
+OLLAMA_NUM_CTX = config('OLLAMA_NUM_CTX', default=4096, cast=int)
+LLM_MAX_RESPONSE_TOKENS = config('LLM_MAX_RESPONSE_TOKENS', default=500, cast=int)
+# Most tokens of retrieved knowledge base context put in a prompt
+PROMPT_CONTEXT_TOKENS = config('PROMPT_CONTEXT_TOKENS', default=1000, cast=int)
+
+SYSTEM_PROMPT = """You are a helpful tourism assistant for Algeria. Use the context given with each question to answer questions about Algeria's tourism, culture, places to visit, and travel information.
+
+Instructions:
+- Provide accurate and helpful information about Algeria
+- If the context doesn't contain relevant information, use your general knowledge about Algeria
+- Be friendly and encouraging about visiting Algeria
+- Suggest specific places, activities, or experiences when appropriate
+- If asked about travel logistics, provide practical advice
+- Keep responses concise but informative"""
+
+NO_CONTEXT = "No specific context available."
+
+# Words and single punctuation marks; long words count as several tokens
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+CHARS_PER_TOKEN = 4
+ELLIPSIS_TOKENS = 3
+
+
+def _piece_tokens(piece: str) -> int:
+    return max(1, math.ceil(len(piece) / CHARS_PER_TOKEN))
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate the number of model tokens in ``text``.
+
+    Sub-word tokenizers average about four characters per token on English
+    and French text and give punctuation its own token, which this mirrors
+    without needing the model's vocabulary.
+    """
+    return sum(_piece_tokens(piece) for piece in TOKEN_PATTERN.findall(text or ''))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of ``text`` that fits in ``max_tokens``"""
+    used = 0
+    end = 0
+    for match in TOKEN_PATTERN.finditer(text or ''):
+        used += _piece_tokens(match.group())
+        if used > max_tokens:
+            break
+        end = match.end()
+    else:
+        return text or ''
+    return text[:end]
+
+
+class Prompt(NamedTuple):
+    system: str
+    context: str
+    history: List[Dict[str, str]]
+    question: str
+    token_count: int
+    summary: str = ''
+
+    def completion_text(self) -> str:
+        """Everything after the system prompt, for completion-style APIs"""
+        summary = f"Conversation so far:\n{self.summary}\n\n" if self.summary else ''
+        conversation = ''.join(
+            f"{'Human' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}\n"
+            for msg in self.history
+        )
+        return f"Context:\n{self.context or NO_CONTEXT}\n\n{summary}{conversation}Human: {self.question}\nAssistant:"
+
+    def messages(self) -> List[Dict[str, str]]:
+        """Chat messages with the static system prompt first"""
+        messages = [
+            {'role': 'system', 'content': self.system},
+            {'role': 'system', 'content': f"Context:\n{self.context or NO_CONTEXT}"},
+        ]
+        if self.summary:
+            messages.append({'role': 'system', 'content': f"Conversation so far:\n{self.summary}"})
+        messages.extend(
+            {'role': 'user' if msg['role'] == 'user' else 'assistant', 'content': msg['content']}
+            for msg in self.history
+        )
+        messages.append({'role': 'user', 'content': self.question})
+        return messages
+
+
+class PromptBuilder:
+    """
+    Fits retrieved context and conversation history into a token budget.
+
+    The question is always kept. Context chunks are kept in retrieval order
+    up to ``context_tokens``, then the conversation summary (a leading
+    'system' history entry, see ChatSession.get_conversation_history), and
+    history is filled newest-first with whatever budget is left, dropping
+    whole turns rather than cutting them.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = OLLAMA_NUM_CTX - LLM_MAX_RESPONSE_TOKENS,
+        context_tokens: int = PROMPT_CONTEXT_TOKENS,
+        system: str = SYSTEM_PROMPT
+    ):
+        self.token_budget = token_budget
+        self.context_tokens = context_tokens
+        self.system = system
+        self.system_tokens = count_tokens(system)
+
+    def fit_context(self, context: str, max_tokens: int) -> str:
+        """Keep whole context chunks that fit, then as much of the next as is useful"""
+        chunks = [chunk.strip() for chunk in re.split(r'\n{2,}', context or '') if chunk.strip()]
+        kept = []
+        used = 0
+        for chunk in chunks:
+            tokens = count_tokens(chunk)
+            if used + tokens <= max_tokens:
+                kept.append(chunk)
+                used += tokens
+                continue
+            # Only add a partial chunk if there's meaningful space
+            if max_tokens - used > 25:
+                kept.append(truncate_to_tokens(chunk, max_tokens - used - ELLIPSIS_TOKENS).rstrip() + '...')
+            break
+        return '\n\n'.join(kept)
+
+    def build(
+        self,
+        question: str,
+        context: str,
+        conversation_history: Optional[List[Dict]] = None,
+        history_turns: int = 6
+    ) -> Prompt:
+        history = list(conversation_history or [])
+        summary = '\n'.join(msg['content'] for msg in history if msg['role'] == 'system')
+        history = [msg for msg in history if msg['role'] != 'system']
+        # The views store the question before reading the history
+        if history and history[-1]['role'] == 'user' and history[-1]['content'] == question:
+            history.pop()
+
+        # Framing words ("Context:", "Human:", ...) cost a few tokens as well
+        remaining = self.token_budget - self.system_tokens - count_tokens(question) - 10
+        context = self.fit_context(context, max(0, min(self.context_tokens, remaining)))
+        remaining -= count_tokens(context)
+        # The summary stands in for older turns, so it goes before any of them
+        summary = truncate_to_tokens(summary, max(0, remaining - 5))
+        if summary:
+            remaining -= count_tokens(summary) + 5
+
+        kept = []
+        for msg in reversed(history[-history_turns:] if history_turns else []):
+            tokens = count_tokens(msg['content']) + 2
+            if tokens > remaining:
+                break
+            kept.append(msg)
+            remaining -= tokens
+        kept.reverse()
+
+        return Prompt(
+            self.system,
+            context,
+            kept,
+            question,
+            self.token_budget - remaining,
+            summary
+        )
@@ -0,0 +1,155 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+from decouple import config
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+from .embeddings import EmbeddingService
+
+RESPONSE_CACHE_ENABLED = config('RESPONSE_CACHE_ENABLED', default=True, cast=bool)
+RESPONSE_CACHE_SIZE = config('RESPONSE_CACHE_SIZE', default=1000, cast=int)
+# Seconds a cached answer is served before the LLM is asked again
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=3600.0, cast=float)
+# Cosine similarity above which a differently worded question reuses an answer
+RESPONSE_CACHE_SIMILARITY = config('RESPONSE_CACHE_SIMILARITY', default=0.9, cast=float)
+# Embeds cached questions; the local hashing backend needs no model server
+RESPONSE_CACHE_EMBEDDING_BACKEND = config('RESPONSE_CACHE_EMBEDDING_BACKEND', default='hashing')
+
+QUERY_NOISE = re.compile(r'[^\w\s]+')
+# Filler words are left out of question embeddings, negations are kept
+FILLER_WORDS = ENGLISH_STOP_WORDS - {'no', 'not', 'nor', 'never', 'none', 'nothing', 'without'}
+
+
+class CacheEntry(NamedTuple):
+    vector: np.ndarray
+    response: Dict[str, Any]
+    expires_at: float
+
+
+class ResponseCache:
+    """
+    In-process LRU cache of chatbot responses with a TTL.
+
+    Answers are scoped by a fingerprint of the retrieved context and of the
+    earlier conversation, so an answer is only reused when the model would
+    have seen the same prompt apart from the question. Within a scope a
+    question matches exactly after normalisation, or as a near duplicate
+    whose embedding is within RESPONSE_CACHE_SIMILARITY. Since the retrieved
+    context is part of the key, knowledge base edits made by any process stop
+    stale answers from matching; local edits also clear the cache outright.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL,
+        similarity_threshold: float = RESPONSE_CACHE_SIMILARITY,
+        embedding_service: Optional[EmbeddingService] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._embedding_service = embedding_service
+        self._entries = OrderedDict()
+        self._scopes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def embedding_service(self) -> EmbeddingService:
+        if self._embedding_service is None:
+            self._embedding_service = EmbeddingService(RESPONSE_CACHE_EMBEDDING_BACKEND)
+        return self._embedding_service
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return ' '.join(QUERY_NOISE.sub(' ', query.lower()).split())
+
+    @staticmethod
+    def content_words(normalized_query: str) -> str:
+        return ' '.join(word for word in normalized_query.split() if word not in FILLER_WORDS)
+
+    def embed(self, normalized_query: str) -> np.ndarray:
+        return self.embedding_service.embed_query(self.content_words(normalized_query) or normalized_query)
+
+    @staticmethod
+    def scope(query: str, context: str, conversation_history: Optional[List[Dict]] = None) -> str:
+        """Fingerprint of everything in the prompt except the question itself"""
+        history = list(conversation_history or [])
+        # The views store the question before reading the history
+        if history and history[-1].get('role') == 'user' and history[-1].get('content') == query:
+            history.pop()
+        digest = hashlib.sha1((context or '').encode('utf-8'))
+        for msg in history:
+            digest.update(f"\x00{msg['role']}\x00{msg['content']}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, query: str, context: str, conversation_history: Optional[List[Dict]] = None) -> Optional[Dict[str, Any]]:
+        """Cached response for the question, or None"""
+        scope = self.scope(query, context, conversation_history)
+        key = (scope, self.normalize_query(query))
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    return dict(entry.response)
+                self._discard(key)
+            if not self._scopes.get(scope):
+                return None
+
+        vector = self.embed(key[1])
+        with self._lock:
+            keys = [
+                candidate for candidate in self._scopes.get(scope, ())
+                if self._entries[candidate].expires_at > now
+            ]
+            if not keys:
+                return None
+            similarities = np.stack([self._entries[candidate].vector for candidate in keys]) @ vector
+            best = int(similarities.argmax())
+            if similarities[best] < self.similarity_threshold:
+                return None
+            self._entries.move_to_end(keys[best])
+            return dict(self._entries[keys[best]].response)
+
+    def set(self, query: str, context: str, response: Dict[str, Any], conversation_history: Optional[List[Dict]] = None):
+        scope = self.scope(query, context, conversation_history)
+        key = (scope, self.normalize_query(query))
+        entry = CacheEntry(
+            self.embed(key[1]),
+            dict(response),
+            time.monotonic() + self.ttl
+        )
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._scopes.setdefault(scope, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        del self._entries[key]
+        scope_keys = self._scopes[key[0]]
+        scope_keys.discard(key)
+        if not scope_keys:
+            del self._scopes[key[0]]
+
+    def invalidate(self):
+        """Drop every cached response"""
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+response_cache = ResponseCache()
@@ -4,9 +4,13 @@ from .models import (
     FrequentlyAskedQuestion, ChatAnalytics
 )
 from django.contrib.auth import get_user_model
+from django.db.models import Avg, Sum
 import uuid
 import time
 
+from .exporters import parquet_available
+from .ingestion import INGEST_CHUNK_OVERLAP, INGEST_CHUNK_TOKENS
+
 User = get_user_model()
 
 class KnowledgeBaseSerializer(serializers.ModelSerializer):
@@ -14,8 +18,8 @@ class KnowledgeBaseSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = KnowledgeBase
-        fields = '__all__'
-        read_only_fields = ('created_at', 'updated_at', 'embedding')
+        exclude = ('embedding',)
+        read_only_fields = ('created_at', 'updated_at', 'embedding_model', 'embedded_at')
 
 class KnowledgeBaseCreateSerializer(serializers.ModelSerializer):
     """Knowledge base create serializer"""
@@ -41,9 +45,12 @@ class ChatSessionSerializer(serializers.ModelSerializer):
         read_only_fields = ('user', 'session_id', 'created_at', 'updated_at')
     
     def get_messages_count(self, obj):
-        return obj.messages.count()
+        return obj.message_count
     
     def get_last_message_at(self, obj):
+        # Annotated by ChatSession.objects.with_message_stats()
+        if hasattr(obj, 'last_message_at'):
+            return obj.last_message_at or obj.created_at
         last_message = obj.messages.order_by('-created_at').first()
         return last_message.created_at if last_message else obj.created_at
 
@@ -122,9 +129,23 @@ class ChatMessageListSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = ChatMessage
-        fields = ['id', 'content', 'message_type', 'created_at', 'confidence_score']
+        fields = ['id', 'content', 'message_type', 'status', 'created_at', 'confidence_score']
         read_only_fields = ['id', 'created_at']
 
+class ChatMessageStatusSerializer(serializers.ModelSerializer):
+    """Queued assistant reply, as polled by the client"""
+    message_id = serializers.IntegerField(source='id', read_only=True)
+    response = serializers.CharField(source='content', read_only=True)
+    sources = serializers.JSONField(source='retrieved_context', read_only=True)
+    
+    class Meta:
+        model = ChatMessage
+        fields = [
+            'message_id', 'session', 'status', 'response', 'confidence_score', 'sources',
+            'processing_time_ms', 'stage_timings', 'model_used', 'created_at'
+        ]
+        read_only_fields = fields
+
 class ChatFeedbackSerializer(serializers.ModelSerializer):
     """Chat feedback serializer"""
     user_name = serializers.CharField(source='user.full_name', read_only=True)
@@ -200,12 +221,14 @@ class ChatSuggestionSerializer(serializers.Serializer):
 class KnowledgeSearchSerializer(serializers.Serializer):
     """Knowledge base search serializer"""
     query = serializers.CharField(required=True, max_length=500)
-    content_type = serializers.CharField(required=False, allow_blank=True)
-    source_type = serializers.ChoiceField(
+    content_type = serializers.ChoiceField(
         choices=KnowledgeBase.CONTENT_TYPES,
         required=False,
         allow_blank=True
     )
+    source_type = serializers.CharField(required=False, allow_blank=True)
+    language = serializers.CharField(required=False, allow_blank=True, max_length=10)
+    province_id = serializers.IntegerField(required=False)
     limit = serializers.IntegerField(default=10, min_value=1, max_value=50)
 
 class ChatHistorySerializer(serializers.Serializer):
@@ -227,16 +250,18 @@ class ChatSessionAdminSerializer(serializers.ModelSerializer):
         fields = '__all__'
     
     def get_messages_count(self, obj):
-        return obj.messages.count()
+        return obj.message_count
     
+    # Annotated by ChatSession.objects.with_message_stats()
     def get_total_response_time(self, obj):
-        return sum(msg.processing_time_ms or 0 for msg in obj.messages.all())
+        if hasattr(obj, 'total_response_time'):
+            return obj.total_response_time or 0
+        return obj.messages.aggregate(total=Sum('processing_time_ms'))['total'] or 0
     
     def get_average_confidence(self, obj):
-        messages = obj.messages.filter(confidence_score__isnull=False)
-        if messages.exists():
-            return sum(msg.confidence_score for msg in messages) / messages.count()
-        return 0
+        if hasattr(obj, 'average_confidence'):
+            return obj.average_confidence or 0
+        return obj.messages.aggregate(average=Avg('confidence_score'))['average'] or 0
 
 class BulkKnowledgeBaseSerializer(serializers.Serializer):
     """Bulk knowledge base operations serializer"""
@@ -247,6 +272,28 @@ class BulkKnowledgeBaseSerializer(serializers.Serializer):
     )
     action = serializers.ChoiceField(choices=['activate', 'deactivate', 'delete'])
 
+class KnowledgeDocumentSerializer(serializers.Serializer):
+    """Document to ingest into the knowledge base"""
+    title = serializers.CharField(max_length=300)
+    content = serializers.CharField()
+    content_type = serializers.ChoiceField(choices=KnowledgeBase.CONTENT_TYPES, default='general')
+    source_type = serializers.CharField(required=False, allow_blank=True, max_length=100)
+    source_url = serializers.URLField(required=False, allow_blank=True)
+    language = serializers.CharField(required=False, allow_blank=True, max_length=10)
+
+class KnowledgeIngestSerializer(serializers.Serializer):
+    """Knowledge base ingestion serializer"""
+    documents = KnowledgeDocumentSerializer(many=True, min_length=1, max_length=100)
+    chunk_tokens = serializers.IntegerField(required=False, min_value=20, max_value=1000)
+    overlap_tokens = serializers.IntegerField(required=False, min_value=0)
+    replace = serializers.BooleanField(default=False)
+    
+    def validate(self, data):
+        chunk_tokens = data.get('chunk_tokens', INGEST_CHUNK_TOKENS)
+        if data.get('overlap_tokens', INGEST_CHUNK_OVERLAP) >= chunk_tokens:
+            raise serializers.ValidationError("overlap_tokens must be smaller than chunk_tokens.")
+        return data
+
 class ChatExportSerializer(serializers.Serializer):
     """Chat export serializer"""
     session_ids = serializers.ListField(
@@ -255,5 +302,10 @@ class ChatExportSerializer(serializers.Serializer):
     )
     start_date = serializers.DateTimeField(required=False)
     end_date = serializers.DateTimeField(required=False)
-    format = serializers.ChoiceField(choices=['json', 'csv'], default='json')
-    include_feedback = serializers.BooleanField(default=True)
\ No newline at end of file
+    format = serializers.ChoiceField(choices=['json', 'jsonl', 'csv', 'parquet'], default='json')
+    include_feedback = serializers.BooleanField(default=True)
+    
+    def validate_format(self, value):
+        if value == 'parquet' and not parquet_available():
+            raise serializers.ValidationError("Parquet export requires pyarrow to be installed.")
+        return value
\ No newline at end of file
@@ -1,55 +1,735 @@
+import asyncio
+import hashlib
 import json
+import logging
+import os
 import re
-from typing import List, Dict, Any, Optional
-from django.db.models import Q
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Iterator, NamedTuple, Optional, Tuple
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Q, Count, Max
 from django.conf import settings
+from django.utils import timezone
 from .models import KnowledgeBase, ChatMessage
+from .ann import ExactSearchIndex, IVFIndex, build_ann_index
+from .bm25 import BM25Encoder
+from .facets import FACET_FIELDS, FacetIndex
+from .intents import FALLBACK_SUGGESTIONS, shared_intent_engine
+from .languages import RAG_DEFAULT_LANGUAGE, analyzer_options, detect_language, normalize_language
+from .embeddings import EmbeddingService, SharedDenseIndex, shared_dense_index
+from .prompts import (
+    ELLIPSIS_TOKENS, LLM_MAX_RESPONSE_TOKENS, OLLAMA_NUM_CTX, PROMPT_CONTEXT_TOKENS, Prompt, PromptBuilder,
+    count_tokens, truncate_to_tokens
+)
+from .response_cache import RESPONSE_CACHE_ENABLED, ResponseCache, response_cache as shared_response_cache
+from .tracing import StageTimer
 import openai
 import ollama
 from decouple import config
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
+import joblib
+from scipy import sparse
 
-class RAGService:
-    """Retrieval-Augmented Generation service for knowledge base search"""
+logger = logging.getLogger(__name__)
+
+# How often (seconds) a worker re-checks the knowledge base for changes made
+# by other processes before reusing its cached index
+RAG_INDEX_CHECK_INTERVAL = config('RAG_INDEX_CHECK_INTERVAL', default=5.0, cast=float)
+
+# Refit the vocabulary once this fraction of rows were appended or removed
+# since the last fit, or once any change is older than the compaction interval
+RAG_INDEX_COMPACT_RATIO = config('RAG_INDEX_COMPACT_RATIO', default=0.2, cast=float)
+RAG_INDEX_COMPACT_INTERVAL = config('RAG_INDEX_COMPACT_INTERVAL', default=3600.0, cast=float)
+# A row's updated_at is set before its transaction commits, so syncs re-read
+# rows stamped this many seconds before the last sync to catch slow commits
+RAG_INDEX_SYNC_MARGIN = config('RAG_INDEX_SYNC_MARGIN', default=60.0, cast=float)
+
+# Bump whenever the on-disk layout written by KnowledgeIndex.save changes
+INDEX_ARTIFACT_VERSION = 5
+
+# 'tfidf', 'bm25', 'dense' (cosine similarity over KnowledgeBase.embedding)
+# or 'hybrid' (BM25 and dense rankings fused)
+RAG_SEARCH_MODE = config('RAG_SEARCH_MODE', default='tfidf')
+# Search mode used to pick the chunks packed into the LLM context window
+RAG_CONTEXT_SEARCH_MODE = config('RAG_CONTEXT_SEARCH_MODE', default='hybrid')
+
+# Hybrid retrieval: 'rrf' (reciprocal-rank fusion) or 'weighted' (weighted
+# sum of min-max normalised scores)
+RAG_FUSION = config('RAG_FUSION', default='rrf')
+RAG_RRF_K = config('RAG_RRF_K', default=60, cast=int)
+# Share of the fused score given to the dense ranking, the rest goes to BM25
+RAG_HYBRID_DENSE_WEIGHT = config('RAG_HYBRID_DENSE_WEIGHT', default=0.5, cast=float)
+# Candidates taken from each ranking before fusion
+RAG_HYBRID_CANDIDATES = config('RAG_HYBRID_CANDIDATES', default=20, cast=int)
+RAG_HYBRID_WORKERS = config('RAG_HYBRID_WORKERS', default=4, cast=int)
+
+# LLM calls this process keeps in flight against Ollama; further prompts queue
+OLLAMA_MAX_IN_FLIGHT = config('OLLAMA_MAX_IN_FLIGHT', default=2, cast=int)
+# Seconds a prompt may wait in the queue before it is given up on
+OLLAMA_QUEUE_TIMEOUT = config('OLLAMA_QUEUE_TIMEOUT', default=60.0, cast=float)
+# How long Ollama keeps the model (and its cached prompt prefix) loaded
+OLLAMA_KEEP_ALIVE = config('OLLAMA_KEEP_ALIVE', default='30m')
+
+# Circuit breakers: a backend is skipped for LLM_BREAKER_COOLDOWN seconds once
+# LLM_BREAKER_FAILURE_RATE of its last LLM_BREAKER_WINDOW calls failed
+LLM_BREAKER_WINDOW = config('LLM_BREAKER_WINDOW', default=20, cast=int)
+LLM_BREAKER_MIN_CALLS = config('LLM_BREAKER_MIN_CALLS', default=5, cast=int)
+LLM_BREAKER_FAILURE_RATE = config('LLM_BREAKER_FAILURE_RATE', default=0.5, cast=float)
+LLM_BREAKER_COOLDOWN = config('LLM_BREAKER_COOLDOWN', default=30.0, cast=float)
+# Start the next backend too once a call runs past the backend's p95 latency
+LLM_HEDGE_ENABLED = config('LLM_HEDGE_ENABLED', default=True, cast=bool)
+LLM_HEDGE_MIN_DELAY = config('LLM_HEDGE_MIN_DELAY', default=1.0, cast=float)
+# Threads running hedged calls: by default room for every in-flight generation
+# plus a hedge for each, so losing calls can't grow the pool under load
+LLM_HEDGE_WORKERS = config('LLM_HEDGE_WORKERS', default=OLLAMA_MAX_IN_FLIGHT * 2, cast=int)
+
+# Lexical scoring runs here while the request thread embeds the query
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=RAG_HYBRID_WORKERS,
+    thread_name_prefix='rag-retrieval'
+)
+
+
+def knowledge_base_fingerprint() -> tuple:
+    """Cheap summary of the knowledge base table that changes whenever rows do"""
+    stats = KnowledgeBase.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        last_updated=Max('updated_at'),
+        last_embedded=Max('embedded_at')
+    )
+    return (stats['total'], stats['active'], stats['last_updated'], stats['last_embedded'])
+
+
+def sync_window_start(synced_through):
+    """Earliest updated_at re-read by a sync of an index synced through ``synced_through``"""
+    return synced_through - timedelta(seconds=RAG_INDEX_SYNC_MARGIN)
+
+
+def in_sync_window(synced_through) -> bool:
+    """
+    Whether rows from transactions still committing may be missing from an
+    index synced through ``synced_through``. Their commit need not change
+    the fingerprint, so such an index is re-synced until the margin passes.
+    """
+    return synced_through is not None and timezone.now() - synced_through < timedelta(seconds=RAG_INDEX_SYNC_MARGIN)
+
+
+def reciprocal_rank_fusion(rankings, weights=None, k: int = RAG_RRF_K) -> List[Tuple[Dict[str, Any], float]]:
+    """
+    Fuse ranked (document, score) lists by summing ``weight / (k + rank)``.
     
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(
+    Only ranks are used, so scores on different scales (BM25, cosine) need
+    no calibration.
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, (doc, _) in enumerate(ranking, start=1):
+            entry = fused.setdefault(doc['id'], [doc, 0.0])
+            entry[1] += weight / (k + rank)
+    return sorted((tuple(entry) for entry in fused.values()), key=lambda item: -item[1])
+
+
+def weighted_score_fusion(rankings, weights=None) -> List[Tuple[Dict[str, Any], float]]:
+    """Fuse ranked (document, score) lists by a weighted sum of min-max normalised scores"""
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        if not ranking:
+            continue
+        scores = np.array([score for _, score in ranking], dtype=np.float64)
+        spread = scores.max() - scores.min()
+        normalised = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+        for (doc, _), score in zip(ranking, normalised):
+            entry = fused.setdefault(doc['id'], [doc, 0.0])
+            entry[1] += weight * score
+    return sorted((tuple(entry) for entry in fused.values()), key=lambda item: -item[1])
+
+
+FUSION_METHODS = {
+    'rrf': reciprocal_rank_fusion,
+    'weighted': weighted_score_fusion,
+}
+
+
+class LanguageIndex:
+    """
+    Fitted TF-IDF and BM25 matrices and document metadata for the active
+    knowledge base entries of one language.
+    
+    The vectorizer uses that language's analyzer (see chatbot.languages).
+    Instances are never mutated once published: incremental changes produce a
+    new index that shares the fitted vectorizer, appends rows for new or
+    edited entries and masks out rows of removed ones. Rows appended this way
+    are weighted with the vocabulary of the last full fit until compaction.
+    """
+    
+    DOCUMENT_FIELDS = ('id', 'title', 'content', *FACET_FIELDS)
+    
+    def __init__(
+        self,
+        language,
+        vectorizer,
+        vectors,
+        documents,
+        live=None,
+        fitted_rows=None,
+        built_at=None,
+        positions=None,
+        ann=None,
+        facets=None,
+        bm25_encoder=None,
+        bm25=None
+    ):
+        self.language = language
+        self.vectorizer = vectorizer
+        self.vectors = vectors
+        self.bm25_encoder = bm25_encoder
+        self.bm25 = bm25
+        self.ann = ann if ann is not None else build_ann_index(vectors)
+        self.facets = facets if facets is not None else FacetIndex.from_documents(documents)
+        self.documents = documents
+        self.live = live if live is not None else np.ones(len(documents), dtype=bool)
+        self.fitted_rows = len(documents) if fitted_rows is None else fitted_rows
+        self.built_at = built_at or time.time()
+        if positions is None:
+            positions = {doc['id']: i for i, doc in enumerate(documents) if self.live[i]}
+        self.positions = positions
+    
+    @staticmethod
+    def create_vectorizer(language: str) -> TfidfVectorizer:
+        return TfidfVectorizer(
             max_features=1000,
-            stop_words='english',
-            ngram_range=(1, 2)
-        )
-        self._knowledge_vectors = None
-        self._knowledge_documents = None
-        self._last_update = None
-    
-    def _update_knowledge_vectors(self):
-        """Update the vectorized knowledge base"""
-        documents = KnowledgeBase.objects.filter(is_active=True).values(
-            'id', 'title', 'content', 'content_type', 'source_type'
+            ngram_range=(1, 2),
+            **analyzer_options(language)
         )
+    
+    @staticmethod
+    def document_text(doc: Dict[str, Any]) -> str:
+        # Combine title and content for better search
+        return f"{doc['title']} {doc['content']}"
+    
+    @classmethod
+    def from_documents(cls, language: str, documents) -> 'LanguageIndex':
+        vectorizer = cls.create_vectorizer(language)
         
         if not documents:
-            self._knowledge_vectors = None
-            self._knowledge_documents = []
-            return
+            return cls(language, vectorizer, None, [])
         
-        # Combine title and content for better search
-        texts = []
-        doc_list = list(documents)
+        texts = [cls.document_text(doc) for doc in documents]
+        try:
+            vectors = vectorizer.fit_transform(texts)
+        except ValueError:
+            # Every term was a stop word, nothing to index
+            return cls(language, vectorizer, None, [])
+        # BM25 shares the TF-IDF vocabulary so both rankings see the same terms
+        bm25_encoder, bm25 = BM25Encoder.fit(vectorizer, texts)
+        return cls(language, vectorizer, vectors, documents, bm25_encoder=bm25_encoder, bm25=bm25)
+    
+    def write(self, directory: Path) -> Dict[str, Any]:
+        """Write the partition's files to ``directory``, returns its manifest entry"""
+        # Masked rows are dropped so the artifact is always compact
+        rows = np.flatnonzero(self.live)
+        documents = [self.documents[i] for i in rows]
+        if self.vectors is not None:
+            vectors = self.vectors[rows].tocsr()
+            bm25 = self.bm25[rows].tocsr()
+        else:
+            vectors = bm25 = sparse.csr_matrix((0, 0))
+        ann = self.ann.subset(rows)
         
-        for doc in doc_list:
-            combined_text = f"{doc['title']} {doc['content']}"
-            texts.append(combined_text)
+        np.save(directory / 'data.npy', vectors.data)
+        np.save(directory / 'indices.npy', vectors.indices)
+        np.save(directory / 'indptr.npy', vectors.indptr)
+        np.save(directory / 'bm25_data.npy', bm25.data)
+        np.save(directory / 'bm25_indices.npy', bm25.indices)
+        np.save(directory / 'bm25_indptr.npy', bm25.indptr)
+        joblib.dump(self.vectorizer, directory / 'vectorizer.joblib')
+        joblib.dump(self.bm25_encoder, directory / 'bm25_encoder.joblib')
+        ann.save(directory)
+        with open(directory / 'documents.json', 'w', encoding='utf-8') as f:
+            json.dump(documents, f, ensure_ascii=False)
         
-        # Vectorize the documents
-        if texts:
-            self._knowledge_vectors = self.vectorizer.fit_transform(texts)
-            self._knowledge_documents = doc_list
-        else:
-            self._knowledge_vectors = None
-            self._knowledge_documents = []
+        return {
+            'built_at': self.built_at,
+            'shape': list(vectors.shape),
+            'fitted': self.vectors is not None,
+            'ann': ann.name,
+        }
+    
+    @classmethod
+    def read(cls, language: str, directory: Path, manifest: Dict[str, Any]) -> 'LanguageIndex':
+        """Read a partition written by ``write``, memory-mapping its matrices"""
+        vectorizer = joblib.load(directory / 'vectorizer.joblib')
+        bm25_encoder = joblib.load(directory / 'bm25_encoder.joblib')
+        with open(directory / 'documents.json', encoding='utf-8') as f:
+            documents = json.load(f)
+        
+        vectors = bm25 = None
+        if manifest['fitted']:
+            vectors, bm25 = (
+                sparse.csr_matrix(
+                    (
+                        np.load(directory / f'{prefix}data.npy', mmap_mode='r'),
+                        np.load(directory / f'{prefix}indices.npy', mmap_mode='r'),
+                        np.load(directory / f'{prefix}indptr.npy', mmap_mode='r'),
+                    ),
+                    shape=tuple(manifest['shape']),
+                    copy=False
+                )
+                for prefix in ('', 'bm25_')
+            )
+        
+        # Reuse the stored clustering instead of refitting it on every boot
+        ann = IVFIndex.load(directory) if manifest.get('ann') == IVFIndex.name else None
+        
+        return cls(
+            language, vectorizer, vectors, documents,
+            built_at=manifest['built_at'],
+            ann=ann,
+            bm25_encoder=bm25_encoder,
+            bm25=bm25
+        )
+    
+    def apply_changes(self, upserts=(), removed_ids=()) -> 'LanguageIndex':
+        """Return a new index with entries added/replaced and others removed"""
+        live = self.live.copy()
+        positions = self.positions.copy()
+        for doc_id in removed_ids:
+            position = positions.pop(doc_id, None)
+            if position is not None:
+                live[position] = False
+        
+        appended = {}
+        for doc in upserts:
+            doc = {field: doc[field] for field in self.DOCUMENT_FIELDS}
+            position = positions.get(doc['id'])
+            if position is not None:
+                if self.documents[position] == doc:
+                    continue
+                live[position] = False
+            appended[doc['id']] = doc
+        
+        if not appended:
+            if len(positions) == len(self.positions):
+                # Nothing removed either, keep sharing this index
+                return self
+            return self._derive(self.vectors, self.documents, live, positions)
+        
+        new_documents = list(appended.values())
+        if self.vectors is None:
+            # Nothing fitted yet, so there is no vocabulary to extend
+            documents = [doc for i, doc in enumerate(self.documents) if live[i]]
+            return self.from_documents(self.language, documents + new_documents)
+        
+        new_texts = [self.document_text(doc) for doc in new_documents]
+        new_vectors = self.vectorizer.transform(new_texts)
+        for offset, doc in enumerate(new_documents):
+            positions[doc['id']] = len(self.documents) + offset
+        return self._derive(
+            sparse.vstack([self.vectors, new_vectors], format='csr'),
+            self.documents + new_documents,
+            np.concatenate([live, np.ones(len(new_documents), dtype=bool)]),
+            positions,
+            self.ann.extend(new_vectors),
+            self.facets.extend(new_documents),
+            sparse.vstack([self.bm25, self.bm25_encoder.transform_documents(new_texts)], format='csr')
+        )
+    
+    def _derive(self, vectors, documents, live, positions, ann=None, facets=None, bm25=None) -> 'LanguageIndex':
+        return LanguageIndex(
+            self.language, self.vectorizer, vectors, documents,
+            live=live,
+            fitted_rows=self.fitted_rows,
+            built_at=self.built_at,
+            positions=positions,
+            ann=ann or self.ann,
+            facets=facets or self.facets,
+            bm25_encoder=self.bm25_encoder,
+            bm25=bm25 if bm25 is not None else self.bm25
+        )
+    
+    @property
+    def pending_changes(self) -> int:
+        """Rows appended or masked out since the vocabulary was last fitted"""
+        appended = len(self.documents) - self.fitted_rows
+        removed = int(self.fitted_rows - self.live[:self.fitted_rows].sum())
+        return appended + removed
+    
+    def needs_compaction(self) -> bool:
+        pending = self.pending_changes
+        if not pending:
+            return False
+        if pending >= max(self.fitted_rows, 1) * RAG_INDEX_COMPACT_RATIO:
+            return True
+        return time.time() - self.built_at >= RAG_INDEX_COMPACT_INTERVAL
+    
+    def __len__(self):
+        return len(self.positions)
+
+
+class KnowledgeIndex:
+    """
+    Lexical index over the active knowledge base, partitioned by language.
+    
+    Each entry lives in the LanguageIndex of its ``language``, so Arabic and
+    French entries get their own analyzer and vocabulary instead of being
+    tokenised as English, and a query is only scored against one partition
+    (see ``route``). Like its partitions, an instance is never mutated once
+    published.
+    """
+    
+    DOCUMENT_FIELDS = LanguageIndex.DOCUMENT_FIELDS
+    
+    def __init__(self, partitions: Dict[str, LanguageIndex], fingerprint=None, synced_through=None):
+        self.partitions = partitions
+        self.fingerprint = fingerprint
+        self.synced_through = synced_through
+        # Entry id -> language of the partition holding it
+        self.positions = {
+            doc_id: language
+            for language, partition in partitions.items()
+            for doc_id in partition.positions
+        }
+    
+    @classmethod
+    def build(cls, fingerprint=None) -> 'KnowledgeIndex':
+        """Read every active entry and fit a fresh vectorizer per language"""
+        documents = list(
+            KnowledgeBase.objects.filter(is_active=True).values(*cls.DOCUMENT_FIELDS)
+        )
+        synced_through = fingerprint[2] if fingerprint else None
+        return cls.from_documents(documents, fingerprint, synced_through)
+    
+    @classmethod
+    def from_documents(cls, documents, fingerprint=None, synced_through=None) -> 'KnowledgeIndex':
+        by_language = {}
+        for doc in documents:
+            by_language.setdefault(normalize_language(doc['language']), []).append(doc)
+        partitions = {
+            language: LanguageIndex.from_documents(language, language_documents)
+            for language, language_documents in by_language.items()
+        }
+        return cls(partitions, fingerprint, synced_through)
+    
+    def partition(self, language: Optional[str]) -> Optional[LanguageIndex]:
+        return self.partitions.get(normalize_language(language))
+    
+    def route(self, query: str, language: Optional[str] = None) -> Optional[LanguageIndex]:
+        """
+        Partition ``query`` is scored against.
+        
+        An explicit ``language`` filter is honoured as is. Otherwise the query
+        language is detected, falling back to RAG_DEFAULT_LANGUAGE when there
+        are no entries in the detected language.
+        """
+        if language:
+            return self.partition(language)
+        partition = self.partition(detect_language(query))
+        if partition is None or not len(partition):
+            partition = self.partition(RAG_DEFAULT_LANGUAGE)
+        return partition
+    
+    def save(self, directory, keep: int = 2) -> Path:
+        """
+        Write the index as a versioned artifact under ``directory``.
+        
+        Each build goes to its own sub-directory, with one directory per
+        language partition, and the ``CURRENT`` pointer is swapped atomically,
+        so workers never see a half-written artifact and workers still mapping
+        an older build keep valid pages. Only the last ``keep`` builds are
+        kept on disk.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        
+        build_dir = directory / f"v{INDEX_ARTIFACT_VERSION}-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        build_dir.mkdir()
+        partitions = {}
+        for language, partition in self.partitions.items():
+            partition_dir = build_dir / language
+            partition_dir.mkdir()
+            partitions[language] = partition.write(partition_dir)
+        
+        manifest = {
+            'format_version': INDEX_ARTIFACT_VERSION,
+            'fingerprint': [
+                value.isoformat() if isinstance(value, datetime) else value
+                for value in self.fingerprint or ()
+            ],
+            'partitions': partitions,
+        }
+        with open(build_dir / 'manifest.json', 'w') as f:
+            json.dump(manifest, f)
+        
+        pointer = directory / f'.CURRENT.{uuid.uuid4().hex[:8]}'
+        pointer.write_text(build_dir.name)
+        os.replace(pointer, directory / 'CURRENT')
+        
+        builds = sorted(
+            (path for path in directory.glob(f'v{INDEX_ARTIFACT_VERSION}-*') if path.is_dir()),
+            key=lambda path: path.stat().st_mtime
+        )
+        for stale in builds[:-keep]:
+            shutil.rmtree(stale, ignore_errors=True)
+        
+        return build_dir
+    
+    @classmethod
+    def load(cls, directory) -> Optional['KnowledgeIndex']:
+        """
+        Load the current artifact under ``directory``, memory-mapping the matrices.
+        
+        The sparse matrix arrays are mapped read-only, so every worker on the
+        host shares the same page cache instead of holding its own copy.
+        Returns None if there is no usable artifact.
+        """
+        directory = Path(directory)
+        try:
+            build_dir = directory / (directory / 'CURRENT').read_text().strip()
+            with open(build_dir / 'manifest.json') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if manifest.get('format_version') != INDEX_ARTIFACT_VERSION:
+            return None
+        
+        # Counts stay ints, timestamps were written as ISO strings
+        fingerprint = tuple(
+            datetime.fromisoformat(value) if isinstance(value, str) else value
+            for value in manifest['fingerprint']
+        ) or None
+        
+        partitions = {
+            language: LanguageIndex.read(language, build_dir / language, partition)
+            for language, partition in manifest['partitions'].items()
+        }
+        return cls(partitions, fingerprint, synced_through=fingerprint[2] if fingerprint else None)
+    
+    def apply_changes(self, upserts=(), removed_ids=()) -> 'KnowledgeIndex':
+        """Return a new index with entries added/replaced and others removed"""
+        removed = {}
+        for doc_id in removed_ids:
+            language = self.positions.get(doc_id)
+            if language is not None:
+                removed.setdefault(language, []).append(doc_id)
+        
+        added = {}
+        for doc in upserts:
+            language = normalize_language(doc['language'])
+            previous = self.positions.get(doc['id'])
+            if previous is not None and previous != language:
+                # The entry's language changed, move it to its new partition
+                removed.setdefault(previous, []).append(doc['id'])
+            added.setdefault(language, []).append(doc)
+        
+        partitions = dict(self.partitions)
+        for language in removed.keys() | added.keys():
+            partition = partitions.get(language)
+            if partition is None:
+                partitions[language] = LanguageIndex.from_documents(language, added[language])
+            else:
+                partitions[language] = partition.apply_changes(added.get(language, ()), removed.get(language, ()))
+        if partitions == self.partitions:
+            # No partition changed, keep sharing this index
+            return self
+        return KnowledgeIndex(partitions, self.fingerprint, self.synced_through)
+    
+    @property
+    def pending_changes(self) -> int:
+        return sum(partition.pending_changes for partition in self.partitions.values())
+    
+    def needs_compaction(self) -> bool:
+        return any(partition.needs_compaction() for partition in self.partitions.values())
+    
+    def __len__(self):
+        return len(self.positions)
+
+class SharedKnowledgeIndex:
+    """
+    Process-wide holder for the knowledge base index.
+    
+    The index is fitted once and reused by every request served by this
+    process, starting from the on-disk artifact in RAG_INDEX_DIR when one
+    exists (see the build_knowledge_index command) so worker boot does not
+    refit. Changes made in this process are applied incrementally through
+    KnowledgeBase signals; changes made by other workers are picked up by
+    comparing the knowledge base fingerprint, checked at most every
+    RAG_INDEX_CHECK_INTERVAL seconds, and syncing only the rows that changed.
+    Once enough incremental changes pile up the vocabulary is refitted in a
+    background thread while searches keep using the current index.
+    """
+    
+    def __init__(
+        self,
+        check_interval: float = RAG_INDEX_CHECK_INTERVAL,
+        compact_in_background: bool = True,
+        artifact_dir=None
+    ):
+        self.check_interval = check_interval
+        self.compact_in_background = compact_in_background
+        self.artifact_dir = artifact_dir
+        self._index = None
+        self._checked_at = 0.0
+        self._compacting = False
+        self._lock = threading.Lock()
+    
+    def get(self) -> KnowledgeIndex:
+        index = self._index
+        if index is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return index
+        
+        with self._lock:
+            # Another thread may have refreshed the index while we waited
+            if self._index is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._index
+            
+            fingerprint = knowledge_base_fingerprint()
+            if self._index is None:
+                self._index = self._load_artifact() or KnowledgeIndex.build(fingerprint)
+            if self._index.fingerprint != fingerprint or in_sync_window(self._index.synced_through):
+                self._index = self._sync(self._index, fingerprint)
+            self._checked_at = time.monotonic()
+            index = self._index
+        
+        if self._maybe_compact(index):
+            # Compaction ran inline, hand out the refitted index
+            index = self._index or index
+        return index
+    
+    def _sync(self, index: KnowledgeIndex, fingerprint: tuple) -> KnowledgeIndex:
+        """Bring the index up to date with rows changed since it was last synced"""
+        changed = KnowledgeBase.objects.all()
+        if index.synced_through is not None:
+            changed = changed.filter(updated_at__gte=sync_window_start(index.synced_through))
+        
+        upserts = []
+        removed_ids = []
+        for row in changed.values(*KnowledgeIndex.DOCUMENT_FIELDS, 'is_active'):
+            if row['is_active']:
+                upserts.append(row)
+            else:
+                removed_ids.append(row['id'])
+        
+        # Deleted rows leave no trace behind, so diff the active ids
+        active_ids = set(
+            KnowledgeBase.objects.filter(is_active=True).values_list('id', flat=True)
+        )
+        removed_ids.extend(doc_id for doc_id in index.positions if doc_id not in active_ids)
+        
+        synced = index.apply_changes(upserts, removed_ids)
+        if synced is index:
+            if index.fingerprint == fingerprint:
+                # Nothing changed, e.g. a re-read within the sync margin
+                return index
+            synced = KnowledgeIndex(index.partitions, index.fingerprint, index.synced_through)
+        synced.fingerprint = fingerprint
+        synced.synced_through = fingerprint[2]
+        return synced
+    
+    def _load_artifact(self) -> Optional[KnowledgeIndex]:
+        directory = self.artifact_dir or getattr(settings, 'RAG_INDEX_DIR', None)
+        if not directory:
+            return None
+        try:
+            return KnowledgeIndex.load(directory)
+        except Exception:
+            logger.exception("Could not load knowledge index artifact from %s", directory)
+            return None
+    
+    def apply_changes(self, upserts=(), removed_ids=()):
+        """Apply knowledge base changes made in this process to the index"""
+        with self._lock:
+            if self._index is None:
+                # Nothing built yet; the next lookup reads the current rows
+                return
+            self._index = self._index.apply_changes(upserts, removed_ids)
+            index = self._index
+        self._maybe_compact(index)
+    
+    def _maybe_compact(self, index: KnowledgeIndex) -> bool:
+        """Start compaction if needed, returns True if it already finished"""
+        if self._compacting or not index.needs_compaction():
+            return False
+        self._compacting = True
+        if not self.compact_in_background:
+            self.compact()
+            return True
+        threading.Thread(
+            target=self._compact_in_thread,
+            name='knowledge-index-compaction',
+            daemon=True
+        ).start()
+        return False
+    
+    def _compact_in_thread(self):
+        try:
+            self.compact()
+        finally:
+            connections.close_all()
+    
+    def compact(self):
+        """Refit the vocabulary over the current knowledge base and swap it in"""
+        self._compacting = True
+        try:
+            fingerprint = knowledge_base_fingerprint()
+            # Prefer a freshly built artifact so workers keep sharing its pages
+            index = self._load_artifact()
+            if index is None or index.fingerprint != fingerprint:
+                index = KnowledgeIndex.build(fingerprint)
+            with self._lock:
+                self._index = index
+                # Changes committed while we were fitting are caught by the next sync
+                self._checked_at = 0.0
+        except Exception:
+            logger.exception("Knowledge index compaction failed")
+        finally:
+            self._compacting = False
+    
+    def invalidate(self):
+        """Force the next lookup to re-check the knowledge base for changes"""
+        self._checked_at = 0.0
+    
+    def clear(self):
+        """Drop the cached index entirely"""
+        with self._lock:
+            self._index = None
+            self._checked_at = 0.0
+
+
+shared_knowledge_index = SharedKnowledgeIndex()
+
+
+class RAGService:
+    """Retrieval-Augmented Generation service for knowledge base search"""
+    
+    def __init__(
+        self,
+        index_provider: Optional[SharedKnowledgeIndex] = None,
+        dense_index_provider: Optional[SharedDenseIndex] = None,
+        embedding_service: Optional[EmbeddingService] = None
+    ):
+        self.index_provider = index_provider or shared_knowledge_index
+        self.dense_index_provider = dense_index_provider or shared_dense_index
+        self._embedding_service = embedding_service
+    
+    @property
+    def embedding_service(self) -> EmbeddingService:
+        if self._embedding_service is None:
+            self._embedding_service = EmbeddingService()
+        return self._embedding_service
     
     def search_knowledge_base(
         self, 
@@ -57,306 +737,1027 @@ class RAGService:
         content_type: Optional[str] = None,
         source_type: Optional[str] = None,
         limit: int = 5,
-        min_similarity: float = 0.1
+        min_similarity: float = 0.1,
+        mode: Optional[str] = None,
+        language: Optional[str] = None,
+        province_id: Optional[int] = None
     ) -> List[Dict[str, Any]]:
-        """Search the knowledge base using TF-IDF similarity"""
+        """
+        Search the knowledge base.
+        
+        ``mode`` (default RAG_SEARCH_MODE) is 'tfidf', 'bm25', 'dense' for
+        cosine similarity over stored embeddings, or 'hybrid' which fuses the
+        BM25 and dense rankings. Dense retrieval falls back to lexical search
+        while no embeddings exist for the configured model. Results can be
+        filtered by content type, source type, language and province.
+        """
+        filters = {
+            'content_type': content_type,
+            'source_type': source_type,
+            'language': language,
+            'related_province_id': province_id,
+        }
+        mode = mode or RAG_SEARCH_MODE
+        if mode == 'hybrid':
+            return self._hybrid_search(query, filters, limit, min_similarity)
+        if mode == 'dense':
+            results = self._dense_search(query, filters, limit, min_similarity)
+            if results is not None:
+                return results
+        if mode == 'bm25':
+            ranking = self._lexical_ranking(self.index_provider.get(), query, filters, limit, 'bm25')
+            return [self._format_result(doc, score) for doc, score in ranking]
+        return self._tfidf_search(query, filters, limit, min_similarity)
+    
+    @staticmethod
+    def _format_result(doc: Dict[str, Any], similarity: float) -> Dict[str, Any]:
+        return {
+            'id': doc['id'],
+            'title': doc['title'],
+            'content': doc['content'][:500] + '...' if len(doc['content']) > 500 else doc['content'],
+            'content_type': doc['content_type'],
+            'source_type': doc['source_type'],
+            'similarity_score': float(similarity)
+        }
+    
+    def _get_dense_index(self):
+        """Dense index for the configured model, None while it is unavailable"""
+        try:
+            index = self.dense_index_provider.get(self.embedding_service.model_name)
+        except Exception as e:
+            logger.warning("Dense search unavailable, using lexical search: %s", e)
+            return None
+        return index if len(index) else None
+    
+    def _dense_ranking(
+        self,
+        index,
+        query: str,
+        filters: Dict[str, Any],
+        limit: int,
+        min_similarity: float
+    ) -> List[Tuple[Dict[str, Any], float]]:
+        """Vectorised cosine top-k over the dense index as (document, similarity)"""
+        mask = index.live
+        facet_mask = index.facets.mask(**filters)
+        if facet_mask is not None:
+            mask = mask & facet_mask
+        if not mask.any():
+            return []
         
-        # Update vectors if needed
-        if self._knowledge_vectors is None or not self._knowledge_documents:
-            self._update_knowledge_vectors()
+        query_vector = self.embedding_service.embed_query(query)
+        top_indices, similarities = index.ann.search(index.matrix, query_vector, limit, mask)
         
-        if not self._knowledge_documents:
+        return [
+            (index.documents[idx], similarity)
+            for idx, similarity in zip(top_indices, similarities)
+            if similarity >= min_similarity
+        ]
+    
+    def _dense_search(
+        self,
+        query: str,
+        filters: Dict[str, Any],
+        limit: int,
+        min_similarity: float
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Dense search results, None if dense search is unavailable"""
+        index = self._get_dense_index()
+        if index is None:
+            return None
+        try:
+            ranking = self._dense_ranking(index, query, filters, limit, min_similarity)
+        except Exception as e:
+            logger.warning("Dense search unavailable, using TF-IDF: %s", e)
+            return None
+        return [self._format_result(doc, similarity) for doc, similarity in ranking]
+    
+    @staticmethod
+    def _lexical_ranking(
+        index: KnowledgeIndex,
+        query: str,
+        filters: Dict[str, Any],
+        limit: int,
+        scorer: str = 'tfidf',
+        min_score: float = 0.0
+    ) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Top-k over the lexical index as (document, score).
+        
+        Only the partition of the query's language is scored (see
+        KnowledgeIndex.route). ``scorer`` is 'tfidf' (cosine similarity) or
+        'bm25'; only rows scoring above ``min_score`` are returned. Works on
+        an index snapshot without touching the database, so it is safe to run
+        in a worker thread.
+        """
+        index = index.route(query, filters.get('language'))
+        if index is None or not len(index):
             return []
         
-        # Filter documents by content_type and source_type if specified
-        filtered_docs = self._knowledge_documents.copy()
-        if content_type:
-            filtered_docs = [doc for doc in filtered_docs if doc['content_type'] == content_type]
-        if source_type:
-            filtered_docs = [doc for doc in filtered_docs if doc['source_type'] == source_type]
+        # Precomputed facet codes turn the filters into one vectorised mask
+        mask = index.live
+        facet_mask = index.facets.mask(**filters)
+        if facet_mask is not None:
+            mask = mask & facet_mask
         
-        if not filtered_docs:
+        if not mask.any():
             return []
         
-        # Get indices of filtered documents
-        filtered_indices = [i for i, doc in enumerate(self._knowledge_documents) if doc in filtered_docs]
+        # Vectorize the query and score it through the nearest-neighbour index
+        if scorer == 'bm25':
+            # IVF clusters are fitted on the TF-IDF rows, so probing them would
+            # pick BM25 candidates in the wrong space; the sparse scan is cheap
+            top_indices, scores = ExactSearchIndex().search(
+                index.bm25, index.bm25_encoder.transform_query(query), limit, mask
+            )
+        else:
+            top_indices, scores = index.ann.search(index.vectors, index.vectorizer.transform([query]), limit, mask)
         
-        # Vectorize the query
-        query_vector = self.vectorizer.transform([query])
+        return [
+            (index.documents[idx], score)
+            for idx, score in zip(top_indices, scores)
+            if score > min_score
+        ]
+    
+    def _tfidf_search(
+        self,
+        query: str,
+        filters: Dict[str, Any],
+        limit: int,
+        min_similarity: float
+    ) -> List[Dict[str, Any]]:
+        """Search the knowledge base using TF-IDF similarity"""
         
-        # Calculate similarities
-        similarities = cosine_similarity(query_vector, self._knowledge_vectors[filtered_indices]).flatten()
+        # Take a single snapshot so a concurrent rebuild can't mix indexes
+        index = self.index_provider.get()
+        ranking = self._lexical_ranking(index, query, filters, limit, 'tfidf')
+        return [
+            self._format_result(doc, similarity)
+            for doc, similarity in ranking
+            if similarity >= min_similarity
+        ]
+    
+    def _hybrid_search(
+        self,
+        query: str,
+        filters: Dict[str, Any],
+        limit: int,
+        min_similarity: float
+    ) -> List[Dict[str, Any]]:
+        """
+        BM25 and dense retrieval run in parallel and fused into one ranking.
         
-        # Get top results
-        top_indices = similarities.argsort()[-limit:][::-1]
+        Both index snapshots are taken up front on the request thread, then
+        BM25 scoring runs on the retrieval pool while this thread embeds the
+        query and scores the dense index. ``min_similarity`` applies to the
+        dense ranking only; the returned score is the fused score.
+        """
+        index = self.index_provider.get()
+        dense_index = self._get_dense_index()
+        depth = max(limit, RAG_HYBRID_CANDIDATES)
         
-        results = []
-        for idx in top_indices:
-            similarity = similarities[idx]
-            if similarity >= min_similarity:
-                doc_idx = filtered_indices[idx]
-                doc = self._knowledge_documents[doc_idx]
-                results.append({
-                    'id': doc['id'],
-                    'title': doc['title'],
-                    'content': doc['content'][:500] + '...' if len(doc['content']) > 500 else doc['content'],
-                    'content_type': doc['content_type'],
-                    'source_type': doc['source_type'],
-                    'similarity_score': float(similarity),
-                    'tags': doc['tags']
-                })
+        if dense_index is None:
+            ranking = self._lexical_ranking(index, query, filters, limit, 'bm25')
+            return [self._format_result(doc, score) for doc, score in ranking]
         
-        return results
+        lexical_future = retrieval_executor.submit(
+            self._lexical_ranking, index, query, filters, depth, 'bm25'
+        )
+        try:
+            dense_ranking = self._dense_ranking(dense_index, query, filters, depth, min_similarity)
+        except Exception as e:
+            logger.warning("Dense search unavailable, using BM25 only: %s", e)
+            dense_ranking = []
+        lexical_ranking = lexical_future.result()
+        
+        fuse = FUSION_METHODS[RAG_FUSION]
+        fused = fuse(
+            [lexical_ranking, dense_ranking],
+            [1 - RAG_HYBRID_DENSE_WEIGHT, RAG_HYBRID_DENSE_WEIGHT]
+        )
+        return [self._format_result(doc, score) for doc, score in fused[:limit]]
     
-    def get_relevant_context(self, query: str, max_context_length: int = 2000) -> str:
-        """Get relevant context for the query"""
-        results = self.search_knowledge_base(query, limit=3)
+    def get_relevant_context(self, query: str, max_context_tokens: int = PROMPT_CONTEXT_TOKENS) -> str:
+        """Get relevant context for the query, packed into a token budget"""
+        results = self.search_knowledge_base(query, limit=3, mode=RAG_CONTEXT_SEARCH_MODE)
         
         context_parts = []
-        current_length = 0
+        current_tokens = 0
         
         for result in results:
             content = f"Title: {result['title']}\nContent: {result['content']}\n\n"
-            if current_length + len(content) <= max_context_length:
+            tokens = count_tokens(content)
+            if current_tokens + tokens <= max_context_tokens:
                 context_parts.append(content)
-                current_length += len(content)
+                current_tokens += tokens
             else:
                 # Add partial content if it fits
-                remaining_space = max_context_length - current_length
-                if remaining_space > 100:  # Only add if there's meaningful space
-                    partial_content = content[:remaining_space-3] + "..."
+                remaining_tokens = max_context_tokens - current_tokens
+                if remaining_tokens > 25:  # Only add if there's meaningful space
+                    partial_content = truncate_to_tokens(content, remaining_tokens - ELLIPSIS_TOKENS) + "..."
                     context_parts.append(partial_content)
                 break
         
         return "\n".join(context_parts)
 
+class GenerationQueueTimeout(Exception):
+    """A prompt waited longer than the queue timeout for a free generation slot"""
+
+
+class GenerationAbandoned(Exception):
+    """The shared call a coalesced prompt was waiting on was cancelled"""
+
+
+class GenerationScheduler:
+    """
+    Queues LLM calls made by this process against a single model server.
+    
+    At most ``max_in_flight`` calls run at once and the rest wait for a slot,
+    so a burst of chats queues up instead of overloading Ollama into timeouts.
+    Identical prompts submitted while one is already queued or running share
+    that call's result. Queue depth and wait times are exposed by ``metrics``.
+    """
+    
+    def __init__(self, max_in_flight: int = OLLAMA_MAX_IN_FLIGHT, queue_timeout: float = OLLAMA_QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiting = 0
+        self.reset_metrics()
+    
+    @staticmethod
+    def prompt_key(*parts) -> str:
+        """Stable key for coalescing, built from everything that shapes the output"""
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        """Future for ``key`` and whether the caller has to make the call"""
+        with self._lock:
+            self._submitted += 1
+            future = self._pending.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return future, False
+            future = Future()
+            self._pending[key] = future
+            return future, True
+    
+    def _settle(self, key: str, future: Future, result=None, error: Optional[BaseException] = None):
+        with self._lock:
+            self._pending.pop(key, None)
+        if error is not None and not isinstance(error, Exception):
+            # The leader was cancelled or interrupted, not the prompts that
+            # joined it; give those an error they handle like a failed call
+            error = GenerationAbandoned(f"Shared call was abandoned: {error!r}")
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def _enqueue(self) -> float:
+        with self._lock:
+            self._waiting += 1
+        return time.monotonic()
+    
+    def _dequeue(self, enqueued_at: float, acquired: bool):
+        wait = time.monotonic() - enqueued_at
+        with self._lock:
+            self._waiting -= 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            if acquired:
+                self._in_flight += 1
+                self._started += 1
+            else:
+                self._timeouts += 1
+        if not acquired:
+            raise GenerationQueueTimeout(f"No generation slot free after {wait:.1f}s")
+    
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+    
+    def _acquire(self):
+        enqueued_at = self._enqueue()
+        self._dequeue(enqueued_at, self._slots.acquire(timeout=self.queue_timeout))
+    
+    async def _aacquire(self):
+        # Poll instead of blocking so waiting chats don't stall the event loop
+        enqueued_at = self._enqueue()
+        deadline = enqueued_at + self.queue_timeout
+        acquired = self._slots.acquire(blocking=False)
+        try:
+            while not acquired and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                acquired = self._slots.acquire(blocking=False)
+        except BaseException:
+            # Cancelled while waiting: leave the queue without taking a slot
+            with self._lock:
+                self._waiting -= 1
+            raise
+        self._dequeue(enqueued_at, acquired)
+    
+    @contextmanager
+    def slot(self):
+        """Hold a generation slot, e.g. for the length of a streamed response"""
+        self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+    
+    def run(self, key: str, call):
+        """Run ``call()`` in a generation slot, sharing the result for identical keys"""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            with self.slot():
+                result = call()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result
+    
+    async def arun(self, key: str, call):
+        """Async variant of ``run`` where ``call()`` returns an awaitable"""
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            await self._aacquire()
+            try:
+                result = await call()
+            finally:
+                self._release()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result
+    
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            waited = self._started + self._timeouts
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self._in_flight,
+                'queue_depth': self._waiting,
+                'submitted': self._submitted,
+                'coalesced': self._coalesced,
+                'started': self._started,
+                'queue_timeouts': self._timeouts,
+                'average_wait_ms': self._wait_total / waited * 1000 if waited else 0.0,
+                'max_wait_ms': self._wait_max * 1000,
+            }
+    
+    def reset_metrics(self):
+        """Zero the cumulative counters; in-flight and queued gauges are kept"""
+        with self._lock:
+            self._submitted = 0
+            self._coalesced = 0
+            self._started = 0
+            self._timeouts = 0
+            self._wait_total = 0.0
+            self._wait_max = 0.0
+
+
+generation_scheduler = GenerationScheduler()
+
+
+class CircuitBreaker:
+    """
+    Rolling error and latency window for one LLM backend.
+    
+    The circuit opens once at least ``min_calls`` calls were recorded and
+    ``failure_rate`` of the window failed. While open, requests are refused
+    without touching the backend; after ``cooldown`` seconds a single probe is
+    let through, closing the circuit on success and reopening it on failure.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(
+        self,
+        name: str,
+        window: int = LLM_BREAKER_WINDOW,
+        min_calls: int = LLM_BREAKER_MIN_CALLS,
+        failure_rate: float = LLM_BREAKER_FAILURE_RATE,
+        cooldown: float = LLM_BREAKER_COOLDOWN
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self._calls = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                return self.HALF_OPEN
+            return self._state
+    
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+    
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self._state = self.HALF_OPEN
+                self._probing = False
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+    
+    def record_success(self, latency: float):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                # Failures from before the outage no longer say anything
+                self._calls.clear()
+                self._state = self.CLOSED
+                self._probing = False
+            self._calls.append((True, latency))
+    
+    def record_failure(self, latency: float):
+        with self._lock:
+            self._calls.append((False, latency))
+            if self._state == self.HALF_OPEN:
+                self._open()
+            elif self._state == self.CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(1 for succeeded, _ in self._calls if not succeeded)
+                if failures >= self.failure_rate * len(self._calls):
+                    self._open()
+    
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+        logger.warning("Circuit for %s opened", self.name)
+    
+    def p95_latency(self) -> Optional[float]:
+        """p95 of recent successful calls, None until there are enough of them"""
+        with self._lock:
+            latencies = [latency for succeeded, latency in self._calls if succeeded]
+        if len(latencies) < self.min_calls:
+            return None
+        return float(np.percentile(latencies, 95))
+    
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self._calls)
+        p95 = self.p95_latency()
+        return {
+            'state': self.state,
+            'recent_calls': len(calls),
+            'recent_failures': sum(1 for succeeded, _ in calls if not succeeded),
+            'p95_latency_ms': p95 * 1000 if p95 is not None else None,
+        }
+
+
+class CircuitBreakerRegistry:
+    """Process-wide circuit breaker per LLM backend"""
+    
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+    
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(name)
+            return self._breakers[name]
+    
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.metrics() for name, breaker in breakers.items()}
+    
+    def clear(self):
+        with self._lock:
+            self._breakers.clear()
+
+
+circuit_breakers = CircuitBreakerRegistry()
+
+# Runs hedged LLM calls; the losing call finishes here in the background
+llm_executor = ThreadPoolExecutor(max_workers=max(LLM_HEDGE_WORKERS, 2), thread_name_prefix='llm-hedge')
+# Keeps references to losing async calls until they finish
+background_tasks = set()
+
+
+class LLMBackend(NamedTuple):
+    name: str
+    model: str
+    confidence: float
+    call: Callable[..., str]
+    acall: Callable[..., Any]
+    stream: Callable[..., Iterator[str]]
+
+
 class ChatbotService:
     """Service for generating AI responses using Ollama or fallback logic"""
     
-    def __init__(self):
+    OLLAMA_OPTIONS = {
+        'temperature': 0.7,
+        'top_p': 0.9,
+        'num_predict': LLM_MAX_RESPONSE_TOKENS,
+        'num_ctx': OLLAMA_NUM_CTX
+    }
+    
+    def __init__(
+        self,
+        response_cache: Optional[ResponseCache] = None,
+        scheduler: Optional[GenerationScheduler] = None,
+        prompt_builder: Optional[PromptBuilder] = None
+    ):
         # Initialize Ollama configuration
         self.ollama_base_url = config('OLLAMA_BASE_URL', default='http://localhost:11434')
         self.ollama_model = config('OLLAMA_MODEL', default='llama2:chat')
         self.use_ollama = True
+        self._ollama_async_client = None
+        # Every Ollama call goes through the process-wide queue
+        self.scheduler = scheduler or generation_scheduler
+        self.prompt_builder = prompt_builder or PromptBuilder()
         
         # Fallback to OpenAI if configured
+        self.openai_model = 'gpt-3.5-turbo'
         self.use_openai = config('OPENAI_API_KEY', default=None) is not None
         if self.use_openai:
             openai.api_key = config('OPENAI_API_KEY')
+        
+        # Answers to repeated questions are served without calling the LLM
+        if response_cache is None and RESPONSE_CACHE_ENABLED:
+            response_cache = shared_response_cache
+        self.response_cache = response_cache
     
     def generate_response(
         self, 
         user_message: str, 
         context: str, 
-        conversation_history: Optional[List[Dict]] = None
+        conversation_history: Optional[List[Dict]] = None,
+        timer: Optional[StageTimer] = None
     ) -> Dict[str, Any]:
-        """Generate a response using AI or fallback logic"""
+        """Generate a response using AI or fallback logic, timing the stages on ``timer``"""
+        timer = timer or StageTimer()
+        
+        cached = self._get_cached_response(user_message, context, conversation_history, timer)
+        if cached is not None:
+            return cached
         
+        result = self._route_request(user_message, context, conversation_history, timer)
+        self._cache_response(user_message, context, result, conversation_history, timer)
+        return result
+    
+    def _llm_backends(self) -> List[LLMBackend]:
+        """Configured LLM backends in order of preference"""
+        backends = []
         if self.use_ollama:
-            return self._generate_ollama_response(user_message, context, conversation_history)
-        elif self.use_openai:
-            return self._generate_openai_response(user_message, context, conversation_history)
-        else:
-            return self._generate_fallback_response(user_message, context)
+            backends.append(LLMBackend(
+                'ollama', self.ollama_model, 0.85,
+                self._call_ollama, self._acall_ollama, self._stream_ollama_tokens
+            ))
+        if self.use_openai:
+            backends.append(LLMBackend(
+                'openai', self.openai_model, 0.9,
+                self._call_openai, self._acall_openai, self._stream_openai_tokens
+            ))
+        return backends
     
-    def _generate_ollama_response(
-        self, 
-        user_message: str, 
-        context: str, 
-        conversation_history: Optional[List[Dict]] = None
+    def _build_result(
+        self,
+        backend: LLMBackend,
+        prompt: Prompt,
+        context: str,
+        ai_response: str,
+        timer: StageTimer
     ) -> Dict[str, Any]:
-        """Generate response using Ollama API"""
+        with timer.stage('suggestions'):
+            suggestions = self._generate_suggestions(prompt.question, ai_response)
+        return {
+            'response': ai_response,
+            'confidence': backend.confidence,
+            'sources': self._extract_sources_from_context(context),
+            'suggestions': suggestions,
+            'model_used': backend.model,
+            'prompt_tokens': prompt.token_count
+        }
+    
+    @staticmethod
+    def _hedge_delay(breaker: CircuitBreaker, pending: List[LLMBackend]) -> Optional[float]:
+        """Seconds to wait before hedging to the next backend, None to not hedge"""
+        if not LLM_HEDGE_ENABLED or not pending:
+            return None
+        p95 = breaker.p95_latency()
+        if p95 is None or circuit_breakers.get(pending[0].name).is_open:
+            return None
+        return max(p95, LLM_HEDGE_MIN_DELAY)
+    
+    @staticmethod
+    def _timed_call(breaker: CircuitBreaker, call, *args) -> str:
+        start = time.monotonic()
         try:
-            # Build the prompt with context and conversation history
-            context_text = context if context else "No specific context available."
-            system_prompt = f"""You are a helpful tourism assistant for Algeria. Use the following context to answer questions about Algeria's tourism, culture, places to visit, and travel information.
-            
-Context:
-{context_text}
-            
-Instructions:
-- Provide accurate and helpful information about Algeria
-- If the context doesn't contain relevant information, use your general knowledge about Algeria
-- Be friendly and encouraging about visiting Algeria
-- Suggest specific places, activities, or experiences when appropriate
-- If asked about travel logistics, provide practical advice
-- Keep responses concise but informative"""
-            
-            # Build conversation context
-            conversation_context = ""
-            if conversation_history:
-                for msg in conversation_history[-4:]:  # Last 4 messages for context
-                    role = "Human" if msg['role'] == 'user' else "Assistant"
-                    conversation_context += f"{role}: {msg['content']}\n"
-            
-            # Create the full prompt
-            full_prompt = f"{system_prompt}\n\n{conversation_context}Human: {user_message}\nAssistant:"
-            
-            # Generate response using Ollama
-            response = ollama.generate(
-                model=self.ollama_model,
-                prompt=full_prompt,
-                options={
-                    'temperature': 0.7,
-                    'top_p': 0.9,
-                    'max_tokens': 500
-                }
-            )
-            
-            ai_response = response['response'].strip()
+            result = call(*args)
+        except BaseException:
+            # Whatever ended the call, settle it so a half-open probe is released
+            breaker.record_failure(time.monotonic() - start)
+            raise
+        breaker.record_success(time.monotonic() - start)
+        return result
+    
+    def complete(self, prompt: Prompt) -> Optional[str]:
+        """
+        Raw completion of ``prompt`` from the first backend that answers.
+        
+        For internal prompts such as conversation summaries: no caching,
+        hedging or rule-based fallback. Returns None if no backend answered.
+        """
+        for backend in self._llm_backends():
+            breaker = circuit_breakers.get(backend.name)
+            if not breaker.allow_request():
+                continue
+            try:
+                return self._timed_call(breaker, backend.call, prompt)
+            except Exception as e:
+                logger.warning("%s completion failed: %s", backend.name, e)
+        return None
+    
+    def _route_request(
+        self,
+        user_message: str,
+        context: str,
+        conversation_history: Optional[List[Dict]],
+        timer: StageTimer
+    ) -> Dict[str, Any]:
+        """LLM answer to the question, or the rule-based one if no backend answered"""
+        with timer.stage('prompt'):
+            prompt = self.prompt_builder.build(user_message, context, conversation_history)
+        with timer.stage('llm'):
+            answer = self._call_backends(prompt)
+        if answer is None:
+            with timer.stage('fallback'):
+                return self._generate_fallback_response(user_message, context)
+        backend, ai_response = answer
+        return self._build_result(backend, prompt, context, ai_response, timer)
+    
+    def _call_backends(self, prompt: Prompt) -> Optional[Tuple[LLMBackend, str]]:
+        """
+        Try each backend whose circuit is closed, hedging slow calls.
+        
+        A backend with an open circuit is skipped without a request, so when
+        every circuit is open None is returned at once. If a call runs past
+        its backend's p95 latency the next backend is started as well and
+        whichever answers first wins. Returns the backend and its answer.
+        """
+        pending = self._llm_backends()
+        while pending:
+            backend = pending.pop(0)
+            breaker = circuit_breakers.get(backend.name)
+            if not breaker.allow_request():
+                continue
             
-            # Generate suggestions based on the response
-            suggestions = self._generate_suggestions(user_message, ai_response)
+            hedge_delay = self._hedge_delay(breaker, pending)
+            if hedge_delay is None:
+                try:
+                    return backend, self._timed_call(breaker, backend.call, prompt)
+                except Exception as e:
+                    logger.warning("%s request failed: %s", backend.name, e)
+                    continue
             
-            return {
-                'response': ai_response,
-                'confidence': 0.85,
-                'sources': self._extract_sources_from_context(context),
-                'suggestions': suggestions
-            }
+            futures = {llm_executor.submit(self._timed_call, breaker, backend.call, prompt): backend}
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                hedge_breaker = circuit_breakers.get(pending[0].name)
+                # A refused hedge stays pending, to be tried if this call fails
+                if hedge_breaker.allow_request():
+                    hedge = pending.pop(0)
+                    logger.info("%s slower than %.1fs, hedging to %s", backend.name, hedge_delay, hedge.name)
+                    futures[llm_executor.submit(self._timed_call, hedge_breaker, hedge.call, prompt)] = hedge
             
+            # The slower call keeps running so its latency still reaches the breaker
+            for future in as_completed(futures):
+                try:
+                    return futures[future], future.result()
+                except Exception as e:
+                    logger.warning("%s request failed: %s", futures[future].name, e)
+        
+        return None
+    
+    def _get_cached_response(
+        self,
+        user_message: str,
+        context: str,
+        conversation_history: Optional[List[Dict]],
+        timer: StageTimer
+    ) -> Optional[Dict[str, Any]]:
+        if self.response_cache is None:
+            return None
+        try:
+            with timer.stage('cache'):
+                cached = self.response_cache.get(user_message, context, conversation_history)
         except Exception as e:
-            print(f"Ollama API error: {e}")
-            # Fallback to OpenAI if available, otherwise use fallback response
-            if self.use_openai:
-                return self._generate_openai_response(user_message, context, conversation_history)
-            else:
-                return self._generate_fallback_response(user_message, context)
+            logger.warning("Response cache lookup failed: %s", e)
+            return None
+        if cached is not None:
+            # Nothing was sent to the model for this answer; stored messages
+            # and analytics attribute it to the cache, like FAQ answers
+            cached['cached'] = True
+            cached['model_used'] = 'cache'
+            cached['prompt_tokens'] = 0
+        return cached
     
-    def _generate_openai_response(
-        self, 
-        user_message: str, 
-        context: str, 
-        conversation_history: Optional[List[Dict]] = None
+    def _cache_response(
+        self,
+        user_message: str,
+        context: str,
+        result: Dict[str, Any],
+        conversation_history: Optional[List[Dict]],
+        timer: StageTimer
+    ):
+        # Rule-based answers mean the LLM was unavailable, so don't pin them
+        if self.response_cache is None or result.get('model_used', 'fallback') == 'fallback':
+            return
+        try:
+            with timer.stage('cache'):
+                self.response_cache.set(user_message, context, result, conversation_history)
+        except Exception as e:
+            logger.warning("Response cache update failed: %s", e)
+    
+    @property
+    def ollama_async_client(self) -> ollama.AsyncClient:
+        if self._ollama_async_client is None:
+            self._ollama_async_client = ollama.AsyncClient(host=self.ollama_base_url)
+        return self._ollama_async_client
+    
+    async def agenerate_response(
+        self,
+        user_message: str,
+        context: str,
+        conversation_history: Optional[List[Dict]] = None,
+        timer: Optional[StageTimer] = None
     ) -> Dict[str, Any]:
-        """Generate response using OpenAI API"""
+        """
+        Async variant of generate_response.
+        
+        The LLM call is awaited on the event loop instead of blocking a
+        thread, with the same backend order, circuit breakers and hedging.
+        """
+        timer = timer or StageTimer()
+        cached = self._get_cached_response(user_message, context, conversation_history, timer)
+        if cached is not None:
+            return cached
+        
+        # Load admin intents off the event loop for the fallback and suggestions
+        await sync_to_async(shared_intent_engine.get)()
+        result = await self._aroute_request(user_message, context, conversation_history, timer)
+        self._cache_response(user_message, context, result, conversation_history, timer)
+        return result
+    
+    @staticmethod
+    async def _atimed_call(breaker: CircuitBreaker, call, *args) -> str:
+        start = time.monotonic()
         try:
-            # Build conversation messages
-            context_text = context if context else "No specific context available."
-            messages = [
-                {
-                    "role": "system",
-                    "content": f"""You are a helpful tourism assistant for Algeria. Use the following context to answer questions about Algeria's tourism, culture, places to visit, and travel information.
-                    
-Context:
-{context_text}
-                    
-Instructions:
-- Provide accurate and helpful information about Algeria
-- If the context doesn't contain relevant information, use your general knowledge about Algeria
-- Be friendly and encouraging about visiting Algeria
-- Suggest specific places, activities, or experiences when appropriate
-- If asked about travel logistics, provide practical advice
-- Keep responses concise but informative"""
-                }
-            ]
-            
-            # Add conversation history if available
-            if conversation_history:
-                for msg in conversation_history[-6:]:  # Last 6 messages for context
-                    messages.append({
-                        "role": "user" if msg['message_type'] == 'user' else "assistant",
-                        "content": msg['message']
-                    })
-            
-            # Add current user message
-            messages.append({
-                "role": "user",
-                "content": user_message
-            })
-            
-            # Generate response
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=500,
-                temperature=0.7,
-                top_p=0.9
-            )
+            result = await call(*args)
+        except BaseException:
+            # Cancellation included, or a half-open probe would never be released
+            breaker.record_failure(time.monotonic() - start)
+            raise
+        breaker.record_success(time.monotonic() - start)
+        return result
+    
+    async def _aroute_request(
+        self,
+        user_message: str,
+        context: str,
+        conversation_history: Optional[List[Dict]],
+        timer: StageTimer
+    ) -> Dict[str, Any]:
+        """Async variant of _route_request"""
+        with timer.stage('prompt'):
+            prompt = self.prompt_builder.build(user_message, context, conversation_history)
+        with timer.stage('llm'):
+            answer = await self._acall_backends(prompt)
+        if answer is None:
+            with timer.stage('fallback'):
+                return self._generate_fallback_response(user_message, context)
+        backend, ai_response = answer
+        return self._build_result(backend, prompt, context, ai_response, timer)
+    
+    async def _acall_backends(self, prompt: Prompt) -> Optional[Tuple[LLMBackend, str]]:
+        """Async variant of _call_backends"""
+        pending = self._llm_backends()
+        while pending:
+            backend = pending.pop(0)
+            breaker = circuit_breakers.get(backend.name)
+            if not breaker.allow_request():
+                continue
             
-            ai_response = response.choices[0].message.content.strip()
+            tasks = {asyncio.ensure_future(self._atimed_call(breaker, backend.acall, prompt)): backend}
+            hedge_delay = self._hedge_delay(breaker, pending)
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    hedge_breaker = circuit_breakers.get(pending[0].name)
+                    # A refused hedge stays pending, to be tried if this call fails
+                    if hedge_breaker.allow_request():
+                        hedge = pending.pop(0)
+                        logger.info("%s slower than %.1fs, hedging to %s", backend.name, hedge_delay, hedge.name)
+                        tasks[asyncio.ensure_future(self._atimed_call(hedge_breaker, hedge.acall, prompt))] = hedge
             
-            # Generate suggestions based on the response
-            suggestions = self._generate_suggestions(user_message, ai_response)
+            remaining = set(tasks)
+            while remaining:
+                done, remaining = await asyncio.wait(remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        ai_response = task.result()
+                    except Exception as e:
+                        logger.warning("%s request failed: %s", tasks[task].name, e)
+                        continue
+                    # Keep the slower call alive so its latency still reaches the breaker
+                    for task_left in remaining:
+                        background_tasks.add(task_left)
+                        task_left.add_done_callback(background_tasks.discard)
+                    return tasks[task], ai_response
+        
+        return None
+    
+    def stream_response(
+        self,
+        user_message: str,
+        context: str,
+        conversation_history: Optional[List[Dict]] = None,
+        timer: Optional[StageTimer] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Generate a response incrementally.
+        
+        Yields ``{'type': 'token', 'content': ...}`` for every chunk as it
+        arrives, then a single ``{'type': 'done', ...}`` event with the same
+        fields as generate_response plus ``model_used``. Backends are tried in
+        the same order as generate_response, skipping open circuits; one that
+        fails before its first token falls through to the next. A cached
+        answer is sent as one token. The 'llm' stage on ``timer`` includes the
+        time the client took to read the tokens.
+        """
+        timer = timer or StageTimer()
+        cached = self._get_cached_response(user_message, context, conversation_history, timer)
+        if cached is not None:
+            yield {'type': 'token', 'content': cached['response']}
+            yield {'type': 'done', **cached}
+            return
+        
+        with timer.stage('prompt'):
+            prompt = self.prompt_builder.build(user_message, context, conversation_history)
+        for backend in self._llm_backends():
+            breaker = circuit_breakers.get(backend.name)
+            if not breaker.allow_request():
+                continue
             
-            return {
-                'response': ai_response,
-                'confidence': 0.9,
-                'sources': self._extract_sources_from_context(context),
-                'suggestions': suggestions
-            }
+            start = time.monotonic()
+            tokens = []
+            try:
+                for token in backend.stream(prompt):
+                    tokens.append(token)
+                    yield {'type': 'token', 'content': token}
+            except Exception as e:
+                # Once tokens reached the client, finish with what we have
+                logger.warning("Streaming from %s failed: %s", backend.model, e)
+            except BaseException:
+                # The client went away mid-stream (GeneratorExit): settle the
+                # call so a half-open probe is released, judged by what arrived
+                if tokens:
+                    breaker.record_success(time.monotonic() - start)
+                else:
+                    breaker.record_failure(time.monotonic() - start)
+                raise
             
-        except Exception as e:
-            print(f"OpenAI API error: {e}")
-            return self._generate_fallback_response(user_message, context)
-    
-    def _generate_fallback_response(self, user_message: str, context: str) -> Dict[str, Any]:
-        """Generate a fallback response using rule-based logic"""
+            ai_response = ''.join(tokens).strip()
+            timer.add('llm', time.monotonic() - start)
+            if not ai_response:
+                breaker.record_failure(time.monotonic() - start)
+                continue
+            breaker.record_success(time.monotonic() - start)
+            result = self._build_result(backend, prompt, context, ai_response, timer)
+            self._cache_response(user_message, context, result, conversation_history, timer)
+            yield {'type': 'done', **result}
+            return
         
-        # Convert to lowercase for matching
-        message_lower = user_message.lower()
-        
-        # Define response patterns
-        patterns = {
-            'greeting': {
-                'keywords': ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening'],
-                'response': "Hello! I'm here to help you discover the beauty of Algeria. What would you like to know about our amazing country?"
-            },
-            'places': {
-                'keywords': ['places', 'visit', 'attractions', 'destinations', 'where to go'],
-                'response': "Algeria has many incredible places to visit! Some highlights include the Casbah of Algiers (UNESCO World Heritage site), the Roman ruins of Timgad and Djémila, the stunning Sahara Desert, and the beautiful Mediterranean coastline. What type of experience interests you most?"
-            },
-            'gorillas': {
-                'keywords': ['gorilla', 'gorillas', 'mountain gorilla', 'trekking'],
-                'response': "The Sahara Desert is Algeria's most famous attraction! You can experience camel trekking, visit ancient rock art at Tassili n'Ajjer, and enjoy stunning desert landscapes. Desert tours can be arranged from cities like Tamanrasset. Would you like to know more about desert excursions?"
-            },
-            'culture': {
-                'keywords': ['culture', 'tradition', 'people', 'customs', 'history'],
-                'response': "Algerian culture is rich and diverse! Known as the 'Gateway to Africa,' Algeria has a blend of Berber, Arab, and Mediterranean influences, beautiful traditional music like Raï, and delicious cuisine including couscous and tagines. The people are incredibly hospitable and proud of their heritage. What aspect of culture interests you?"
-            },
-            'weather': {
-                'keywords': ['weather', 'climate', 'temperature', 'rain', 'season'],
-                'response': "Algeria has a Mediterranean climate along the coast and a desert climate in the south. The best time to visit the coast is spring (March-May) and fall (September-November), while winter is ideal for the Sahara. Summer can be very hot, especially inland. The best time depends on your destinations and activities!"
-            },
-            'visa': {
-                'keywords': ['visa', 'entry', 'passport', 'requirements', 'border'],
-                'response': "Most visitors can get a visa on arrival or apply online for an e-visa. Many nationalities can also get a 30-day visa-free entry. Make sure your passport is valid for at least 6 months. Check the latest requirements based on your nationality before traveling."
-            }
+        with timer.stage('fallback'):
+            fallback = self._generate_fallback_response(user_message, context)
+        yield {'type': 'token', 'content': fallback['response']}
+        yield {'type': 'done', **fallback}
+    
+    def _ollama_request(self, prompt: Prompt) -> Dict[str, Any]:
+        # The system prompt goes in its own field so every request starts with
+        # the same tokens, and keep_alive holds the model (and that cached
+        # prefix) in memory between requests
+        return {
+            'model': self.ollama_model,
+            'system': prompt.system,
+            'prompt': prompt.completion_text(),
+            'options': self.OLLAMA_OPTIONS,
+            'keep_alive': OLLAMA_KEEP_ALIVE
         }
+    
+    def _call_ollama(self, prompt: Prompt) -> str:
+        """Generate response using Ollama API"""
+        request = self._ollama_request(prompt)
         
-        # Find matching pattern
-        best_match = None
-        max_matches = 0
-        
-        for category, pattern in patterns.items():
-            matches = sum(1 for keyword in pattern['keywords'] if keyword in message_lower)
-            if matches > max_matches:
-                max_matches = matches
-                best_match = pattern
+        # Generate response using Ollama, queued behind other in-flight prompts
+        response = self.scheduler.run(
+            self.scheduler.prompt_key(request['model'], request['system'], request['prompt'], request['options']),
+            lambda: ollama.generate(**request)
+        )
+        return response['response'].strip()
+    
+    async def _acall_ollama(self, prompt: Prompt) -> str:
+        """Generate response using the async Ollama client"""
+        request = self._ollama_request(prompt)
+        response = await self.scheduler.arun(
+            self.scheduler.prompt_key(request['model'], request['system'], request['prompt'], request['options']),
+            lambda: self.ollama_async_client.generate(**request)
+        )
+        return response['response'].strip()
+    
+    def _stream_ollama_tokens(self, prompt: Prompt) -> Iterator[str]:
+        """Yield response chunks from Ollama as they are generated"""
+        # Streams can't be shared, but they hold a slot until the last chunk
+        with self.scheduler.slot():
+            stream = ollama.generate(**self._ollama_request(prompt), stream=True)
+            for chunk in stream:
+                if chunk['response']:
+                    yield chunk['response']
+    
+    def _call_openai(self, prompt: Prompt) -> str:
+        """Generate response using OpenAI API"""
+        response = openai.ChatCompletion.create(
+            model=self.openai_model,
+            messages=prompt.messages(),
+            max_tokens=LLM_MAX_RESPONSE_TOKENS,
+            temperature=0.7,
+            top_p=0.9
+        )
+        return response.choices[0].message.content.strip()
+    
+    async def _acall_openai(self, prompt: Prompt) -> str:
+        """Generate response using the async OpenAI API"""
+        response = await openai.ChatCompletion.acreate(
+            model=self.openai_model,
+            messages=prompt.messages(),
+            max_tokens=LLM_MAX_RESPONSE_TOKENS,
+            temperature=0.7,
+            top_p=0.9
+        )
+        return response.choices[0].message.content.strip()
+    
+    def _stream_openai_tokens(self, prompt: Prompt) -> Iterator[str]:
+        """Yield response chunks from OpenAI as they are generated"""
+        stream = openai.ChatCompletion.create(
+            model=self.openai_model,
+            messages=prompt.messages(),
+            max_tokens=LLM_MAX_RESPONSE_TOKENS,
+            temperature=0.7,
+            top_p=0.9,
+            stream=True
+        )
+        for chunk in stream:
+            content = chunk.choices[0].delta.get('content')
+            if content:
+                yield content
+    
+    def _generate_fallback_response(self, user_message: str, context: str) -> Dict[str, Any]:
+        """Generate a fallback response using rule-based logic"""
+        analysis = shared_intent_engine.get().analyze(user_message)
         
-        # Use context if available and no pattern matched well
-        if max_matches == 0 and context:
+        # Use context if available and no intent matched
+        if analysis.intent is None and context:
             # Extract first few sentences from context
             sentences = context.split('. ')[:3]
             response = '. '.join(sentences) + ". Would you like to know more about any specific aspect?"
-        elif best_match:
-            response = best_match['response']
         else:
-            response = "I'd be happy to help you learn about Algeria! You can ask me about places to visit, culture, desert excursions, weather, visa requirements, or any other travel-related questions."
-        
-        # Generate simple suggestions
-        suggestions = [
-            "What are the best places to visit in Algeria?",
-            "Tell me about the Sahara Desert",
-            "What's the weather like in Algeria?",
-            "What should I know about Algerian culture?"
-        ]
+            response = analysis.response
         
         return {
             'response': response,
-            'confidence': 0.7 if max_matches > 0 else 0.5,
+            'confidence': 0.7 if analysis.intent else 0.5,
             'sources': self._extract_sources_from_context(context),
-            'suggestions': suggestions[:3]
+            'suggestions': list(FALLBACK_SUGGESTIONS[:3]),
+            'model_used': 'fallback'
         }
     
     def _extract_sources_from_context(self, context: str) -> List[Dict[str, str]]:
@@ -376,55 +1777,8 @@ Instructions:
     
     def _generate_suggestions(self, user_message: str, ai_response: str) -> List[str]:
         """Generate follow-up suggestions based on the conversation"""
-        
-        message_lower = user_message.lower()
-        
-        # Context-aware suggestions
-        if any(word in message_lower for word in ['desert', 'sahara', 'trekking']):
-            return [
-                "What should I bring for desert trekking?",
-                "How much does a Sahara tour cost?",
-                "What other activities are available in the desert?"
-            ]
-        elif any(word in message_lower for word in ['places', 'visit', 'attractions']):
-            return [
-                "Tell me about the Casbah of Algiers",
-                "What can I do in Constantine?",
-                "How many days should I spend in Algeria?"
-            ]
-        elif any(word in message_lower for word in ['culture', 'people', 'tradition']):
-            return [
-                "What is traditional Algerian food like?",
-                "Tell me about Algerian music and dance",
-                "What languages are spoken in Algeria?"
-            ]
-        else:
-            return [
-                "What's the best time to visit Algeria?",
-                "How do I get around Algeria?",
-                "What are the must-see attractions?"
-            ]
+        return shared_intent_engine.get().analyze(user_message).suggestions
     
     def analyze_sentiment(self, message: str) -> Dict[str, float]:
         """Simple sentiment analysis"""
-        positive_words = ['good', 'great', 'excellent', 'amazing', 'wonderful', 'love', 'like', 'best', 'fantastic']
-        negative_words = ['bad', 'terrible', 'awful', 'hate', 'dislike', 'worst', 'horrible', 'disappointing']
-        
-        words = message.lower().split()
-        
-        positive_count = sum(1 for word in words if word in positive_words)
-        negative_count = sum(1 for word in words if word in negative_words)
-        
-        total_words = len(words)
-        if total_words == 0:
-            return {'positive': 0.5, 'negative': 0.5, 'neutral': 0.0}
-        
-        positive_score = positive_count / total_words
-        negative_score = negative_count / total_words
-        neutral_score = 1 - positive_score - negative_score
-        
-        return {
-            'positive': positive_score,
-            'negative': negative_score,
-            'neutral': neutral_score
-        }
\ No newline at end of file
+        return shared_intent_engine.get().sentiment(message)
\ No newline at end of file
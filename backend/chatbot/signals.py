@@ -0,0 +1,99 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from tourism.models import Place, Province
+
+from .models import ChatIntent, ChatMessage, FrequentlyAskedQuestion, KnowledgeBase
+from .embeddings import shared_dense_index
+from .entities import shared_entity_linker
+from .faq import shared_faq_index
+from .intents import shared_intent_engine
+from .response_cache import response_cache
+from .services import KnowledgeIndex, shared_knowledge_index
+from .tasks import link_chat_mentions, summarize_conversation
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=KnowledgeBase)
+def update_knowledge_index(sender, instance, **kwargs):
+    """Add, replace or drop the saved entry in this process's search index"""
+    transaction.on_commit(shared_dense_index.invalidate)
+    transaction.on_commit(response_cache.invalidate)
+    if instance.is_active:
+        document = {field: getattr(instance, field) for field in KnowledgeIndex.DOCUMENT_FIELDS}
+        transaction.on_commit(lambda: shared_knowledge_index.apply_changes(upserts=[document]))
+    else:
+        entry_id = instance.pk
+        transaction.on_commit(lambda: shared_knowledge_index.apply_changes(removed_ids=[entry_id]))
+
+
+@receiver(post_delete, sender=KnowledgeBase)
+def remove_from_knowledge_index(sender, instance, **kwargs):
+    """Drop the deleted entry from this process's search index"""
+    transaction.on_commit(shared_dense_index.invalidate)
+    transaction.on_commit(response_cache.invalidate)
+    entry_id = instance.pk
+    transaction.on_commit(lambda: shared_knowledge_index.apply_changes(removed_ids=[entry_id]))
+
+
+@receiver(post_save, sender=ChatMessage)
+def link_message_mentions(sender, instance, created, update_fields=None, **kwargs):
+    """Queue tagging new or rewritten messages with the places and provinces they mention"""
+    if instance.message_type == 'system' or not instance.content:
+        return
+    if not created and update_fields is not None and 'content' not in update_fields:
+        return
+
+    message_id = instance.pk
+
+    def enqueue():
+        try:
+            link_chat_mentions.delay(message_id)
+        except Exception as e:
+            # Mentions only feed analytics; `manage.py link_chat_mentions` backfills missed ones
+            logger.warning("Could not queue mention linking for message %s: %s", message_id, e)
+
+    transaction.on_commit(enqueue)
+
+
+@receiver(post_save, sender=ChatMessage)
+def schedule_conversation_summary(sender, instance, **kwargs):
+    """Once a reply is finished, queue folding turns past the recent window into the summary"""
+    if instance.message_type != 'assistant' or instance.status != 'complete':
+        return
+    session_id = instance.session_id
+
+    def enqueue():
+        try:
+            summarize_conversation.delay(session_id)
+        except Exception as e:
+            # The prompt just carries more raw turns until a later reply queues it again
+            logger.warning("Could not queue summary of chat session %s: %s", session_id, e)
+
+    transaction.on_commit(enqueue)
+
+
+@receiver([post_save, post_delete], sender=Place)
+@receiver([post_save, post_delete], sender=Province)
+def reload_entity_names(sender, **kwargs):
+    """Rebuild this process's name automaton after place or province edits"""
+    transaction.on_commit(shared_entity_linker.clear)
+
+
+@receiver([post_save, post_delete], sender=FrequentlyAskedQuestion)
+def reload_faq_index(sender, update_fields=None, **kwargs):
+    """Rebuild this process's FAQ index after FAQ edits"""
+    # View counts don't change what is matched
+    if update_fields is not None and set(update_fields) == {'view_count'}:
+        return
+    transaction.on_commit(shared_faq_index.clear)
+
+
+@receiver([post_save, post_delete], sender=ChatIntent)
+def reload_intents(sender, **kwargs):
+    """Recompile this process's intent engine after intent edits"""
+    transaction.on_commit(shared_intent_engine.clear)
@@ -0,0 +1,123 @@
+import logging
+import re
+from typing import List, Optional
+
+from decouple import config
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+from .models import ChatMessage, ChatSession
+from .prompts import PromptBuilder, count_tokens, truncate_to_tokens
+from .services import ChatbotService
+
+logger = logging.getLogger(__name__)
+
+# Messages (two turns) sent to the LLM verbatim; older ones are summarized
+CONVERSATION_RECENT_MESSAGES = config('CONVERSATION_RECENT_MESSAGES', default=4, cast=int)
+CONVERSATION_SUMMARY_TOKENS = config('CONVERSATION_SUMMARY_TOKENS', default=250, cast=int)
+# Longest share of a single message that goes into the summarization prompt
+SUMMARY_MESSAGE_TOKENS = 200
+# Tokens of each message kept when summarizing without an LLM
+EXTRACT_MESSAGE_TOKENS = 40
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a traveller and an Algeria tourism assistant.
+
+Instructions:
+- Merge the new exchanges into the summary given as context
+- Keep the traveller's plans, preferences, dates and the places already discussed
+- Drop greetings, repetition and details of answers the traveller did not follow up on
+- Write plain sentences in the conversation's language, no more than a short paragraph"""
+
+SENTENCE_END = re.compile(r'(?<=[.!?؟])\s')
+
+
+def unsummarized_count(session_id: int) -> int:
+    """Finished messages of the session that the summary doesn't cover yet"""
+    return ChatMessage.objects.filter(
+        session_id=session_id,
+        id__gt=Coalesce(F('session__summary_message_id'), Value(0))
+    ).exclude(status='pending').count()
+
+
+def needs_summary(session_id: int) -> bool:
+    return unsummarized_count(session_id) > CONVERSATION_RECENT_MESSAGES
+
+
+class ConversationSummarizer:
+    """
+    Folds chat messages into a session's rolling summary.
+
+    The previous summary and the new messages go to the LLM; if no backend
+    answers, the first sentence of each message is appended instead and the
+    oldest lines are dropped to stay within ``max_tokens``.
+    """
+
+    def __init__(self, chatbot_service: Optional[ChatbotService] = None, max_tokens: int = CONVERSATION_SUMMARY_TOKENS):
+        self.chatbot_service = chatbot_service or ChatbotService()
+        self.max_tokens = max_tokens
+        self.prompt_builder = PromptBuilder(context_tokens=max_tokens, system=SUMMARY_PROMPT)
+
+    @staticmethod
+    def speaker(message: ChatMessage) -> str:
+        return 'Traveller' if message.message_type == 'user' else 'Assistant'
+
+    def transcript(self, messages: List[ChatMessage]) -> str:
+        return '\n'.join(
+            f"{self.speaker(msg)}: {truncate_to_tokens(msg.content, SUMMARY_MESSAGE_TOKENS)}" for msg in messages
+        )
+
+    def extract(self, summary: str, messages: List[ChatMessage]) -> str:
+        lines = [line for line in summary.splitlines() if line.strip()]
+        for msg in messages:
+            sentence = SENTENCE_END.split(msg.content.strip(), 1)[0]
+            lines.append(f"{self.speaker(msg)}: {truncate_to_tokens(sentence, EXTRACT_MESSAGE_TOKENS)}")
+
+        # Keep the newest lines that fit
+        kept = []
+        used = 0
+        for line in reversed(lines):
+            used += count_tokens(line)
+            if used > self.max_tokens:
+                break
+            kept.append(line)
+        return '\n'.join(reversed(kept))
+
+    def summarize(self, summary: str, messages: List[ChatMessage]) -> str:
+        """New summary covering ``summary`` and then ``messages``"""
+        prompt = self.prompt_builder.build(
+            f"Summarize the conversation so far, including these new exchanges:\n{self.transcript(messages)}",
+            summary
+        )
+        text = self.chatbot_service.complete(prompt)
+        if not text:
+            return self.extract(summary, messages)
+        return truncate_to_tokens(text.strip(), self.max_tokens)
+
+
+def update_session_summary(session_id: int, summarizer: Optional[ConversationSummarizer] = None) -> Optional[str]:
+    """
+    Fold every finished message older than the recent window into the
+    session's summary. Returns the summary, or None if the session is gone.
+
+    The summary is written only if no other worker moved it on meanwhile, so
+    concurrent runs for one session never fold a message twice.
+    """
+    session = ChatSession.objects.filter(id=session_id).only('summary', 'summary_message_id').first()
+    if session is None:
+        return None
+
+    messages = list(
+        session.messages.exclude(status='pending').filter(id__gt=session.summary_message_id or 0).order_by('id')
+    )
+    older = messages[:max(len(messages) - CONVERSATION_RECENT_MESSAGES, 0)]
+    if not older:
+        return session.summary
+
+    summary = (summarizer or ConversationSummarizer()).summarize(session.summary, older)
+    updated = ChatSession.objects.filter(
+        id=session_id,
+        summary_message_id=session.summary_message_id
+    ).update(summary=summary, summary_message_id=older[-1].id)
+    if not updated:
+        logger.info("Summary of chat session %s was updated concurrently", session_id)
+    return summary
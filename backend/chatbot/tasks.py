@@ -0,0 +1,94 @@
+import logging
+import time
+
+from django.utils import timezone
+
+from myguide_backend.celery import app
+
+from . import analytics, entities, summaries
+from .faq import answer_from_faq
+from .models import ChatMessage
+from .services import RAGService, ChatbotService
+from .tracing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+ERROR_RESPONSE = "I'm sorry, I'm having trouble processing your request right now. Please try again later."
+
+
+@app.task(acks_late=True, ignore_result=True)
+def generate_chat_response(message_id: int, reply_id: int):
+    """
+    Answer a user message into its pending assistant reply.
+
+    Runs retrieval and the LLM call on a worker, then marks the reply
+    complete (or failed) so clients polling it see the result. Tasks are
+    acknowledged after they finish, so one lost with its worker is redelivered;
+    a reply that is no longer pending is left alone.
+    """
+    try:
+        reply = ChatMessage.objects.select_related('session').get(id=reply_id, status='pending')
+        message = ChatMessage.objects.get(id=message_id, session_id=reply.session_id)
+    except ChatMessage.DoesNotExist:
+        return
+
+    start_time = time.time()
+    timer = StageTimer('queued')
+    try:
+        with timer.stage('faq'):
+            ai_response = answer_from_faq(message.content)
+        if ai_response is None:
+            with timer.stage('retrieval'):
+                context = RAGService().get_relevant_context(message.content)
+            with timer.stage('history'):
+                history = reply.session.get_conversation_history()
+            ai_response = ChatbotService().generate_response(message.content, context, history, timer=timer)
+    except Exception:
+        logger.exception("Queued chat response %s failed", reply_id)
+        reply.content = ERROR_RESPONSE
+        reply.status = 'failed'
+        reply.confidence_score = 0.0
+        reply.processing_time_ms = 0
+        reply.save(update_fields=['content', 'status', 'confidence_score', 'processing_time_ms'])
+        return
+
+    reply.content = ai_response['response']
+    reply.status = 'complete'
+    reply.processing_time_ms = int((time.time() - start_time) * 1000)
+    reply.confidence_score = ai_response.get('confidence', 0.8)
+    reply.retrieved_context = ai_response.get('sources', [])
+    reply.model_used = ai_response.get('model_used')
+    reply.prompt_tokens = ai_response.get('prompt_tokens')
+    reply.stage_timings = timer.timings
+    with timer.stage('persistence'):
+        reply.save(update_fields=[
+            'content', 'status', 'processing_time_ms', 'confidence_score', 'retrieved_context', 'model_used',
+            'prompt_tokens', 'stage_timings'
+        ])
+
+        reply.session.updated_at = timezone.now()
+        reply.session.save(update_fields=['updated_at'])
+    timer.observe()
+
+
+@app.task(ignore_result=True)
+def rollup_chat_analytics():
+    """Bring the daily ChatAnalytics rows up to date, scheduled by celery beat"""
+    analytics.rollup_chat_analytics()
+
+
+@app.task(ignore_result=True)
+def summarize_conversation(session_id: int):
+    """Fold turns older than the recent window into the session's rolling summary"""
+    # Short conversations are sent verbatim, nothing to fold yet
+    if not summaries.needs_summary(session_id):
+        return
+    summaries.update_session_summary(session_id)
+
+
+@app.task(ignore_result=True)
+def link_chat_mentions(message_id: int):
+    """Tag a chat message with the places and provinces it mentions"""
+    message = ChatMessage.objects.filter(id=message_id).only('id', 'content').first()
+    if message is not None:
+        entities.link_messages([message])
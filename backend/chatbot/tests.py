@@ -1,3 +1,1958 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import mmap
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+import ollama
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from tourism.models import District, Municipality, Place, Province
+
+from .ann import ExactSearchIndex, IVFIndex, build_ann_index
+from .benchmark import FakeLLMServer, format_report, reset_shared_state, run_benchmark, seed_knowledge_base
+from .exporters import parquet_available
+from .entities import AhoCorasick, EntityLinker, shared_entity_linker
+from .facets import FacetIndex
+from .faq import ViewCountBuffer, faq_view_counts, shared_faq_index
+from .ingestion import SimHashIndex, chunk_text, ingest_documents, simhash, split_sentences, to_signed
+from .intents import BUILTIN_INTENTS, Intent, IntentEngine, builtin_intent_engine, shared_intent_engine
+from .languages import detect_language, normalize_language
+from .embeddings import EmbeddingService, compute_knowledge_embeddings, decode_embedding, shared_dense_index
+from .analytics import rollup_chat_analytics
+from .models import (
+    ChatAnalytics, ChatFeedback, ChatIntent, ChatMessage, ChatSession, FrequentlyAskedQuestion, KnowledgeBase
+)
+from .prompts import SYSTEM_PROMPT, PromptBuilder, count_tokens, truncate_to_tokens
+from .response_cache import ResponseCache, response_cache
+from .summaries import CONVERSATION_RECENT_MESSAGES, ConversationSummarizer, needs_summary, update_session_summary
+from .tasks import generate_chat_response, link_chat_mentions, summarize_conversation
+from .tracing import StageTimer
+from .services import (
+    ChatbotService, CircuitBreaker, GenerationAbandoned, GenerationQueueTimeout, GenerationScheduler, RAGService,
+    KnowledgeIndex, SharedKnowledgeIndex, circuit_breakers, reciprocal_rank_fusion, shared_knowledge_index, weighted_score_fusion
+)
+
+User = get_user_model()
+
+
+class KnowledgeBaseTestMixin:
+    """Helpers for tests that need knowledge base entries"""
+
+    def setUp(self):
+        super().setUp()
+        # Rows from earlier tests are rolled back without firing signals
+        shared_knowledge_index.clear()
+        shared_dense_index.clear()
+        shared_faq_index.clear()
+        shared_intent_engine.clear()
+        response_cache.invalidate()
+        circuit_breakers.clear()
+        shared_knowledge_index.compact_in_background = False
+        self.addCleanup(setattr, shared_knowledge_index, 'compact_in_background', True)
+        shared_dense_index.compact_in_background = False
+        self.addCleanup(setattr, shared_dense_index, 'compact_in_background', True)
+        # Never pick up an index artifact built on the developer's machine
+        no_artifact = override_settings(RAG_INDEX_DIR=None)
+        no_artifact.enable()
+        self.addCleanup(no_artifact.disable)
+
+    def create_entry(self, title, content, content_type='general', **kwargs):
+        return KnowledgeBase.objects.create(
+            title=title,
+            content=content,
+            content_type=content_type,
+            **kwargs
+        )
+
+
+class SharedKnowledgeIndexTestCase(KnowledgeBaseTestMixin, TestCase):
+    """Test the process-wide knowledge base index"""
+
+    def setUp(self):
+        super().setUp()
+        self.create_entry('Casbah of Algiers', 'Historic citadel and medina overlooking the bay of Algiers')
+        self.create_entry('Sahara Desert', 'Camel trekking and dunes near Tamanrasset', 'travel_tips')
+
+    def test_index_is_shared_between_services(self):
+        """Test that separate RAGService instances reuse one fitted index"""
+        RAGService().search_knowledge_base('casbah')
+        first_index = shared_knowledge_index.get()
+        RAGService().search_knowledge_base('sahara')
+        self.assertIs(shared_knowledge_index.get(), first_index)
+
+    def test_search_returns_matching_entry(self):
+        """Test searching the shared index"""
+        results = RAGService().search_knowledge_base('camel trekking')
+        self.assertEqual(results[0]['title'], 'Sahara Desert')
+
+    def test_index_rebuilt_after_knowledge_base_change(self):
+        """Test that saving an entry updates the cached index"""
+        first_index = shared_knowledge_index.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_entry('Timgad', 'Roman ruins founded by emperor Trajan')
+        self.assertIsNot(shared_knowledge_index.get(), first_index)
+        results = RAGService().search_knowledge_base('roman ruins trajan')
+        self.assertEqual(results[0]['title'], 'Timgad')
+
+    def test_unchanged_knowledge_base_keeps_index(self):
+        """Test that invalidation without changes does not refit"""
+        first_index = shared_knowledge_index.get()
+        shared_knowledge_index.invalidate()
+        self.assertIs(shared_knowledge_index.get(), first_index)
+
+    def test_content_type_filter(self):
+        """Test filtering search results by content type"""
+        results = RAGService().search_knowledge_base('casbah sahara', content_type='travel_tips')
+        self.assertEqual([r['title'] for r in results], ['Sahara Desert'])
+
+
+    def test_late_commit_behind_watermark_is_synced(self):
+        """Test that an edit committed after a sync moved past its updated_at is picked up"""
+        provider = SharedKnowledgeIndex(check_interval=0, compact_in_background=False)
+        provider.get()
+        casbah = KnowledgeBase.objects.get(title='Casbah of Algiers')
+        latest = KnowledgeBase.objects.latest('updated_at').updated_at
+        # Same row count and newest updated_at, so the fingerprint does not change
+        KnowledgeBase.objects.filter(pk=casbah.pk).update(
+            content='Ottoman palaces of the Mzab valley', updated_at=latest - timedelta(seconds=1)
+        )
+        results = RAGService(provider).search_knowledge_base('ottoman palaces')
+        self.assertEqual(results[0]['title'], 'Casbah of Algiers')
+
+        with mock.patch('chatbot.services.RAG_INDEX_SYNC_MARGIN', 0):
+            with mock.patch.object(provider, '_sync') as sync:
+                provider.get()
+        sync.assert_not_called()
+
+class IncrementalKnowledgeIndexTestCase(KnowledgeBaseTestMixin, TestCase):
+    """Test incremental updates of the shared knowledge base index"""
+
+    def setUp(self):
+        super().setUp()
+        for i in range(10):
+            self.create_entry(f'Beach {i}', f'Mediterranean beach number {i} near Oran')
+        self.casbah = self.create_entry('Casbah of Algiers', 'Historic citadel overlooking the bay')
+        self.index = shared_knowledge_index.get()
+
+    def test_new_entry_appended_without_refit(self):
+        """Test that saving an entry appends a row using the fitted vocabulary"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_entry('Casbah museum', 'Museum inside the historic citadel')
+        index = shared_knowledge_index.get().partitions['en']
+        self.assertIs(index.vectorizer, self.index.partitions['en'].vectorizer)
+        self.assertEqual(index.vectors.shape[0], self.index.partitions['en'].vectors.shape[0] + 1)
+        titles = [r['title'] for r in RAGService().search_knowledge_base('historic citadel')]
+        self.assertIn('Casbah museum', titles)
+
+    def test_deactivated_entry_removed(self):
+        """Test that deactivating an entry masks it out of searches"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.casbah.is_active = False
+            self.casbah.save()
+        self.assertEqual(RAGService().search_knowledge_base('historic citadel'), [])
+        self.assertNotIn(self.casbah.id, shared_knowledge_index.get().positions)
+
+    def test_edited_entry_replaced(self):
+        """Test that editing an entry replaces its row"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.casbah.content = 'Ottoman palace and narrow streets'
+            self.casbah.save()
+        index = shared_knowledge_index.get().partitions['en']
+        self.assertEqual(len(index), 11)
+        self.assertEqual(index.documents[index.positions[self.casbah.id]]['content'], 'Ottoman palace and narrow streets')
+
+    def test_changes_from_other_workers_synced(self):
+        """Test that rows changed behind the signals' back are synced"""
+        KnowledgeBase.objects.filter(id=self.casbah.id).update(is_active=False, updated_at=self.casbah.updated_at)
+        shared_knowledge_index.invalidate()
+        self.assertNotIn(self.casbah.id, shared_knowledge_index.get().positions)
+
+    def test_compaction_refits_vocabulary(self):
+        """Test that many incremental changes trigger a full refit"""
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                self.create_entry(f'Oasis {i}', 'Palm groves of Timimoun')
+        index = shared_knowledge_index.get()
+        self.assertIsNot(index.partitions['en'].vectorizer, self.index.partitions['en'].vectorizer)
+        self.assertEqual(index.pending_changes, 0)
+        self.assertIn('timimoun', index.partitions['en'].vectorizer.vocabulary_)
+
+
+class BulkKnowledgeBaseOperationsTestCase(KnowledgeBaseTestMixin, APITestCase):
+    """Test that bulk operations keep the search index in sync"""
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='adminpass123'
+        )
+        self.client.force_authenticate(user=self.admin)
+        self.entry = self.create_entry('Djemila', 'Roman ruins in the mountains')
+        shared_knowledge_index.get()
+
+    def test_bulk_deactivate_and_activate(self):
+        """Test bulk deactivation removes rows and activation restores them"""
+        url = reverse('chatbot:knowledge-base-bulk-operations')
+        self.client.post(url, {'document_ids': [self.entry.id], 'action': 'deactivate'}, format='json')
+        self.assertEqual(RAGService().search_knowledge_base('roman ruins'), [])
+        self.client.post(url, {'document_ids': [self.entry.id], 'action': 'activate'}, format='json')
+        self.assertEqual(RAGService().search_knowledge_base('roman ruins')[0]['id'], self.entry.id)
+
+    def test_bulk_deactivate_updates_dense_index(self):
+        """Test that dense search stops returning deactivated rows right away"""
+        rag_service = RAGService(embedding_service=EmbeddingService('hashing'))
+        compute_knowledge_embeddings(rag_service.embedding_service)
+        self.assertEqual(rag_service.search_knowledge_base('roman ruins', mode='dense')[0]['id'], self.entry.id)
+        url = reverse('chatbot:knowledge-base-bulk-operations')
+        self.client.post(url, {'document_ids': [self.entry.id], 'action': 'deactivate'}, format='json')
+        self.assertEqual(rag_service.search_knowledge_base('roman ruins', mode='dense', min_similarity=-1), [])
+
+
+def is_memory_mapped(array):
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+class KnowledgeIndexArtifactTestCase(KnowledgeBaseTestMixin, TestCase):
+    """Test writing and memory-mapping the on-disk index artifact"""
+
+    def setUp(self):
+        super().setUp()
+        self.create_entry('Tassili n\'Ajjer', 'Rock art and sandstone forests in the desert')
+        self.create_entry('Tipaza', 'Roman ruins on the Mediterranean coast')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        call_command('build_knowledge_index', output=self.directory, stdout=StringIO())
+
+    def test_load_memory_maps_matrix(self):
+        """Test that the loaded matrix is backed by the artifact files"""
+        index = KnowledgeIndex.load(self.directory)
+        self.assertEqual(len(index), 2)
+        self.assertTrue(is_memory_mapped(index.partitions['en'].vectors.data))
+        self.assertFalse(index.partitions['en'].vectors.data.flags.writeable)
+
+    def test_shared_index_starts_from_artifact(self):
+        """Test that a worker loads the artifact instead of refitting"""
+        provider = SharedKnowledgeIndex(artifact_dir=self.directory)
+        index = provider.get()
+        self.assertTrue(is_memory_mapped(index.partitions['en'].vectors.indices))
+        results = RAGService(provider).search_knowledge_base('roman ruins coast')
+        self.assertEqual(results[0]['title'], 'Tipaza')
+
+    def test_stale_artifact_is_synced(self):
+        """Test that rows changed after the artifact was built are synced"""
+        self.create_entry('Ghardaia', 'Mzab valley and its ksour')
+        provider = SharedKnowledgeIndex(artifact_dir=self.directory, compact_in_background=False)
+        results = RAGService(provider).search_knowledge_base('mzab valley')
+        self.assertEqual(results[0]['title'], 'Ghardaia')
+
+    def test_missing_artifact(self):
+        """Test that loading from an empty directory returns None"""
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(KnowledgeIndex.load(directory))
+
+
+class DenseRetrievalTestCase(KnowledgeBaseTestMixin, TestCase):
+    """Test dense embedding storage and retrieval"""
+
+    def setUp(self):
+        super().setUp()
+        self.embedding_service = EmbeddingService('hashing')
+        self.sahara = self.create_entry('Sahara Desert', 'Camel trekking among the dunes of the Sahara')
+        self.oran = self.create_entry('Oran', 'Port city famous for rai music', 'cultural_info')
+
+    def test_embeddings_stored_as_float32_blobs(self):
+        """Test that embeddings are packed as raw float32 bytes"""
+        self.assertEqual(compute_knowledge_embeddings(self.embedding_service), 2)
+        self.sahara.refresh_from_db()
+        vector = decode_embedding(self.sahara.embedding)
+        self.assertEqual(vector.dtype, np.float32)
+        self.assertEqual(len(bytes(self.sahara.embedding)), vector.size * 4)
+        self.assertEqual(self.sahara.embedding_model, self.embedding_service.model_name)
+        self.assertAlmostEqual(float(np.linalg.norm(vector)), 1.0, places=5)
+
+    def test_only_stale_entries_reembedded(self):
+        """Test that the batch job skips up-to-date embeddings"""
+        compute_knowledge_embeddings(self.embedding_service)
+        self.assertEqual(compute_knowledge_embeddings(self.embedding_service), 0)
+        self.oran.content = 'Port city and birthplace of rai music'
+        self.oran.save()
+        self.assertEqual(compute_knowledge_embeddings(self.embedding_service), 1)
+
+    @mock.patch('chatbot.services.RAG_INDEX_COMPACT_RATIO', 10.0)
+    def test_dense_index_synced_without_rebuild(self):
+        """Test that rows changed after the build are applied to the dense index in place"""
+        compute_knowledge_embeddings(self.embedding_service)
+        rag_service = RAGService(embedding_service=self.embedding_service)
+        rag_service.search_knowledge_base('rai music', mode='dense')
+        with mock.patch('chatbot.embeddings.DenseVectorIndex.build') as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.create_entry('Tassili', 'Rock art and sandstone arches in the desert')
+            compute_knowledge_embeddings(self.embedding_service)
+            shared_dense_index.invalidate()
+            results = rag_service.search_knowledge_base('rock art sandstone arches', mode='dense')
+            self.assertEqual(results[0]['title'], 'Tassili')
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.oran.is_active = False
+                self.oran.save()
+            results = rag_service.search_knowledge_base('rai music', mode='dense', min_similarity=-1)
+            self.assertNotIn('Oran', [r['title'] for r in results])
+        build.assert_not_called()
+        index = shared_dense_index.get(self.embedding_service.model_name)
+        self.assertEqual((len(index), index.pending_changes), (2, 2))
+
+    def test_dense_index_compacted_after_changes(self):
+        """Test that enough synced changes trigger a rebuild of the matrix"""
+        compute_knowledge_embeddings(self.embedding_service)
+        model_name = self.embedding_service.model_name
+        shared_dense_index.get(model_name)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.oran.delete()
+        index = shared_dense_index.get(model_name)
+        self.assertEqual((len(index.documents), index.pending_changes), (1, 0))
+
+    def test_dense_search(self):
+        """Test cosine top-k search over the dense index"""
+        compute_knowledge_embeddings(self.embedding_service)
+        rag_service = RAGService(embedding_service=self.embedding_service)
+        results = rag_service.search_knowledge_base('camel trekking dunes', mode='dense')
+        self.assertEqual(results[0]['title'], 'Sahara Desert')
+        results = rag_service.search_knowledge_base(
+            'camel trekking dunes', content_type='cultural_info', mode='dense', min_similarity=-1
+        )
+        self.assertEqual([r['title'] for r in results], ['Oran'])
+
+    def test_dense_search_falls_back_without_embeddings(self):
+        """Test that dense mode uses TF-IDF until embeddings exist"""
+        rag_service = RAGService(embedding_service=self.embedding_service)
+        results = rag_service.search_knowledge_base('rai music', mode='dense')
+        self.assertEqual(results[0]['title'], 'Oran')
+
+
+class HybridRetrievalTestCase(KnowledgeBaseTestMixin, TestCase):
+    """Test BM25 scoring and fused BM25 + dense retrieval"""
+
+    def setUp(self):
+        super().setUp()
+        self.embedding_service = EmbeddingService('hashing')
+        self.create_entry('Sahara Desert', 'Camel trekking among the dunes of the Sahara')
+        self.create_entry('Oran', 'Port city famous for rai music', 'cultural_info')
+        self.create_entry('Tassili', 'Rock art and sandstone dunes in the desert south')
+        self.rag_service = RAGService(embedding_service=self.embedding_service)
+
+    def test_bm25_search(self):
+        """Test that BM25 ranks entries by matched query terms"""
+        results = self.rag_service.search_knowledge_base('camel dunes', mode='bm25')
+        self.assertEqual(results[0]['title'], 'Sahara Desert')
+        self.assertEqual(len(results), 2)
+        self.assertEqual(self.rag_service.search_knowledge_base('zzz', mode='bm25'), [])
+
+    def test_bm25_rows_appended_incrementally(self):
+        """Test that entries added after the fit are scored with BM25"""
+        shared_knowledge_index.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_entry('Timgad', 'Roman ruins of camel caravans', 'historical_info')
+        index = shared_knowledge_index.get().partitions['en']
+        self.assertEqual(index.bm25.shape[0], len(index.documents))
+        results = self.rag_service.search_knowledge_base('roman ruins', mode='bm25')
+        self.assertEqual(results[0]['title'], 'Timgad')
+
+    def test_hybrid_search_fuses_rankings(self):
+        """Test that hybrid mode returns documents found by either ranking"""
+        compute_knowledge_embeddings(self.embedding_service)
+        results = self.rag_service.search_knowledge_base('camel trekking dunes', mode='hybrid')
+        self.assertEqual(results[0]['title'], 'Sahara Desert')
+        self.assertEqual(len({r['id'] for r in results}), len(results))
+        results = self.rag_service.search_knowledge_base(
+            'camel trekking dunes', content_type='cultural_info', mode='hybrid', min_similarity=-1
+        )
+        self.assertEqual([r['title'] for r in results], ['Oran'])
+
+    def test_hybrid_search_without_embeddings(self):
+        """Test that hybrid mode uses BM25 alone until embeddings exist"""
+        results = self.rag_service.search_knowledge_base('rai music', mode='hybrid')
+        self.assertEqual([r['title'] for r in results], ['Oran'])
+
+    def test_relevant_context_uses_hybrid_retrieval(self):
+        """Test that the context window is packed from hybrid results"""
+        compute_knowledge_embeddings(self.embedding_service)
+        context = self.rag_service.get_relevant_context('rai music in Oran')
+        self.assertTrue(context.startswith('Title: Oran'))
+
+    def test_fusion(self):
+        """Test reciprocal-rank and weighted score fusion"""
+        a, b, c = ({'id': i} for i in range(3))
+        lexical = [(a, 12.0), (b, 3.0)]
+        dense = [(b, 0.9), (c, 0.8)]
+        self.assertEqual([doc['id'] for doc, _ in reciprocal_rank_fusion([lexical, dense])], [1, 0, 2])
+        fused = weighted_score_fusion([lexical, dense], [0.8, 0.2])
+        self.assertEqual([doc['id'] for doc, _ in fused], [0, 1, 2])
+
+
+class ApproximateNearestNeighbourTestCase(TestCase):
+    """Test the exact and IVF nearest-neighbour backends"""
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        # Clustered data, like knowledge base entries grouped by topic
+        centers = rng.normal(size=(20, 32))
+        matrix = np.repeat(centers, 100, axis=0) + rng.normal(scale=0.3, size=(2000, 32))
+        self.matrix = (matrix / np.linalg.norm(matrix, axis=1, keepdims=True)).astype(np.float32)
+        self.queries = self.matrix[rng.choice(2000, 20, replace=False)] + rng.normal(scale=0.1, size=(20, 32))
+
+    def test_small_corpus_uses_exact_search(self):
+        """Test the fallback to exact search below the size threshold"""
+        self.assertIsInstance(build_ann_index(self.matrix, backend='ivf', min_rows=5000), ExactSearchIndex)
+        self.assertIsInstance(build_ann_index(self.matrix, backend='ivf', min_rows=100), IVFIndex)
+
+    def test_probing_every_list_matches_exact_search(self):
+        """Test that IVF with all clusters probed returns the exact top-k"""
+        ivf = IVFIndex.fit(self.matrix, n_lists=16, n_probe=16)
+        for query in self.queries:
+            exact, _ = ExactSearchIndex().search(self.matrix, query, 10)
+            approx, _ = ivf.search(self.matrix, query, 10)
+            self.assertEqual(list(approx), list(exact))
+
+    def test_recall_with_few_probes(self):
+        """Test that probing a few clusters keeps recall high"""
+        ivf = IVFIndex.fit(self.matrix, n_lists=40, n_probe=4)
+        hits = 0
+        for query in self.queries:
+            exact, _ = ExactSearchIndex().search(self.matrix, query, 10)
+            approx, _ = ivf.search(self.matrix, query, 10)
+            hits += len(set(exact) & set(approx))
+        self.assertGreaterEqual(hits / (10 * len(self.queries)), 0.9)
+
+    def test_mask_respected(self):
+        """Test that masked-out rows are never returned"""
+        ivf = IVFIndex.fit(self.matrix, n_lists=40, n_probe=2)
+        mask = np.zeros(len(self.matrix), dtype=bool)
+        mask[::50] = True
+        rows, _ = ivf.search(self.matrix, self.queries[0], 5, mask)
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(mask[rows].all())
+
+    def test_extend_assigns_new_rows(self):
+        """Test that appended rows are searchable without refitting"""
+        ivf = IVFIndex.fit(self.matrix, n_lists=16, n_probe=16)
+        extended = ivf.extend(self.queries[:1])
+        matrix = np.vstack([self.matrix, self.queries[:1] / np.linalg.norm(self.queries[0])])
+        rows, _ = extended.search(matrix, self.queries[0], 1)
+        self.assertEqual(rows[0], len(self.matrix))
+
+
+@mock.patch('chatbot.ann.RAG_ANN_MIN_ROWS', 0)
+@mock.patch('chatbot.ann.RAG_ANN_BACKEND', 'ivf')
+class KnowledgeIndexANNTestCase(KnowledgeBaseTestMixin, TestCase):
+    """Test knowledge base search through the IVF backend"""
+
+    def setUp(self):
+        super().setUp()
+        self.create_entry('Tlemcen', 'Great Mosque and Mansourah ruins')
+        self.create_entry('Constantine', 'City of bridges over the Rhumel gorge')
+        self.create_entry('Bejaia', 'Yemma Gouraya and Cap Carbon lighthouse')
+
+    def test_search_through_ivf(self):
+        """Test that searches use the IVF index when configured"""
+        index = shared_knowledge_index.get().partitions['en']
+        self.assertIsInstance(index.ann, IVFIndex)
+        results = RAGService().search_knowledge_base('bridges gorge')
+        self.assertEqual(results[0]['title'], 'Constantine')
+
+    def test_bm25_not_searched_through_tfidf_clusters(self):
+        """Test that BM25 scores every row instead of probing the TF-IDF clusters"""
+        shared_knowledge_index.get()
+        with mock.patch.object(IVFIndex, 'search') as search:
+            results = RAGService().search_knowledge_base('lighthouse', mode='bm25')
+        search.assert_not_called()
+        self.assertEqual(results[0]['title'], 'Bejaia')
+
+    def test_clustering_saved_with_artifact(self):
+        """Test that the IVF clustering is stored in the index artifact"""
+        with tempfile.TemporaryDirectory() as directory:
+            shared_knowledge_index.get().save(directory)
+            index = KnowledgeIndex.load(directory).partitions['en']
+            self.assertIsInstance(index.ann, IVFIndex)
+            self.assertEqual(len(index.ann.assignments), 3)
+
+
+class FilteredSearchTestCase(KnowledgeBaseTestMixin, TestCase):
+    """Test facet-filtered knowledge base search"""
+
+    def setUp(self):
+        super().setUp()
+        self.oran = Province.objects.create(name='Oran', description='Western coastal province')
+        self.algiers = Province.objects.create(name='Algiers', description='Capital province')
+        self.create_entry('Santa Cruz Fort', 'Fort overlooking the bay', 'historical_info', related_province=self.oran)
+        self.create_entry('Notre-Dame d\'Afrique', 'Basilica overlooking the bay', 'historical_info', related_province=self.algiers)
+        self.create_entry('Baie d\'Alger', 'La baie et le port', 'general', related_province=self.algiers, language='fr')
+
+    def test_facet_mask(self):
+        """Test vectorised facet masks, including appended rows"""
+        facets = FacetIndex.from_documents([
+            {'content_type': 'general', 'source_type': None, 'language': 'en', 'related_province_id': 1},
+            {'content_type': 'events', 'source_type': None, 'language': 'fr', 'related_province_id': 1},
+        ])
+        self.assertIsNone(facets.mask(content_type=None, language=''))
+        self.assertEqual(list(facets.mask(related_province_id=1, language='fr')), [False, True])
+        self.assertFalse(facets.mask(content_type='unknown').any())
+        extended = facets.extend([{'content_type': 'events', 'language': 'en'}])
+        self.assertEqual(list(extended.mask(content_type='events')), [False, True, True])
+
+    def test_filter_by_province(self):
+        """Test restricting results to one province"""
+        results = RAGService().search_knowledge_base('overlooking the bay', province_id=self.oran.id)
+        self.assertEqual([r['title'] for r in results], ['Santa Cruz Fort'])
+
+    def test_filter_by_language_and_content_type(self):
+        """Test combining language and content type filters"""
+        rag_service = RAGService()
+        self.assertEqual(rag_service.search_knowledge_base('bay', language='fr', content_type='historical_info'), [])
+        results = rag_service.search_knowledge_base('baie port', language='fr')
+        self.assertEqual([r['title'] for r in results], ['Baie d\'Alger'])
+
+    def test_filters_apply_to_incremental_rows(self):
+        """Test that rows appended after the fit are filtered correctly"""
+        shared_knowledge_index.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_entry('Le Corniche', 'Fort and bay promenade', 'general', related_province=self.oran)
+        results = RAGService().search_knowledge_base('fort bay', province_id=self.oran.id, content_type='general')
+        self.assertEqual([r['title'] for r in results], ['Le Corniche'])
+
+
+class MultilingualSearchTestCase(KnowledgeBaseTestMixin, TestCase):
+    """Test per-language knowledge base partitions and query routing"""
+
+    def setUp(self):
+        super().setUp()
+        self.create_entry('Museums of Algiers', 'The best museums in Algiers and the Bardo museum')
+        self.create_entry('Musées d\'Alger', 'Les meilleurs musées d\'Alger et le musée du Bardo', language='fr')
+        self.create_entry('متاحف الجزائر', 'أفضل المتاحف في الجزائر العاصمة ومتحف باردو', language='ar')
+
+    def test_detect_language(self):
+        """Test the script and stop word based language guess"""
+        self.assertEqual(detect_language('ما هي أفضل المتاحف في الجزائر؟'), 'ar')
+        self.assertEqual(detect_language('Quels sont les meilleurs musées à Alger ?'), 'fr')
+        self.assertEqual(detect_language('Where are the best museums?'), 'en')
+        self.assertEqual(detect_language('Bardo', default='fr'), 'fr')
+        self.assertEqual(normalize_language('fr-FR'), 'fr')
+
+    def test_entries_partitioned_by_language(self):
+        """Test that each language gets its own partition and analyzer"""
+        index = shared_knowledge_index.get()
+        self.assertEqual(sorted(index.partitions), ['ar', 'en', 'fr'])
+        self.assertEqual([len(index.partitions[language]) for language in ('ar', 'en', 'fr')], [1, 1, 1])
+        # Accents folded, French stop words dropped
+        self.assertIn('musee', index.partitions['fr'].vectorizer.vocabulary_)
+        self.assertNotIn('les', index.partitions['fr'].vectorizer.vocabulary_)
+        # Definite article stripped and letter variants folded
+        self.assertIn('متاحف', index.partitions['ar'].vectorizer.vocabulary_)
+        self.assertIn('افضل', index.partitions['ar'].vectorizer.vocabulary_)
+
+    def test_queries_routed_to_their_language(self):
+        """Test that a query only scores entries in its own language"""
+        rag_service = RAGService()
+        for query, title in (
+            ('best museums in Algiers', 'Museums of Algiers'),
+            ('les musees d\'Alger', 'Musées d\'Alger'),
+            ('المتاحف في الجزائر', 'متاحف الجزائر'),
+        ):
+            for mode in ('tfidf', 'bm25'):
+                results = rag_service.search_knowledge_base(query, mode=mode)
+                self.assertEqual([r['title'] for r in results], [title])
+
+    def test_explicit_language_filter_wins(self):
+        """Test that a language filter picks the partition over detection"""
+        results = RAGService().search_knowledge_base('Bardo', language='fr')
+        self.assertEqual([r['title'] for r in results], ['Musées d\'Alger'])
+        self.assertEqual(RAGService().search_knowledge_base('Bardo', language='de'), [])
+
+    def test_language_filter_matches_regional_codes(self):
+        """Test that language filters and stored languages compare by their primary subtag"""
+        self.create_entry('Musée du Bardo', 'Le musée du Bardo et ses collections', language='fr-FR')
+        for language in ('fr', 'fr-FR', 'FR_ca'):
+            results = RAGService().search_knowledge_base('Bardo collections', language=language)
+            self.assertIn('Musée du Bardo', [r['title'] for r in results])
+
+    def test_language_change_moves_entry(self):
+        """Test that editing an entry's language moves it between partitions"""
+        entry = self.create_entry('Djemila', 'Ruines romaines dans les montagnes')
+        shared_knowledge_index.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.language = 'fr'
+            entry.save()
+        index = shared_knowledge_index.get()
+        self.assertEqual(index.positions[entry.id], 'fr')
+        self.assertNotIn(entry.id, index.partitions['en'].positions)
+        results = RAGService().search_knowledge_base('les ruines romaines')
+        self.assertEqual([r['title'] for r in results], ['Djemila'])
+
+
+class ChatMessageStreamTestCase(KnowledgeBaseTestMixin, APITestCase):
+    """Test the Server-Sent Events chat endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='traveller', email='traveller@example.com', password='travelpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('chatbot:chat-message-stream')
+
+    def stream(self, content):
+        response = self.client.post(
+            self.url, {'content': content, 'message_type': 'user'},
+            format='json', HTTP_ACCEPT='text/event-stream'
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        return [
+            (event.split('\n')[0][len('event: '):], json.loads(event.split('\n')[1][len('data: '):]))
+            for event in body.strip().split('\n\n')
+        ]
+
+    @mock.patch('chatbot.services.ollama.generate')
+    def test_tokens_streamed_and_message_saved(self, generate):
+        """Test that tokens are relayed as they arrive and the answer is stored"""
+        generate.return_value = iter([{'response': 'Visit '}, {'response': 'the Casbah'}, {'response': ''}])
+        events = self.stream('Where should I go in Algiers?')
+
+        self.assertEqual([name for name, _ in events], ['message', 'token', 'token', 'done'])
+        self.assertEqual(events[1][1]['content'], 'Visit ')
+        done = events[-1][1]
+        self.assertEqual(done['response'], 'Visit the Casbah')
+        self.assertTrue(generate.call_args.kwargs['stream'])
+
+        message = ChatMessage.objects.get(id=done['message_id'])
+        self.assertEqual(message.message_type, 'assistant')
+        self.assertEqual(message.content, 'Visit the Casbah')
+        self.assertIsNotNone(message.time_to_first_token_ms)
+        self.assertLessEqual(message.time_to_first_token_ms, message.processing_time_ms)
+        self.assertEqual(done['time_to_first_token_ms'], message.time_to_first_token_ms)
+        self.assertGreater(message.prompt_tokens, count_tokens(SYSTEM_PROMPT))
+
+    @mock.patch('chatbot.services.ollama.generate', side_effect=ConnectionError('offline'))
+    def test_falls_back_when_model_unavailable(self, generate):
+        """Test that the rule-based answer is streamed when no model responds"""
+        with self.assertLogs('chatbot.services', 'WARNING'):
+            events = self.stream('hello')
+        self.assertEqual([name for name, _ in events], ['message', 'token', 'done'])
+        message = ChatMessage.objects.get(id=events[-1][1]['message_id'])
+        self.assertEqual(message.model_used, 'fallback')
+
+
+class AsyncChatMessageTestCase(KnowledgeBaseTestMixin, TestCase):
+    """Test the async chat endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='traveller', email='traveller@example.com', password='travelpass123'
+        )
+        self.url = reverse('chatbot:chat-message-async')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    @mock.patch('chatbot.services.ollama.AsyncClient')
+    def test_response_awaited_and_saved(self, async_client):
+        """Test that the LLM is awaited and both messages are stored"""
+        async_client.return_value.generate = mock.AsyncMock(return_value={'response': ' Try the Casbah. '})
+        response = self.client.post(
+            self.url, {'content': 'Where should I go in Algiers?', 'message_type': 'user'},
+            content_type='application/json', **self.auth
+        )
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['response'], 'Try the Casbah.')
+
+        message = ChatMessage.objects.get(id=data['message_id'])
+        self.assertEqual(message.session_id, data['session_id'])
+        self.assertEqual(message.model_used, ChatbotService().ollama_model)
+        self.assertEqual(
+            list(message.session.messages.values_list('message_type', flat=True)), ['user', 'assistant']
+        )
+
+    def test_requires_authentication(self):
+        """Test that requests without a valid token are rejected"""
+        response = self.client.post(self.url, {'content': 'hello'}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post(
+            self.url, {'content': 'hello'}, content_type='application/json',
+            HTTP_AUTHORIZATION='Bearer invalid'
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_invalid_message(self):
+        """Test that validation errors are returned"""
+        response = self.client.post(self.url, {}, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('content', response.json())
+
+
+class ResponseCacheTestCase(KnowledgeBaseTestMixin, TestCase):
+    """Test the semantic chatbot response cache"""
+
+    def setUp(self):
+        super().setUp()
+        self.cache = ResponseCache(max_entries=2, ttl=60, similarity_threshold=0.8)
+        self.context = 'Title: Visa\nContent: Most visitors need a visa.'
+        self.answer = {'response': 'Apply for an e-visa.', 'model_used': 'llama2:chat'}
+
+    def test_exact_and_near_duplicate_hits(self):
+        """Test normalised and reworded questions reuse the cached answer"""
+        self.cache.set('What are the visa requirements?', self.context, self.answer)
+        self.assertEqual(self.cache.get('what are the VISA requirements', self.context), self.answer)
+        self.assertEqual(self.cache.get('what are visa requirements?', self.context), self.answer)
+        self.assertIsNone(self.cache.get('best time to visit the Sahara', self.context))
+
+    def test_scoped_by_context_and_history(self):
+        """Test that answers are not reused for a different prompt"""
+        history = [{'role': 'user', 'content': 'Hi'}, {'role': 'assistant', 'content': 'Hello!'}]
+        self.cache.set('visa requirements', self.context, self.answer)
+        self.assertIsNone(self.cache.get('visa requirements', 'Title: Oran'))
+        self.assertIsNone(self.cache.get('visa requirements', self.context, history))
+        # The question itself at the end of the history is not part of the scope
+        current = [{'role': 'user', 'content': 'visa requirements'}]
+        self.assertEqual(self.cache.get('visa requirements', self.context, current), self.answer)
+
+    def test_ttl_and_lru_eviction(self):
+        """Test that expired and least recently used entries are dropped"""
+        self.cache.set('visa requirements', self.context, self.answer)
+        self.cache.set('weather in Oran', self.context, self.answer)
+        self.cache.get('visa requirements', self.context)
+        self.cache.set('getting around', self.context, self.answer)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('weather in Oran', self.context))
+        with mock.patch('chatbot.response_cache.time.monotonic', return_value=time.monotonic() + 120):
+            self.assertIsNone(self.cache.get('visa requirements', self.context))
+
+    @mock.patch('chatbot.services.ollama.generate', return_value={'response': 'Apply online.'})
+    def test_chatbot_service_uses_cache(self, generate):
+        """Test that repeated questions skip the LLM until the knowledge base changes"""
+        chatbot_service = ChatbotService()
+        first = chatbot_service.generate_response('Visa requirements?', self.context)
+        second = chatbot_service.generate_response('visa requirements', self.context)
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(second['response'], first['response'])
+        self.assertTrue(second['cached'])
+        self.assertEqual(second['model_used'], 'cache')
+        self.assertNotEqual(first['model_used'], 'cache')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_entry('Visa', 'E-visas are issued within a week')
+        chatbot_service.generate_response('visa requirements', self.context)
+        self.assertEqual(generate.call_count, 2)
+
+    @mock.patch('chatbot.services.ollama.generate', side_effect=ConnectionError('offline'))
+    def test_fallback_answers_not_cached(self, generate):
+        """Test that rule-based answers given while the LLM is down are not cached"""
+        with self.assertLogs('chatbot.services', 'WARNING'):
+            ChatbotService().generate_response('hello', '')
+        self.assertEqual(len(response_cache), 0)
+
+
+class GenerationSchedulerTestCase(TestCase):
+    """Test the LLM concurrency limiter and prompt coalescing"""
+
+    def run_in_threads(self, scheduler, keys, call):
+        results = [None] * len(keys)
+
+        def worker(i, key):
+            results[i] = scheduler.run(key, call)
+
+        threads = [threading.Thread(target=worker, args=(i, key)) for i, key in enumerate(keys)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_max_in_flight(self):
+        """Test that no more than max_in_flight calls run at once"""
+        scheduler = GenerationScheduler(max_in_flight=2, queue_timeout=5)
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def call():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+            return 'ok'
+
+        threads, results = self.run_in_threads(scheduler, [f'prompt-{i}' for i in range(6)], call)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['ok'] * 6)
+        self.assertLessEqual(max(peak), 2)
+        metrics = scheduler.metrics()
+        self.assertEqual(metrics['started'], 6)
+        self.assertEqual((metrics['in_flight'], metrics['queue_depth']), (0, 0))
+        self.assertGreater(metrics['max_wait_ms'], 0)
+
+    def test_identical_prompts_coalesced(self):
+        """Test that concurrent identical prompts share one call"""
+        scheduler = GenerationScheduler(max_in_flight=2, queue_timeout=5)
+        release = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            release.wait(5)
+            return {'response': 'Visit Oran'}
+
+        threads, results = self.run_in_threads(scheduler, ['same'] * 4, call)
+        while scheduler.metrics()['coalesced'] < 3:
+            time.sleep(0.005)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'response': 'Visit Oran'}] * 4)
+
+    def test_queue_timeout(self):
+        """Test that prompts waiting too long for a slot give up"""
+        scheduler = GenerationScheduler(max_in_flight=1, queue_timeout=0.05)
+        with scheduler.slot():
+            with self.assertRaises(GenerationQueueTimeout):
+                scheduler.run('prompt', lambda: 'never')
+        self.assertEqual(scheduler.metrics()['queue_timeouts'], 1)
+        self.assertEqual(scheduler.run('prompt', lambda: 'ok'), 'ok')
+
+    def test_async_coalescing(self):
+        """Test that awaited identical prompts share one call"""
+        scheduler = GenerationScheduler(max_in_flight=1, queue_timeout=5)
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'ok'
+
+        async def main():
+            return await asyncio.gather(*(scheduler.arun('same', call) for _ in range(3)))
+
+        self.assertEqual(asyncio.run(main()), ['ok'] * 3)
+        self.assertEqual(len(calls), 1)
+
+    def test_cancelled_leader_releases_followers(self):
+        """Test that cancelling the call others joined fails them instead of leaving them waiting"""
+        scheduler = GenerationScheduler(max_in_flight=1, queue_timeout=5)
+
+        async def main():
+            leader = asyncio.ensure_future(scheduler.arun('same', lambda: asyncio.sleep(10)))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(scheduler.arun('same', lambda: asyncio.sleep(0, 'unused')))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            with self.assertRaises(GenerationAbandoned):
+                await asyncio.wait_for(follower, 1)
+
+        asyncio.run(main())
+        self.assertEqual(scheduler.run('same', lambda: 'ok'), 'ok')
+        metrics = scheduler.metrics()
+        self.assertEqual((metrics['in_flight'], metrics['queue_depth']), (0, 0))
+
+
+class CircuitBreakerTestCase(KnowledgeBaseTestMixin, TestCase):
+    """Test LLM circuit breakers and hedged requests"""
+
+    def test_breaker_opens_and_recovers(self):
+        """Test the closed -> open -> half-open -> closed cycle"""
+        breaker = CircuitBreaker('ollama', window=10, min_calls=4, failure_rate=0.5, cooldown=30)
+        for _ in range(2):
+            breaker.record_success(0.1)
+        with self.assertLogs('chatbot.services', 'WARNING'):
+            for _ in range(2):
+                breaker.record_failure(5.0)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        later = time.monotonic() + 31
+        with mock.patch('chatbot.services.time.monotonic', return_value=later):
+            self.assertTrue(breaker.allow_request())
+            # Only a single probe is let through
+            self.assertFalse(breaker.allow_request())
+            breaker.record_success(0.2)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.metrics()['recent_failures'], 0)
+
+    @mock.patch('chatbot.services.ollama.generate', side_effect=ConnectionError('offline'))
+    def test_open_circuit_routes_to_fallback(self, generate):
+        """Test that an open circuit skips the backend without calling it"""
+        chatbot_service = ChatbotService()
+        with self.assertLogs('chatbot.services', 'WARNING'):
+            for _ in range(5):
+                chatbot_service.generate_response('hello', '')
+        self.assertEqual(generate.call_count, 5)
+        self.assertTrue(circuit_breakers.get('ollama').is_open)
+
+        result = chatbot_service.generate_response('hello', '')
+        self.assertEqual(generate.call_count, 5)
+        self.assertEqual(result['model_used'], 'fallback')
+
+    @mock.patch('chatbot.services.LLM_HEDGE_MIN_DELAY', 0.01)
+    @mock.patch('chatbot.services.openai.ChatCompletion.create')
+    @mock.patch('chatbot.services.ollama.generate')
+    def test_slow_backend_hedged(self, generate, create):
+        """Test that a call slower than the backend's p95 is hedged to the next backend"""
+        generate.side_effect = lambda **kwargs: time.sleep(0.3) or {'response': 'Slow answer'}
+        create.return_value = mock.Mock(choices=[mock.Mock(message=mock.Mock(content='Hedged answer'))])
+        breaker = circuit_breakers.get('ollama')
+        for _ in range(breaker.min_calls):
+            breaker.record_success(0.01)
+
+        chatbot_service = ChatbotService()
+        chatbot_service.use_openai = True
+        result = chatbot_service.generate_response('best time to visit', '')
+        self.assertEqual(result['response'], 'Hedged answer')
+        self.assertEqual(result['model_used'], chatbot_service.openai_model)
+        self.assertEqual(generate.call_count, 1)
+
+
+    @mock.patch('chatbot.services.LLM_HEDGE_MIN_DELAY', 0.01)
+    @mock.patch('chatbot.services.openai.ChatCompletion.create')
+    @mock.patch('chatbot.services.ollama.generate')
+    def test_refused_hedge_still_tried_as_fallback(self, generate, create):
+        """Test that a backend whose breaker refused the hedge is tried once the primary fails"""
+        def slow_failure(**kwargs):
+            time.sleep(0.1)
+            raise ConnectionError('reset')
+
+        generate.side_effect = slow_failure
+        create.return_value = mock.Mock(choices=[mock.Mock(message=mock.Mock(content='Fallback answer'))])
+        breaker = circuit_breakers.get('ollama')
+        for _ in range(breaker.min_calls):
+            breaker.record_success(0.01)
+
+        chatbot_service = ChatbotService()
+        chatbot_service.use_openai = True
+        openai_breaker = circuit_breakers.get('openai')
+        with mock.patch.object(openai_breaker, 'allow_request', side_effect=[False, True]):
+            with self.assertLogs('chatbot.services', 'WARNING'):
+                result = chatbot_service.generate_response('best time to visit', '')
+        self.assertEqual(result['response'], 'Fallback answer')
+        self.assertEqual(create.call_count, 1)
+
+    def open_breaker(self, name):
+        breaker = circuit_breakers.get(name)
+        with self.assertLogs('chatbot.services', 'WARNING'):
+            for _ in range(breaker.min_calls):
+                breaker.record_failure(1.0)
+        breaker._opened_at -= breaker.cooldown
+        return breaker
+
+    @mock.patch('chatbot.services.ollama.generate')
+    def test_abandoned_stream_probe_released(self, generate):
+        """Test that a half-open probe whose client disconnects mid-stream still settles the breaker"""
+        generate.return_value = iter([{'response': 'Visit '}, {'response': 'the Casbah.'}])
+        breaker = self.open_breaker('ollama')
+
+        stream = ChatbotService().stream_response('best time to visit', '')
+        self.assertEqual(next(stream), {'type': 'token', 'content': 'Visit '})
+        stream.close()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+    def test_cancelled_async_probe_released(self):
+        """Test that a cancelled half-open probe reopens the circuit instead of blocking it for good"""
+        breaker = self.open_breaker('ollama')
+        self.assertTrue(breaker.allow_request())
+
+        async def cancel_probe():
+            task = asyncio.ensure_future(ChatbotService._atimed_call(breaker, asyncio.sleep, 10))
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with self.assertLogs('chatbot.services', 'WARNING'):
+            asyncio.run(cancel_probe())
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with mock.patch('chatbot.services.time.monotonic', return_value=time.monotonic() + breaker.cooldown + 1):
+            self.assertTrue(breaker.allow_request())
+
+class PromptBuilderTestCase(TestCase):
+    """Test token-budgeted prompt assembly"""
+
+    def test_token_helpers(self):
+        """Test token estimates and truncation on token boundaries"""
+        self.assertEqual(count_tokens(''), 0)
+        self.assertEqual(count_tokens('Visit the Casbah!'), 6)
+        # Long words count as several tokens
+        self.assertEqual(count_tokens('internationalisation'), 5)
+        self.assertEqual(truncate_to_tokens('Visit the Casbah of Algiers', 3), 'Visit the')
+        self.assertEqual(truncate_to_tokens('Visit', 3), 'Visit')
+
+    def test_static_prefix_shared_across_prompts(self):
+        """Test that context and history stay out of the system prompt"""
+        builder = PromptBuilder()
+        first = builder.build('Where to go?', 'Title: Casbah\nContent: Old town')
+        second = builder.build('Best food?', 'Title: Couscous\nContent: Dish', [
+            {'role': 'user', 'content': 'Hi'}, {'role': 'assistant', 'content': 'Hello!'}
+        ])
+        self.assertEqual(first.system, SYSTEM_PROMPT)
+        self.assertEqual(second.system, first.system)
+        self.assertEqual(second.messages()[0], first.messages()[0])
+        self.assertIn('Title: Couscous', second.completion_text())
+        self.assertTrue(second.completion_text().endswith('Human: Hi\nAssistant: Hello!\nHuman: Best food?\nAssistant:'))
+
+    def test_context_and_history_fit_budget(self):
+        """Test that context is cut to its budget and old turns are dropped first"""
+        system_tokens = count_tokens(SYSTEM_PROMPT)
+        builder = PromptBuilder(token_budget=system_tokens + 120, context_tokens=60)
+        context = '\n\n'.join(f'Title: Place {i}\nContent: ' + 'sand dunes ' * 20 for i in range(5))
+        history = [
+            {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'turn {i} ' + 'word ' * 8}
+            for i in range(6)
+        ]
+        prompt = builder.build('Where to go?', context, history + [{'role': 'user', 'content': 'Where to go?'}])
+
+        self.assertLessEqual(count_tokens(prompt.context), 60)
+        self.assertTrue(prompt.context.endswith('...'))
+        # The duplicated question is dropped and the newest turns are kept
+        self.assertTrue(prompt.history)
+        self.assertEqual(prompt.history, history[-len(prompt.history):])
+        self.assertLess(len(prompt.history), len(history))
+        self.assertLessEqual(prompt.token_count, builder.token_budget)
+
+    @mock.patch('chatbot.services.ollama.generate', return_value={'response': 'Visit the Casbah.'})
+    def test_ollama_request_uses_system_field(self, generate):
+        """Test that Ollama gets the static prefix separately and is kept loaded"""
+        result = ChatbotService().generate_response('Where to go?', 'Title: Casbah\nContent: Old town')
+        kwargs = generate.call_args.kwargs
+        self.assertEqual(kwargs['system'], SYSTEM_PROMPT)
+        self.assertNotIn('Casbah', kwargs['system'])
+        self.assertIn('Title: Casbah', kwargs['prompt'])
+        self.assertIn('keep_alive', kwargs)
+        self.assertGreater(result['prompt_tokens'], count_tokens(SYSTEM_PROMPT))
+
+
+class QueuedChatMessageTestCase(KnowledgeBaseTestMixin, APITestCase):
+    """Test chat answers generated by a Celery worker"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='traveller', email='traveller@example.com', password='travelpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('chatbot:chat-message-queued')
+
+    def send(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'content': content, 'message_type': 'user'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        return response.data
+
+    @mock.patch('chatbot.services.ollama.generate', return_value={'response': 'Visit the Casbah.'})
+    @mock.patch('chatbot.views.generate_chat_response.delay')
+    def test_pending_reply_completed_by_task(self, delay, generate):
+        """Test that the request returns a pending reply that the task fills in"""
+        data = self.send('Where should I go in Algiers?')
+        self.assertEqual(data['status'], 'pending')
+        delay.assert_called_once()
+        message_id, reply_id = delay.call_args.args
+        self.assertEqual(reply_id, data['message_id'])
+
+        status_url = reverse('chatbot:chat-message-status', args=[reply_id])
+        response = self.client.get(status_url)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(response['Retry-After'], '1')
+        session = ChatMessage.objects.get(id=reply_id).session
+        self.assertEqual(
+            session.get_conversation_history(),
+            [{'role': 'user', 'content': 'Where should I go in Algiers?'}]
+        )
+
+        generate_chat_response(message_id, reply_id)
+        response = self.client.get(status_url)
+        self.assertEqual(response.data['status'], 'complete')
+        self.assertEqual(response.data['response'], 'Visit the Casbah.')
+        self.assertFalse(response.has_header('Retry-After'))
+
+        # A redelivered task leaves the answer alone
+        generate.return_value = {'response': 'Something else.'}
+        generate_chat_response(message_id, reply_id)
+        self.assertEqual(ChatMessage.objects.get(id=reply_id).content, 'Visit the Casbah.')
+
+    @mock.patch('chatbot.services.ollama.generate', return_value={'response': 'Visit the Casbah.'})
+    @mock.patch('chatbot.views.generate_chat_response.delay', side_effect=ConnectionError('no broker'))
+    def test_reply_failed_without_broker(self, delay, generate):
+        """Test that a reply that can't be queued is reported failed rather than generated inline"""
+        with self.assertLogs('chatbot.views', 'WARNING'):
+            data = self.send('Where should I go in Algiers?')
+        generate.assert_not_called()
+
+        response = self.client.get(reverse('chatbot:chat-message-status', args=[data['message_id']]))
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertTrue(response.data['response'])
+        self.assertFalse(response.has_header('Retry-After'))
+
+    @mock.patch('chatbot.tasks.RAGService.get_relevant_context', side_effect=RuntimeError('index unavailable'))
+    @mock.patch('chatbot.views.generate_chat_response.delay')
+    def test_failed_generation_marks_reply_failed(self, delay, get_relevant_context):
+        """Test that an error while answering is reported as a failed reply"""
+        self.send('Where should I go in Algiers?')
+        with self.assertLogs('chatbot.tasks', 'ERROR'):
+            generate_chat_response(*delay.call_args.args)
+        reply = ChatMessage.objects.get(id=delay.call_args.args[1])
+        self.assertEqual(reply.status, 'failed')
+        self.assertTrue(reply.content)
+
+    def test_other_users_replies_hidden(self):
+        """Test that a reply can only be polled by the session owner"""
+        other = User.objects.create_user(username='other', email='other@example.com', password='travelpass123')
+        session = other.chat_sessions.create(session_id='other-session')
+        reply = ChatMessage.objects.create(session=session, content='', message_type='assistant', status='pending')
+        response = self.client.get(reverse('chatbot:chat-message-status', args=[reply.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ChatAnalyticsRollupTestCase(APITestCase):
+    """Test the daily chat analytics rollups and the stats endpoint"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='traveller', email='traveller@example.com', password='travelpass123'
+        )
+        self.algiers = Province.objects.create(name='Algiers', description='Capital province')
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+
+        self.session = ChatSession.objects.create(user=self.user, session_id='traveller-session')
+        ChatSession.objects.create(session_id='anonymous-session')
+        question = self.session.messages.create(message_type='user', content='What is in Algiers?')
+        question.mentioned_provinces.add(self.algiers)
+        answer = self.session.messages.create(
+            message_type='assistant', content='The Casbah.', processing_time_ms=300, confidence_score=0.8
+        )
+        ChatFeedback.objects.create(message=answer, user=self.user, feedback_type='excellent')
+
+        old_answer = self.session.messages.create(
+            message_type='assistant', content='Welcome!', processing_time_ms=100, confidence_score=0.6
+        )
+        ChatFeedback.objects.create(message=old_answer, feedback_type='incorrect')
+        yesterday_noon = timezone.make_aware(datetime.combine(self.yesterday, datetime.min.time())) + timedelta(hours=12)
+        ChatMessage.objects.filter(id=old_answer.id).update(created_at=yesterday_noon)
+        ChatFeedback.objects.filter(message=old_answer).update(created_at=yesterday_noon)
+
+    def test_rollup_aggregates_each_day(self):
+        """Test that each day's activity lands in its own row"""
+        rows = rollup_chat_analytics(since=self.yesterday)
+        self.assertEqual([row.date for row in rows], [self.yesterday, self.today])
+
+        today = ChatAnalytics.objects.get(date=self.today)
+        self.assertEqual(today.total_sessions, 2)
+        self.assertEqual(today.anonymous_sessions, 1)
+        self.assertEqual(today.total_messages, 2)
+        self.assertEqual(today.active_sessions, 1)
+        self.assertEqual(today.unique_users, 1)
+        self.assertEqual(today.avg_response_time_ms, 300)
+        self.assertEqual(today.timed_responses, 1)
+        self.assertEqual(today.helpful_responses, 1)
+        self.assertEqual(today.top_provinces_mentioned, {'Algiers': 1})
+
+        yesterday = ChatAnalytics.objects.get(date=self.yesterday)
+        self.assertEqual(yesterday.total_messages, 1)
+        self.assertEqual(yesterday.not_helpful_responses, 1)
+        # The session's first message was yesterday, so it is counted there only
+        self.assertEqual((yesterday.new_active_sessions, today.new_active_sessions), (1, 0))
+
+    def test_incremental_rollup_is_idempotent(self):
+        """Test that re-running only recomputes from the latest rolled-up day"""
+        rollup_chat_analytics(since=self.yesterday)
+        self.session.messages.create(message_type='user', content='And Oran?')
+        rows = rollup_chat_analytics()
+        self.assertEqual([row.date for row in rows], [self.today])
+        self.assertEqual(ChatAnalytics.objects.get(date=self.today).total_messages, 3)
+        self.assertEqual(ChatAnalytics.objects.count(), 2)
+
+    def test_statistics_read_from_rollups(self):
+        """Test that the admin stats endpoint serves the rolled-up totals"""
+        rollup_chat_analytics(since=self.yesterday)
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='adminpass123'
+        )
+        self.client.force_authenticate(user=admin)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('chatbot:chat-statistics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_messages'], 3)
+        self.assertEqual(response.data['active_sessions_today'], 1)
+        # Messages per session that has messages; the empty anonymous session doesn't count
+        self.assertEqual(response.data['average_session_length'], 3)
+        self.assertEqual(response.data['average_response_time'], 200)
+        self.assertEqual(response.data['user_satisfaction'], 50)
+        self.assertEqual(response.data['popular_topics']['provinces'], {'Algiers': 1})
+        self.assertEqual(
+            response.data['daily_message_count'], {str(self.yesterday): 1, str(self.today): 2}
+        )
+
+    def test_statistics_do_not_roll_up(self):
+        """Test that the stats endpoint serves existing rollups without computing missing ones"""
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='adminpass123'
+        )
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(reverse('chatbot:chat-statistics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_messages'], 0)
+        self.assertFalse(ChatAnalytics.objects.exists())
+
+        rollup_chat_analytics(since=self.yesterday)
+        self.session.messages.create(message_type='user', content='And Oran?')
+        response = self.client.get(reverse('chatbot:chat-statistics'))
+        self.assertEqual(response.data['total_messages'], 3)
+
+
+class FAQFastPathTestCase(KnowledgeBaseTestMixin, APITestCase):
+    """Test answering common questions from the FAQ before retrieval and the LLM"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(faq_view_counts.flush)
+        self.user = User.objects.create_user(
+            username='traveller', email='traveller@example.com', password='travelpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.best_time = FrequentlyAskedQuestion.objects.create(
+            question='What is the best time to visit Algeria?', answer='Spring and autumn are mild.'
+        )
+        self.visa = FrequentlyAskedQuestion.objects.create(
+            question='Do I need a visa to visit Algeria?', answer='Most travellers need a visa.'
+        )
+        FrequentlyAskedQuestion.objects.create(
+            question='Quelle est la meilleure période pour visiter l\'Algérie ?', answer='Le printemps.'
+        )
+
+    def test_match_requires_similar_question(self):
+        """Test that rewordings and typos match but other places do not"""
+        index = shared_faq_index.get()
+        self.assertEqual(index.match('what is the best time to visit algeria')[1], 1.0)
+        self.assertEqual(index.match('When is the best time to visit Algeria')[0]['id'], self.best_time.id)
+        self.assertEqual(index.match('do i need visa to visit algria')[0]['id'], self.visa.id)
+        self.assertEqual(index.match('meilleure periode pour visiter l algerie')[0]['answer'], 'Le printemps.')
+        self.assertIsNone(index.match('What is the best time to visit Oran?'))
+        self.assertIsNone(index.match('visa'))
+
+    @mock.patch('chatbot.faq.faq_view_counts.flush_interval', 3600)
+    @mock.patch('chatbot.services.ollama.generate')
+    def test_chat_answered_from_faq(self, generate):
+        """Test that a matching question skips the LLM and is counted as a view"""
+        response = self.client.post(
+            reverse('chatbot:chat-message-create'),
+            {'content': 'When is the best time to visit Algeria?', 'message_type': 'user'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['response'], 'Spring and autumn are mild.')
+        self.assertEqual(response.data['sources'][0]['type'], 'faq')
+        generate.assert_not_called()
+        self.assertEqual(ChatMessage.objects.get(id=response.data['message_id']).model_used, 'faq')
+
+        self.assertEqual(faq_view_counts.pending(), {self.best_time.id: 1})
+        self.best_time.refresh_from_db()
+        self.assertEqual(self.best_time.view_count, 0)
+        faq_view_counts.flush()
+        self.best_time.refresh_from_db()
+        self.assertEqual(self.best_time.view_count, 1)
+
+    @mock.patch('chatbot.services.ollama.generate', return_value={'response': 'Try the couscous.'})
+    def test_unmatched_question_reaches_llm(self, generate):
+        """Test that other questions go through retrieval and the LLM"""
+        response = self.client.post(reverse('chatbot:quick-chat'), {'message': 'What should I eat in Oran?'}, format='json')
+        self.assertEqual(response.data['response'], 'Try the couscous.')
+        generate.assert_called_once()
+
+    def test_view_counts_written_in_batches(self):
+        """Test that buffered counts are written with one update per increment"""
+        buffer = ViewCountBuffer(flush_interval=3600)
+        for faq_id in (self.best_time.id, self.best_time.id, self.visa.id):
+            buffer.add(faq_id)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries), 2)
+        self.assertEqual(
+            dict(FrequentlyAskedQuestion.objects.values_list('id', 'view_count').filter(view_count__gt=0)),
+            {self.best_time.id: 2, self.visa.id: 1}
+        )
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_edited_faq_reloads_index(self):
+        """Test that FAQ edits are picked up, but view count saves are not a reload"""
+        index = shared_faq_index.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.best_time.view_count = 5
+            self.best_time.save(update_fields=['view_count'])
+        self.assertIs(shared_faq_index.get(), index)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.visa.is_active = False
+            self.visa.save()
+        self.assertIsNone(shared_faq_index.get().match('Do I need a visa to visit Algeria?'))
+
+
+class IntentEngineTestCase(TestCase):
+    """Test the compiled keyword intents behind fallback answers and suggestions"""
+
+    def setUp(self):
+        shared_intent_engine.clear()
+        self.addCleanup(shared_intent_engine.clear)
+
+    def test_keywords_match_whole_words(self):
+        """Test that keywords match on word boundaries, plurals, phrases and overlaps included"""
+        engine = builtin_intent_engine
+        self.assertEqual(engine.scores('this is his history'), {'culture': 1.0})
+        self.assertEqual(engine.scores('Mountain gorillas'), {'gorillas': 3.0})
+        self.assertEqual(engine.scores('Where  to go? Good\nmorning!'), {'places': 1.0, 'greeting': 1.0})
+        # Each keyword counts once, however often it appears
+        self.assertEqual(engine.scores('Visas, visa, and passports?'), {'visa': 2.0})
+        self.assertEqual(engine.analyze('Hi! Where to go?').intent, 'greeting')
+
+    def test_weights_and_suggestions(self):
+        """Test that weighted scores pick the answer and the first matching group the suggestions"""
+        engine = IntentEngine(builtin_intent_engine.intents.values())
+        analysis = engine.analyze('Hello, which places in the desert should I visit?')
+        self.assertEqual(analysis.intent, 'places')
+        self.assertIn('Casbah', analysis.response)
+        # Desert follow-ups come before places ones, whatever the scores
+        self.assertEqual(analysis.suggestions[0], 'What should I bring for desert trekking?')
+
+        analysis = engine.analyze('What about the weather?')
+        self.assertIn('climate', analysis.response)
+        self.assertEqual(analysis.suggestions[0], "What's the best time to visit Algeria?")
+        self.assertIsNone(engine.analyze('Tell me something').intent)
+
+        weighted = IntentEngine([Intent('food', ('couscous',), 3.0, 'Taste it.'), *BUILTIN_INTENTS])
+        self.assertEqual(weighted.analyze('couscous with the people of Kabylie and their customs').intent, 'food')
+
+    def test_sentiment(self):
+        """Test that sentiment is the share of whole words that are positive and negative"""
+        service = ChatbotService()
+        self.assertEqual(
+            service.analyze_sentiment('great trip, worst hotel'), {'positive': 0.25, 'negative': 0.25, 'neutral': 0.5}
+        )
+        self.assertEqual(service.analyze_sentiment('good morning'), {'positive': 0.5, 'negative': 0.0, 'neutral': 0.5})
+        # Words are compared as written, punctuation included
+        self.assertEqual(service.analyze_sentiment('great!'), {'positive': 0.0, 'negative': 0.0, 'neutral': 1.0})
+        self.assertEqual(service.analyze_sentiment(''), {'positive': 0.5, 'negative': 0.5, 'neutral': 0.0})
+
+    def test_fallback_response(self):
+        """Test that the fallback answers from intents, then from context, with fixed suggestions"""
+        service = ChatbotService()
+        suggestions = [
+            "What are the best places to visit in Algeria?",
+            "Tell me about the Sahara Desert",
+            "What's the weather like in Algeria?"
+        ]
+        response = service._generate_fallback_response('Good morning! Any gorilla trekking?', 'Title: Timgad\nRoman ruins.')
+        self.assertIn('Sahara Desert', response['response'])
+        self.assertEqual(response['confidence'], 0.7)
+        self.assertEqual(response['suggestions'], suggestions)
+        self.assertEqual(response['sources'][0]['title'], 'Timgad')
+
+        response = service._generate_fallback_response('Tell me about Timgad', 'Timgad is a Roman city. It is old')
+        self.assertEqual(response['confidence'], 0.5)
+        self.assertTrue(response['response'].startswith('Timgad is a Roman city'))
+        self.assertEqual(response['suggestions'], suggestions)
+
+    def test_suggestions(self):
+        """Test that follow-ups come from the first matching keyword group"""
+        service = ChatbotService()
+        self.assertEqual(service._generate_suggestions('Visit the Sahara', '')[0], 'What should I bring for desert trekking?')
+        self.assertEqual(service._generate_suggestions('Top attractions?', '')[0], 'Tell me about the Casbah of Algiers')
+        self.assertEqual(service._generate_suggestions('Local people', '')[0], 'What is traditional Algerian food like?')
+        self.assertEqual(service._generate_suggestions('Hello', '')[0], "What's the best time to visit Algeria?")
+
+    def test_admin_intents(self):
+        """Test that admin intents replace built-in ones, add new ones and reload on save"""
+        service = ChatbotService()
+        desert_suggestion = 'What should I bring for desert trekking?'
+        self.assertEqual(service._generate_suggestions('Any sahara trekking tours?', '')[0], desert_suggestion)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ChatIntent.objects.create(
+                name='desert_suggestions', keywords='sahara\ntassili', suggestions='Is Djanet safe?'
+            )
+            ChatIntent.objects.create(
+                name='food', keywords='couscous\nfood', weight=2.0, response='Taste the couscous.'
+            )
+        self.assertEqual(service._generate_suggestions('Sahara tours', ''), ['Is Djanet safe?'])
+        # The built-in keywords of a replaced intent are gone
+        self.assertEqual(service._generate_suggestions('desert trekking', '')[0], "What's the best time to visit Algeria?")
+        response = service._generate_fallback_response('Where to find food in the Sahara?', '')
+        self.assertEqual(response['response'], 'Taste the couscous.')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ChatIntent.objects.filter(name='food').update(is_active=False)
+            ChatIntent.objects.get(name='desert_suggestions').delete()
+        self.assertEqual(service._generate_suggestions('Sahara tours', '')[0], desert_suggestion)
+        self.assertIsNone(shared_intent_engine.get().analyze('food').intent)
+
+
+class ConversationSummaryTestCase(TestCase):
+    """Test the rolling conversation summary kept per chat session"""
+
+    def setUp(self):
+        circuit_breakers.clear()
+        self.session = ChatSession.objects.create(session_id='summary-session')
+
+    def add_turns(self, count):
+        messages = []
+        for i in range(count):
+            messages.append(ChatMessage.objects.create(
+                session=self.session, message_type='user', content=f'Question {i}. Tell me more.'
+            ))
+            messages.append(ChatMessage.objects.create(
+                session=self.session, message_type='assistant', content=f'Answer {i}. With details.'
+            ))
+        return messages
+
+    def test_history_carries_summary_and_recent_turns(self):
+        """Test that summarized messages are replaced by the summary"""
+        messages = self.add_turns(4)
+        self.session.summary = 'The traveller asked about the Casbah.'
+        self.session.summary_message_id = messages[3].id
+        history = self.session.get_conversation_history()
+        self.assertEqual(history[0], {'role': 'system', 'content': 'The traveller asked about the Casbah.'})
+        self.assertEqual([msg['content'] for msg in history[1:]], [msg.content for msg in messages[4:]])
+
+    def test_prompt_places_summary_before_turns(self):
+        """Test that the summary gets its own section of the prompt"""
+        prompt = PromptBuilder().build('Any hotels?', '', [
+            {'role': 'system', 'content': 'Planning a week in Oran.'},
+            {'role': 'user', 'content': 'Hi'}, {'role': 'assistant', 'content': 'Hello!'}
+        ])
+        self.assertEqual(prompt.summary, 'Planning a week in Oran.')
+        self.assertEqual([msg['role'] for msg in prompt.history], ['user', 'assistant'])
+        self.assertIn('Conversation so far:\nPlanning a week in Oran.\n\nHuman: Hi\n', prompt.completion_text())
+        self.assertEqual(prompt.messages()[2], {'role': 'system', 'content': 'Conversation so far:\nPlanning a week in Oran.'})
+
+    @mock.patch('chatbot.services.ollama.generate', return_value={'response': 'Asked about questions 0 to 2.'})
+    def test_older_turns_folded_into_summary(self, generate):
+        """Test that everything but the recent window is summarized by the LLM"""
+        messages = self.add_turns(5)
+        summary = update_session_summary(self.session.id)
+        self.assertEqual(summary, 'Asked about questions 0 to 2.')
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary_message_id, messages[-CONVERSATION_RECENT_MESSAGES - 1].id)
+        prompt = generate.call_args.kwargs['prompt']
+        self.assertIn('Traveller: Question 2.', prompt)
+        self.assertNotIn('Question 3.', prompt)
+        # Nothing left to fold until the next turn
+        self.assertFalse(needs_summary(self.session.id))
+        update_session_summary(self.session.id)
+        self.assertEqual(generate.call_count, 1)
+
+    @mock.patch('chatbot.services.ollama.generate', side_effect=ConnectionError('offline'))
+    def test_extractive_summary_without_llm(self, generate):
+        """Test that first sentences are kept when no backend answers"""
+        self.add_turns(4)
+        with self.assertLogs('chatbot.services', 'WARNING'):
+            summary = update_session_summary(self.session.id)
+        self.assertEqual(summary.splitlines(), ['Traveller: Question 0.', 'Assistant: Answer 0.', 'Traveller: Question 1.', 'Assistant: Answer 1.'])
+        summarizer = ConversationSummarizer(max_tokens=16)
+        self.assertEqual(summarizer.extract(summary, []), 'Traveller: Question 1.\nAssistant: Answer 1.')
+
+    @mock.patch('chatbot.tasks.summaries.update_session_summary')
+    @mock.patch('chatbot.signals.summarize_conversation.delay')
+    def test_summary_queued_for_finished_replies(self, delay, update):
+        """Test that finished replies queue a summary and the task skips short sessions"""
+        self.add_turns(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            ChatMessage.objects.create(session=self.session, message_type='user', content='Question 2.')
+            reply = ChatMessage.objects.create(
+                session=self.session, message_type='assistant', content='', status='pending'
+            )
+        delay.assert_not_called()
+        with self.captureOnCommitCallbacks(execute=True):
+            reply.content = 'Answer 2.'
+            reply.status = 'complete'
+            reply.save(update_fields=['content', 'status'])
+        delay.assert_called_once_with(self.session.id)
+
+        summarize_conversation(self.session.id)
+        update.assert_called_once_with(self.session.id)
+        ChatMessage.objects.filter(session=self.session).exclude(id=reply.id).delete()
+        summarize_conversation(self.session.id)
+        self.assertEqual(update.call_count, 1)
+
+    @mock.patch('chatbot.signals.summarize_conversation.delay', side_effect=ConnectionError('no broker'))
+    @mock.patch('chatbot.tasks.summaries.update_session_summary')
+    def test_summary_not_run_inline_without_broker(self, update, delay):
+        """Test that a failed enqueue is logged and left to the next reply"""
+        self.add_turns(3)
+        with self.assertLogs('chatbot.signals', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            ChatMessage.objects.create(session=self.session, message_type='assistant', content='Answer 3.')
+        update.assert_not_called()
+
+
+class ChatSessionListTestCase(APITestCase):
+    """Test that session lists are served in a constant number of queries"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='traveller', email='traveller@example.com', password='travelpass123'
+        )
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='adminpass123'
+        )
+
+    def create_sessions(self, count):
+        for i in range(count):
+            session = ChatSession.objects.create(user=self.user, session_id=f'session-{i}-{time.time()}')
+            session.messages.create(message_type='user', content=f'Question {i}')
+            session.messages.create(
+                message_type='assistant', content='x' * 120, processing_time_ms=100, confidence_score=0.5
+            )
+            session.messages.create(
+                message_type='assistant', content='Last answer', processing_time_ms=200, confidence_score=1.0
+            )
+
+    def assert_constant_queries(self, url):
+        self.create_sessions(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self.create_sessions(5)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(many), len(few))
+        return response.data['results']
+
+    def test_user_session_list(self):
+        """Test the annotated counts, preview and title of the user's sessions"""
+        self.client.force_authenticate(user=self.user)
+        results = self.assert_constant_queries(reverse('chatbot:chat-session-list-create'))
+        self.assertEqual(len(results), 7)
+        session = results[0]
+        self.assertEqual(session['messages_count'], 3)
+        self.assertEqual(session['last_message_preview'], 'Last answer')
+        self.assertEqual(session['auto_title'], 'Question 4')
+        self.assertIsNotNone(session['last_message_at'])
+
+    def test_admin_session_list(self):
+        """Test the annotated totals and averages for admins"""
+        self.client.force_authenticate(user=self.admin)
+        results = self.assert_constant_queries(reverse('chatbot:admin-chat-sessions'))
+        self.assertEqual(results[0]['total_response_time'], 300)
+        self.assertEqual(results[0]['average_confidence'], 0.75)
+
+    def test_unannotated_session_matches(self):
+        """Test that a session loaded without annotations reports the same values"""
+        self.create_sessions(1)
+        session = ChatSession.objects.get()
+        annotated = ChatSession.objects.with_message_stats().get()
+        for field in ('message_count', 'last_message_preview', 'auto_title'):
+            self.assertEqual(getattr(session, field), getattr(annotated, field))
+
+
+class EntityLinkingTestCase(TestCase):
+    """Test tagging chat messages with the places and provinces they mention"""
+
+    def setUp(self):
+        shared_entity_linker.clear()
+        self.oran = Province.objects.create(name='Oran', name_ar='وهران', description='Western coastal province')
+        district = District.objects.create(name='Oran', province=self.oran)
+        municipality = Municipality.objects.create(name='Oran', district=district)
+        self.cathedral = Place.objects.create(
+            name='Oran Cathedral', municipality=municipality, place_type='religious',
+            description='Cathedral', latitude=35.7, longitude=-0.6
+        )
+        self.fort = Place.objects.create(
+            name='Fort Santa Cruz', municipality=municipality, place_type='historical',
+            description='Fort', latitude=35.7, longitude=-0.6
+        )
+        self.user = User.objects.create_user(
+            username='traveller', email='traveller@example.com', password='travelpass123'
+        )
+        self.session = ChatSession.objects.create(user=self.user, session_id='traveller-session')
+
+    def test_automaton_finds_overlapping_patterns(self):
+        """Test that every occurrence is reported in a single pass"""
+        automaton = AhoCorasick()
+        for word in ('he', 'she', 'his', 'hers'):
+            automaton.add(word, word)
+        self.assertEqual(
+            sorted(automaton.iter_matches('ushers')), [(1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers')]
+        )
+
+    def test_linker_matches_whole_names(self):
+        """Test case, accent and script insensitive matching of whole names"""
+        linker = EntityLinker.from_database()
+        self.assertEqual(linker.link('Is FORT SANTA CRUZ open?'), ({self.fort.id}, set()))
+        self.assertEqual(linker.link('زرت وهران'), (set(), {self.oran.id}))
+        # The longest overlapping name wins
+        self.assertEqual(linker.link('Visit the Oran cathedral'), ({self.cathedral.id}, set()))
+        self.assertEqual(linker.link('Oranges from Orania'), (set(), set()))
+
+    @mock.patch('chatbot.signals.link_chat_mentions.delay', side_effect=link_chat_mentions)
+    def test_saved_messages_are_linked(self, delay):
+        """Test that new and completed messages are queued for linking"""
+        with self.captureOnCommitCallbacks(execute=True):
+            message = self.session.messages.create(message_type='user', content='What to see in Oran?')
+            reply = self.session.messages.create(message_type='assistant', content='', status='pending')
+        self.assertEqual(list(message.mentioned_provinces.all()), [self.oran])
+
+        reply.content = 'Climb to Fort Santa Cruz.'
+        with self.captureOnCommitCallbacks(execute=True):
+            reply.save(update_fields=['content'])
+        self.assertEqual(list(reply.mentioned_places.all()), [self.fort])
+        self.assertEqual(delay.call_count, 2)
+
+    @mock.patch('chatbot.signals.link_chat_mentions.delay', side_effect=ConnectionError('no broker'))
+    def test_linking_not_run_inline_without_broker(self, delay):
+        """Test that a failed enqueue leaves linking to the backfill command"""
+        with self.assertLogs('chatbot.signals', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            message = self.session.messages.create(message_type='user', content='What to see in Oran?')
+        self.assertFalse(message.mentioned_provinces.exists())
+
+    def test_backfill_command(self):
+        """Test that historical messages are linked in bulk"""
+        for content in ('Oran or Algiers?', 'Fort Santa Cruz at sunset', 'Hello'):
+            self.session.messages.create(message_type='user', content=content)
+        out = StringIO()
+        # Names, messages, then one insert per relation for the whole batch
+        with self.assertNumQueries(5):
+            call_command('link_chat_mentions', stdout=out)
+        self.assertIn('Linked 3 messages (1 place and 1 province mentions)', out.getvalue())
+        self.assertEqual(self.oran.chat_mentions.count(), 1)
+        self.assertEqual(self.fort.chat_mentions.count(), 1)
+
+
+class ChatExportTestCase(APITestCase):
+    """Test the streaming chat data export"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='adminpass123'
+        )
+        self.client.force_authenticate(user=self.admin)
+        self.url = reverse('chatbot:export-chat-data')
+        self.user = User.objects.create_user(
+            username='traveller', email='traveller@example.com', password='travelpass123'
+        )
+        self.session = ChatSession.objects.create(user=self.user, session_id='traveller-session')
+        self.session.messages.create(message_type='user', content='Where to go, "exactly"?')
+        answer = self.session.messages.create(message_type='assistant', content='Oran.\nThen Tlemcen.')
+        ChatFeedback.objects.create(message=answer, user=self.user, feedback_type='helpful')
+        other = ChatSession.objects.create(session_id='anonymous-session')
+        other.messages.create(message_type='user', content='Hello')
+
+    def export(self, **payload):
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        return b''.join(response.streaming_content)
+
+    def test_jsonl_export(self):
+        """Test one JSON object per message with session and feedback columns"""
+        lines = self.export(format='jsonl', session_ids=[self.session.id]).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['content'] for row in rows], ['Where to go, "exactly"?', 'Oran.\nThen Tlemcen.'])
+        self.assertEqual(rows[1]['user_email'], 'traveller@example.com')
+        self.assertEqual(rows[1]['helpful_feedback'], 1)
+        self.assertEqual(rows[0]['helpful_feedback'], 0)
+
+    def test_json_and_csv_exports(self):
+        """Test that the JSON array and CSV exports hold every message"""
+        rows = json.loads(self.export(format='json'))
+        self.assertEqual(len(rows), 3)
+        self.assertIsNone(rows[2]['user_email'])
+        self.assertEqual(json.loads(self.export(format='json', session_ids=[0])), [])
+
+        reader = csv.DictReader(io.StringIO(self.export(format='csv', include_feedback=False).decode()))
+        csv_rows = list(reader)
+        self.assertNotIn('helpful_feedback', reader.fieldnames)
+        self.assertEqual([row['content'] for row in csv_rows], [row['content'] for row in rows])
+
+    def test_export_streams_in_chunks(self):
+        """Test that rows are written out chunk by chunk"""
+        with mock.patch('chatbot.exporters.EXPORT_CHUNK_SIZE', 1):
+            response = self.client.post(self.url, {'format': 'jsonl'}, format='json')
+            chunks = [chunk for chunk in response.streaming_content if chunk]
+        self.assertEqual(len(chunks), 3)
+
+    @mock.patch('chatbot.serializers.parquet_available', return_value=False)
+    def test_parquet_requires_pyarrow(self, available):
+        """Test that Parquet is refused when pyarrow is missing"""
+        response = self.client.post(self.url, {'format': 'parquet'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(parquet_available(), 'pyarrow is not installed')
+    def test_parquet_export(self):
+        """Test that the Parquet export reads back"""
+        import pyarrow.parquet as pq
+        table = pq.read_table(io.BytesIO(self.export(format='parquet')))
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(table.column('helpful_feedback').to_pylist(), [0, 1, 0])
+
+
+class ChatBenchmarkTestCase(TransactionTestCase):
+    """Test the chat benchmark harness and its fake LLM server"""
+
+    def setUp(self):
+        self.addCleanup(reset_shared_state)
+
+    def test_fake_llm_server(self):
+        """Test that the fake server answers deterministically, streamed or not"""
+        with FakeLLMServer(tokens_per_second=0, first_token_ms=0, response_tokens=8) as server:
+            client = ollama.Client(host=server.url)
+            answer = client.generate(model='fake', prompt='Where is Timgad?')['response']
+            streamed = ''.join(
+                chunk['response'] for chunk in client.generate(model='fake', prompt='Where is Timgad?', stream=True)
+            )
+            embeddings = client.embed(model='fake', input=['Timgad', 'Oran'])['embeddings']
+        self.assertEqual(streamed, answer)
+        self.assertEqual(len(answer.split()), 8)
+        self.assertEqual(len(embeddings), 2)
+        self.assertEqual(server.calls, {'generate': 2, 'embed': 1})
+
+    def test_benchmark_report(self):
+        """Test that every endpoint is measured without errors"""
+        seed_knowledge_base(30, words=20)
+        user = User.objects.create_user(username='benchmark', email='benchmark@example.com', password='benchpass123')
+        server = FakeLLMServer(tokens_per_second=0, first_token_ms=0, response_tokens=5)
+        with server:
+            # SQLite test databases are in memory, where concurrent writes fail
+            report = run_benchmark(
+                user, endpoints=('message', 'stream'), requests=3, concurrency=1, warmup=1, server=server
+            )
+            quick = run_benchmark(user, endpoints=('quick',), requests=4, concurrency=2, warmup=0, server=server)
+
+        message, stream = report['endpoints']['message'], report['endpoints']['stream']
+        self.assertEqual(report['settings']['entries'], 30)
+        self.assertEqual((message['requests'], message['errors']), (3, 0))
+        self.assertEqual((stream['requests'], stream['errors']), (3, 0))
+        self.assertIsNone(message['first_token_ms'])
+        self.assertLessEqual(stream['first_token_ms']['max'], stream['latency_ms']['max'])
+        self.assertGreater(message['retrieval_ms']['p50'], 0)
+        self.assertGreater(message['prompt_tokens']['p50'], count_tokens(SYSTEM_PROMPT))
+        self.assertGreater(message['queries']['p50'], quick['endpoints']['quick']['queries']['p50'])
+        self.assertEqual(report['llm_calls']['generate'], 6)
+        self.assertEqual(quick['endpoints']['quick']['errors'], 0)
+        self.assertIn('[stream] 3 requests, 0 errors', format_report(report))
+
+
+class StageTimingTestCase(KnowledgeBaseTestMixin, APITestCase):
+    """Test the per-stage timing of chat requests"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='traveller', email='traveller@example.com', password='travelpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.create_entry('Casbah of Algiers', 'The Casbah is the old town of Algiers.', 'place_info')
+
+    def stage_count(self, endpoint, stage):
+        return REGISTRY.get_sample_value(
+            'chatbot_stage_duration_seconds_count', {'endpoint': endpoint, 'stage': stage}
+        ) or 0
+
+    def send(self, content):
+        response = self.client.post(
+            reverse('chatbot:chat-message-create'), {'content': content, 'message_type': 'user'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return ChatMessage.objects.get(id=response.data['message_id'])
+
+    def test_stage_timer(self):
+        """Test that repeated stages add up and histograms are observed once"""
+        timer = StageTimer('test')
+        for _ in range(2):
+            with timer.stage('retrieval'):
+                time.sleep(0.005)
+        timer.add('llm', 0.25)
+        self.assertEqual(list(timer.timings), ['retrieval', 'llm'])
+        self.assertGreaterEqual(timer.timings['retrieval'], 10)
+        self.assertEqual(timer.timings['llm'], 250.0)
+
+        timer.observe()
+        timer.observe()
+        self.assertEqual(self.stage_count('test', 'llm'), 1)
+        self.assertEqual(
+            REGISTRY.get_sample_value('chatbot_stage_duration_seconds_sum', {'endpoint': 'test', 'stage': 'llm'}), 0.25
+        )
+
+    @mock.patch('chatbot.services.ollama.generate', return_value={'response': 'Visit the Casbah.'})
+    def test_stages_stored_and_exported(self, generate):
+        """Test that the message stores its stage breakdown and the histograms are exported"""
+        persisted = self.stage_count('message', 'persistence')
+        message = self.send('Where is the Casbah?')
+
+        self.assertLessEqual(
+            {'session', 'faq', 'retrieval', 'history', 'prompt', 'llm', 'suggestions'}, set(message.stage_timings)
+        )
+        self.assertNotIn('fallback', message.stage_timings)
+        self.assertTrue(all(ms >= 0 for ms in message.stage_timings.values()))
+        self.assertEqual(self.stage_count('message', 'persistence'), persisted + 1)
+
+        metrics = self.client.get('/metrics')
+        self.assertEqual(metrics.status_code, 200)
+        self.assertIn(b'chatbot_stage_duration_seconds_bucket{endpoint="message"', metrics.content)
+        self.assertIn(b'chatbot_request_duration_seconds_count{endpoint="message"}', metrics.content)
+
+    def test_metrics_restricted_to_scraper_and_staff(self):
+        """Test that /metrics is only served to allowed networks and staff users"""
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5').status_code, 403)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5').status_code, 403)
+
+        staff = User.objects.create_user(
+            username='operator', email='operator@example.com', password='operatorpass123', is_staff=True
+        )
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5').status_code, 200)
+
+    @mock.patch('chatbot.services.ollama.generate', side_effect=ConnectionError('offline'))
+    def test_fallback_and_faq_stages(self, generate):
+        """Test that only the stages that ran are recorded"""
+        with self.assertLogs('chatbot.services', 'WARNING'):
+            message = self.send('Tell me about the Casbah')
+        self.assertIn('fallback', message.stage_timings)
+        self.assertNotIn('suggestions', message.stage_timings)
+
+        self.addCleanup(faq_view_counts.flush)
+        FrequentlyAskedQuestion.objects.create(question='Is Algeria safe?', answer='Yes, for most travellers.')
+        shared_faq_index.clear()
+        message = self.send('Is Algeria safe?')
+        self.assertEqual(message.model_used, 'faq')
+        self.assertNotIn('retrieval', message.stage_timings)
+        self.assertNotIn('llm', message.stage_timings)
+
+
+class IngestionTestCase(KnowledgeBaseTestMixin, APITestCase):
+    """Test chunked, deduplicated knowledge base ingestion"""
+
+    SENTENCES = [
+        'Timimoun is an oasis town in the Gourara region of the Algerian Sahara.',
+        'Its buildings are made of red clay and give it the name of the red oasis.',
+        'The old ksar sits above a palm grove watered by underground foggara channels.',
+        'Sand dunes of the Grand Erg Occidental surround the town on three sides.',
+        'Visitors often stay in the colonial hotel designed in a Sudanese style.',
+        'The Ahellil, a Zenata poetic and musical tradition, is listed by UNESCO.',
+        'Winter nights are cold, so travellers should pack warm clothes.',
+        'Flights from Algiers land at the small Timimoun airport several times a week.',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='adminpass123'
+        )
+        self.document = {
+            'title': 'Timimoun, the red oasis',
+            'content': ' '.join(self.SENTENCES),
+            'content_type': 'place_info',
+            'source_url': 'https://example.com/timimoun'
+        }
+
+    def ingest(self, documents, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ingest_documents(documents, chunk_tokens=60, overlap_tokens=25, **kwargs)
+
+    def test_chunks_overlap_on_sentences(self):
+        """Test that chunks fit the budget, end on sentences and repeat the previous tail"""
+        chunks = chunk_text(self.document['content'], chunk_tokens=60, overlap_tokens=25)
+        self.assertGreater(len(chunks), 2)
+        self.assertTrue(all(count_tokens(chunk) <= 60 for chunk in chunks))
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertTrue(chunk.startswith(split_sentences(previous)[-1]))
+        self.assertEqual(chunks[0].split('. ')[0] + '.', self.SENTENCES[0])
+
+        long_sentence = ' '.join(['dune'] * 100)
+        pieces = chunk_text(long_sentence, chunk_tokens=40, overlap_tokens=0)
+        self.assertEqual([count_tokens(piece) for piece in pieces], [40, 40, 20])
+
+    def test_simhash_finds_near_duplicates(self):
+        """Test that reworded copies land within the distance and other text does not"""
+        text = ' '.join(self.SENTENCES[:4])
+        near = text.upper().replace('three', ' three ') + ' Indeed.'
+        index = SimHashIndex(max_distance=3)
+        index.add(to_signed(simhash(text)))
+        self.assertEqual(len(index), 1)
+        self.assertIsNotNone(index.find(simhash(near)))
+        self.assertIsNone(index.find(simhash(' '.join(self.SENTENCES[4:]))))
+        self.assertLess(to_signed(1 << 63), 0)
+
+    def test_ingest_bulk_inserts_searchable_chunks(self):
+        """Test that chunks are bulk inserted, indexed and skipped when ingested again"""
+        RAGService().search_knowledge_base('timimoun')
+        with CaptureQueriesContext(connection) as queries:
+            report = self.ingest([self.document])
+        self.assertEqual(report.created, report.chunks)
+        self.assertEqual(report.duplicates, 0)
+        inserts = [query for query in queries.captured_queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+
+        chunks = KnowledgeBase.objects.order_by('chunk_index')
+        self.assertEqual([chunk.chunk_index for chunk in chunks], list(range(report.created)))
+        self.assertTrue(all(chunk.simhash is not None and chunk.content_type == 'place_info' for chunk in chunks))
+
+        results = RAGService().search_knowledge_base('foggara channels palm grove')
+        self.assertTrue(results)
+        self.assertIn('foggara', results[0]['content'])
+        self.assertLess(len(results[0]['content']), len(self.document['content']))
+
+        reworded = dict(self.document, content=self.document['content'].lower(), source_url=None)
+        again = self.ingest([reworded])
+        self.assertEqual((again.created, again.duplicates), (0, report.chunks))
+
+        replaced = self.ingest([self.document], replace=True)
+        self.assertEqual((replaced.replaced, replaced.created), (report.created, report.created))
+        self.assertEqual(KnowledgeBase.objects.count(), report.created)
+
+    def test_ingest_endpoint_and_command(self):
+        """Test the admin ingestion endpoint and the management command"""
+        url = reverse('chatbot:knowledge-base-ingest')
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post(
+            url, {'documents': [self.document], 'chunk_tokens': 60, 'overlap_tokens': 60}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'documents': [self.document], 'chunk_tokens': 60}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertGreater(response.data['created'], 1)
+        self.assertTrue(KnowledgeBase.objects.filter(created_by=self.admin).exists())
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = f'{directory}/ahellil.md'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('# The Ahellil\n\n' + ' '.join(self.SENTENCES[5:]) + '\n\nIt is sung at night during festivals.')
+        out = StringIO()
+        call_command('ingest_knowledge', path, content_type='cultural_info', chunk_tokens=60, stdout=out)
+        self.assertIn('near-duplicates skipped', out.getvalue())
+        self.assertTrue(KnowledgeBase.objects.filter(title='The Ahellil', content_type='cultural_info').exists())
+
+        self.client.force_authenticate(user=User.objects.create_user(
+            username='traveller', email='traveller@example.com', password='travelpass123'
+        ))
+        self.assertEqual(self.client.post(url, {'documents': [self.document]}, format='json').status_code, 403)
@@ -0,0 +1,87 @@
+"""
+Per-stage timing of chat requests.
+
+Each chat endpoint times the stages of answering a message with a
+StageTimer, stores the breakdown on the assistant ChatMessage
+(``stage_timings``, milliseconds) and exports it as Prometheus histograms,
+served on /metrics. Stages that did not run for a request (retrieval for an
+FAQ answer, the LLM call for a cached one) are simply absent.
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from prometheus_client import Histogram
+
+# session: validate the request, resolve the session and store the question
+# faq: FAQ fast path lookup
+# retrieval: knowledge base search and context packing
+# history: conversation history (and summary) fetch
+# cache: response cache lookup and update
+# prompt: prompt assembly
+# llm: LLM call, every backend tried and hedged calls included
+# suggestions: follow-up suggestions for an LLM answer
+# fallback: rule-based answer when no LLM backend answered
+# persistence: saving the answer and touching the session
+CHAT_STAGES = (
+    'session', 'faq', 'retrieval', 'history', 'cache', 'prompt', 'llm', 'suggestions', 'fallback', 'persistence'
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CHAT_STAGE_SECONDS = Histogram(
+    'chatbot_stage_duration_seconds',
+    'Time spent in each stage of answering a chat message',
+    ['endpoint', 'stage'],
+    buckets=LATENCY_BUCKETS
+)
+CHAT_REQUEST_SECONDS = Histogram(
+    'chatbot_request_duration_seconds',
+    'Time to answer a chat message, all stages included',
+    ['endpoint'],
+    buckets=LATENCY_BUCKETS
+)
+
+
+class StageTimer:
+    """
+    Wall-clock time spent in each stage of answering one chat message.
+
+    Stages are timed with ``with timer.stage('retrieval'):``; a stage that
+    runs more than once adds up. ``timings`` gives milliseconds per stage in
+    the order the stages first ran, and ``observe`` exports the stages and
+    the total for ``endpoint`` once the answer is stored.
+    """
+
+    def __init__(self, endpoint: str = 'internal'):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.seconds: Dict[str, float] = {}
+        self._observed = False
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        return {name: round(seconds * 1000, 1) for name, seconds in self.seconds.items()}
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def observe(self):
+        """Export the stage histograms, at most once per timer"""
+        if self._observed:
+            return
+        self._observed = True
+        for name, seconds in self.seconds.items():
+            CHAT_STAGE_SECONDS.labels(self.endpoint, name).observe(seconds)
+        CHAT_REQUEST_SECONDS.labels(self.endpoint).observe(self.elapsed())
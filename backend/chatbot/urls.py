@@ -10,6 +10,7 @@ urlpatterns = [
     path('knowledge-base/search/', views.search_knowledge_base, name='knowledge-base-search'),
     path('knowledge-base/statistics/', views.knowledge_base_statistics, name='knowledge-base-statistics'),
     path('knowledge-base/bulk-operations/', views.bulk_knowledge_base_operations, name='knowledge-base-bulk-operations'),
+    path('knowledge-base/ingest/', views.ingest_knowledge_base, name='knowledge-base-ingest'),
     
     # Chat Session URLs
     path('sessions/', views.ChatSessionListCreateView.as_view(), name='chat-session-list-create'),
@@ -19,6 +20,10 @@ urlpatterns = [
     
     # Chat Message URLs
     path('messages/', views.ChatMessageCreateView.as_view(), name='chat-message-create'),
+    path('messages/stream/', views.ChatMessageStreamView.as_view(), name='chat-message-stream'),
+    path('messages/async/', views.chat_message_async, name='chat-message-async'),
+    path('messages/queued/', views.ChatMessageQueuedView.as_view(), name='chat-message-queued'),
+    path('messages/<int:pk>/', views.ChatMessageStatusView.as_view(), name='chat-message-status'),
     path('chat/quick/', views.quick_chat, name='quick-chat'),
     path('chat/suggestions/', views.chat_suggestions, name='chat-suggestions'),
     path('chat/history/', views.chat_history, name='chat-history'),
@@ -33,6 +38,7 @@ urlpatterns = [
     
     # Statistics URLs (Admin only)
     path('statistics/chat/', views.chat_statistics, name='chat-statistics'),
+    path('statistics/generation/', views.generation_statistics, name='generation-statistics'),
     path('statistics/knowledge-base/', views.knowledge_base_statistics, name='knowledge-base-statistics'),
     
     # Admin URLs
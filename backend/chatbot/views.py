@@ -1,15 +1,23 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework import generics, status, filters
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import transaction
 from django.db.models import Q, Avg, Count
 from django.contrib.auth import get_user_model
+from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
 import json
+import logging
 import time
 import openai
 import uuid
@@ -22,15 +30,25 @@ from .models import (
 from .serializers import (
     KnowledgeBaseSerializer, KnowledgeBaseCreateSerializer,
     ChatSessionSerializer, ChatMessageSerializer, ChatMessageCreateSerializer,
-    ChatMessageListSerializer, ChatFeedbackSerializer, ChatFeedbackCreateSerializer,
+    ChatMessageListSerializer, ChatMessageStatusSerializer, ChatFeedbackSerializer, ChatFeedbackCreateSerializer,
     FrequentlyAskedQuestionSerializer, ChatAnalyticsSerializer,
     ChatStatsSerializer, KnowledgeBaseStatsSerializer, ChatResponseSerializer,
     ChatSuggestionSerializer, KnowledgeSearchSerializer, ChatHistorySerializer,
-    ChatSessionAdminSerializer, BulkKnowledgeBaseSerializer, ChatExportSerializer
+    ChatSessionAdminSerializer, BulkKnowledgeBaseSerializer, KnowledgeIngestSerializer, ChatExportSerializer
 )
-from .services import RAGService, ChatbotService
+from .services import (
+    RAGService, ChatbotService, KnowledgeIndex, circuit_breakers, generation_scheduler, shared_knowledge_index
+)
+from . import analytics, exporters
+from .embeddings import shared_dense_index
+from .faq import answer_from_faq
+from .ingestion import ingest_documents
+from .response_cache import response_cache
+from .tasks import ERROR_RESPONSE, generate_chat_response
+from .tracing import StageTimer
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 # Custom pagination
 class ChatPagination(PageNumberPagination):
@@ -38,6 +56,19 @@ class ChatPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+def sse_event(event, data):
+    """Encode one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients ask for text/event-stream; errors are sent as one SSE event"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse_event('error', data).encode(self.charset)
+
 # Knowledge Base Views
 class KnowledgeBaseListCreateView(generics.ListCreateAPIView):
     """List all knowledge base entries or create a new one (admin only)"""
@@ -73,7 +104,7 @@ class ChatSessionListCreateView(generics.ListCreateAPIView):
     
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            return ChatSession.objects.filter(user=self.request.user)
+            return ChatSession.objects.filter(user=self.request.user).select_related('user').with_message_stats()
         else:
             # For anonymous users, return empty queryset for list view
             return ChatSession.objects.none()
@@ -93,7 +124,7 @@ class ChatSessionDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return ChatSession.objects.filter(user=self.request.user)
+        return ChatSession.objects.filter(user=self.request.user).select_related('user').with_message_stats()
 
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
@@ -104,7 +135,7 @@ def get_or_create_active_session(request):
         active_session = ChatSession.objects.filter(
             user=request.user,
             is_active=True
-        ).order_by('-updated_at').first()
+        ).select_related('user').with_message_stats().order_by('-updated_at').first()
         
         if active_session:
             serializer = ChatSessionSerializer(active_session)
@@ -149,11 +180,13 @@ class ChatMessageCreateView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
     
     def create(self, request, *args, **kwargs):
+        timer = StageTimer('message')
         serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
         
         # Create the user message
-        message = serializer.save()
+        with timer.stage('session'):
+            serializer.is_valid(raise_exception=True)
+            message = serializer.save()
         
         # Generate AI response using RAG service
         try:
@@ -161,42 +194,41 @@ class ChatMessageCreateView(generics.CreateAPIView):
             rag_service = RAGService()
             chatbot_service = ChatbotService()
             
-            # Get relevant context from knowledge base
-            context = rag_service.get_relevant_context(message.content)
-            
-            # Generate response using AI
-            ai_response = chatbot_service.generate_response(
-                message.content, 
-                context, 
-                message.session.get_conversation_history()
-            )
+            # Common questions are answered straight from the FAQ
+            with timer.stage('faq'):
+                ai_response = answer_from_faq(message.content)
+            if ai_response is None:
+                # Get relevant context from knowledge base
+                with timer.stage('retrieval'):
+                    context = rag_service.get_relevant_context(message.content)
+                with timer.stage('history'):
+                    history = message.session.get_conversation_history()
+                
+                # Generate response using AI
+                ai_response = chatbot_service.generate_response(message.content, context, history, timer=timer)
             
             response_time = time.time() - start_time
             
-            # Create AI response message
-            ai_message = ChatMessage.objects.create(
-                session=message.session,
-                content=ai_response['response'],
-                message_type='assistant',
-                processing_time_ms=int(response_time * 1000),
-                confidence_score=ai_response.get('confidence', 0.8),
-                retrieved_context=ai_response.get('sources', [])
-            )
-            
-            # Update session
-            message.session.updated_at = timezone.now()
-            message.session.save()
+            # Create AI response message, with the stages timed so far
+            with timer.stage('persistence'):
+                ai_message = ChatMessage.objects.create(
+                    session=message.session,
+                    content=ai_response['response'],
+                    message_type='assistant',
+                    processing_time_ms=int(response_time * 1000),
+                    confidence_score=ai_response.get('confidence', 0.8),
+                    retrieved_context=ai_response.get('sources', []),
+                    model_used=ai_response.get('model_used'),
+                    prompt_tokens=ai_response.get('prompt_tokens'),
+                    stage_timings=timer.timings
+                )
+                
+                # Update session
+                message.session.updated_at = timezone.now()
+                message.session.save()
+            timer.observe()
             
-            # Log analytics (simplified for now)
-            # Note: ChatAnalytics model needs to be updated to match these fields
-            # ChatAnalytics.objects.create(
-            #     session=message.session,
-            #     user_message=message.content,
-            #     bot_response=ai_message.content,
-            #     response_time=response_time,
-            #     confidence_score=ai_response.get('confidence', 0.8),
-            #     sources_count=len(ai_response.get('sources', []))
-            # )
+            # Usage analytics are rolled up from the messages (see analytics.py)
             
             # Return response
             response_data = ChatResponseSerializer({
@@ -232,6 +264,279 @@ class ChatMessageCreateView(generics.CreateAPIView):
                 'error': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class ChatMessageStreamView(ChatMessageCreateView):
+    """
+    Send a new message to the chatbot and stream the answer as Server-Sent Events.
+    
+    Emits a ``message`` event with the stored user message, one ``token`` event
+    per generated chunk and a final ``done`` event carrying the same fields as
+    ChatMessageCreateView's response. The assistant message is saved once the
+    stream completes, with the time to the first token recorded next to the
+    total processing time.
+    """
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+    
+    def create(self, request, *args, **kwargs):
+        timer = StageTimer('stream')
+        serializer = self.get_serializer(data=request.data)
+        with timer.stage('session'):
+            serializer.is_valid(raise_exception=True)
+            message = serializer.save()
+        
+        response = StreamingHttpResponse(
+            self.stream_events(message, timer),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    def stream_events(self, message, timer=None):
+        timer = timer or StageTimer('stream')
+        start_time = time.time()
+        first_token_time = None
+        yield sse_event('message', {'message_id': message.id, 'session_id': message.session.id})
+        
+        try:
+            rag_service = RAGService()
+            chatbot_service = ChatbotService()
+            with timer.stage('faq'):
+                faq_response = answer_from_faq(message.content)
+            if faq_response is not None:
+                events = [{'type': 'token', 'content': faq_response['response']}, {'type': 'done', **faq_response}]
+            else:
+                with timer.stage('retrieval'):
+                    context = rag_service.get_relevant_context(message.content)
+                with timer.stage('history'):
+                    history = message.session.get_conversation_history()
+                events = chatbot_service.stream_response(message.content, context, history, timer=timer)
+            
+            ai_response = {}
+            for event in events:
+                if event['type'] == 'token':
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                    yield sse_event('token', {'content': event['content']})
+                else:
+                    ai_response = event
+            
+            response_time = time.time() - start_time
+            time_to_first_token_ms = int((first_token_time - start_time) * 1000) if first_token_time else None
+            
+            with timer.stage('persistence'):
+                ai_message = ChatMessage.objects.create(
+                    session=message.session,
+                    content=ai_response['response'],
+                    message_type='assistant',
+                    processing_time_ms=int(response_time * 1000),
+                    time_to_first_token_ms=time_to_first_token_ms,
+                    confidence_score=ai_response.get('confidence', 0.8),
+                    retrieved_context=ai_response.get('sources', []),
+                    model_used=ai_response.get('model_used'),
+                    prompt_tokens=ai_response.get('prompt_tokens'),
+                    stage_timings=timer.timings
+                )
+                
+                message.session.updated_at = timezone.now()
+                message.session.save()
+            timer.observe()
+            
+            response_data = ChatResponseSerializer({
+                'message_id': ai_message.id,
+                'response': ai_message.content,
+                'confidence_score': ai_message.confidence_score,
+                'sources': ai_response.get('sources', []),
+                'response_time': response_time,
+                'suggestions': ai_response.get('suggestions', [])
+            }).data
+            response_data['session_id'] = message.session.id
+            response_data['time_to_first_token_ms'] = time_to_first_token_ms
+            yield sse_event('done', response_data)
+            
+        except Exception as e:
+            logger.exception("Streaming chat response failed")
+            error_message = ChatMessage.objects.create(
+                session=message.session,
+                content="I'm sorry, I'm having trouble processing your request right now. Please try again later.",
+                message_type='assistant',
+                processing_time_ms=0,
+                confidence_score=0.0
+            )
+            yield sse_event('error', {
+                'message_id': error_message.id,
+                'response': error_message.content,
+                'error': str(e)
+            })
+
+@sync_to_async
+def _authenticate_jwt(request):
+    result = JWTAuthentication().authenticate(request)
+    return result[0] if result else None
+
+@sync_to_async
+def _create_user_message(request, data):
+    serializer = ChatMessageCreateSerializer(data=data, context={'request': request})
+    if not serializer.is_valid():
+        return None, serializer.errors
+    return serializer.save(), None
+
+async def chat_message_async(request):
+    """
+    Async variant of ChatMessageCreateView for ASGI deployments.
+    
+    Retrieval runs in a thread and the LLM call is awaited on the event loop,
+    so a chat waiting on the model does not hold a worker thread. Accepts and
+    returns the same payloads as ChatMessageCreateView.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    
+    # DRF views are sync-only, so authenticate the JWT by hand
+    try:
+        user = await _authenticate_jwt(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': e.detail}, status=401)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    request.user = user
+    
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'detail': 'JSON parse error.'}, status=400)
+    timer = StageTimer('async')
+    with timer.stage('session'):
+        message, errors = await _create_user_message(request, data)
+    if errors:
+        return JsonResponse(errors, status=400)
+    
+    try:
+        start_time = time.time()
+        rag_service = RAGService()
+        chatbot_service = ChatbotService()
+        
+        with timer.stage('faq'):
+            ai_response = await sync_to_async(answer_from_faq)(message.content)
+        if ai_response is None:
+            with timer.stage('retrieval'):
+                context = await sync_to_async(rag_service.get_relevant_context)(message.content)
+            with timer.stage('history'):
+                history = await message.session.aget_conversation_history()
+            ai_response = await chatbot_service.agenerate_response(message.content, context, history, timer=timer)
+        
+        response_time = time.time() - start_time
+        
+        with timer.stage('persistence'):
+            ai_message = await ChatMessage.objects.acreate(
+                session=message.session,
+                content=ai_response['response'],
+                message_type='assistant',
+                processing_time_ms=int(response_time * 1000),
+                confidence_score=ai_response.get('confidence', 0.8),
+                retrieved_context=ai_response.get('sources', []),
+                model_used=ai_response.get('model_used'),
+                prompt_tokens=ai_response.get('prompt_tokens'),
+                stage_timings=timer.timings
+            )
+            
+            await message.session.asave(update_fields=['updated_at'])
+        timer.observe()
+        
+        response_data = ChatResponseSerializer({
+            'message_id': ai_message.id,
+            'response': ai_message.content,
+            'confidence_score': ai_message.confidence_score,
+            'sources': ai_response.get('sources', []),
+            'response_time': response_time,
+            'suggestions': ai_response.get('suggestions', [])
+        }).data
+        response_data['session_id'] = message.session.id
+        
+        return JsonResponse(response_data, status=201)
+        
+    except Exception as e:
+        logger.exception("Async chat response failed")
+        error_message = await ChatMessage.objects.acreate(
+            session=message.session,
+            content="I'm sorry, I'm having trouble processing your request right now. Please try again later.",
+            message_type='assistant',
+            processing_time_ms=0,
+            confidence_score=0.0
+        )
+        
+        return JsonResponse({
+            'message_id': error_message.id,
+            'response': error_message.content,
+            'confidence_score': 0,
+            'sources': [],
+            'response_time': 0,
+            'error': str(e)
+        }, status=500)
+
+# Authenticated by JWT only, so CSRF does not apply; Django 4.2's
+# csrf_exempt decorator would hide that the view is async
+chat_message_async.csrf_exempt = True
+
+class ChatMessageQueuedView(ChatMessageCreateView):
+    """
+    Send a message and have the answer generated by a Celery worker.
+    
+    Returns 202 straight away with the id of a pending assistant message;
+    the client polls its status URL until it is complete or failed.
+    """
+    
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        with transaction.atomic():
+            message = serializer.save()
+            reply = ChatMessage.objects.create(
+                session=message.session,
+                content='',
+                message_type='assistant',
+                status='pending'
+            )
+            # The worker must see both rows, so enqueue once they are committed
+            transaction.on_commit(lambda: self._enqueue(message.id, reply.id))
+        
+        response_data = ChatMessageStatusSerializer(reply).data
+        response_data['session_id'] = message.session.id
+        response_data['status_url'] = request.build_absolute_uri(
+            reverse('chatbot:chat-message-status', args=[reply.id])
+        )
+        return Response(response_data, status=status.HTTP_202_ACCEPTED)
+    
+    @staticmethod
+    def _enqueue(message_id, reply_id):
+        try:
+            generate_chat_response.delay(message_id, reply_id)
+        except Exception as e:
+            # Don't generate in the web worker instead; the client sees the
+            # reply fail when it polls and can send the message again
+            logger.warning("Could not queue chat response %s: %s", reply_id, e)
+            ChatMessage.objects.filter(id=reply_id, status='pending').update(
+                content=ERROR_RESPONSE,
+                status='failed',
+                confidence_score=0.0,
+                processing_time_ms=0
+            )
+
+class ChatMessageStatusView(generics.RetrieveAPIView):
+    """Poll a queued assistant reply"""
+    serializer_class = ChatMessageStatusSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return ChatMessage.objects.filter(session__user=self.request.user, message_type='assistant')
+    
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        if response.data['status'] == 'pending':
+            response['Retry-After'] = '1'
+        return response
+
 # Chat Feedback Views
 class ChatFeedbackListCreateView(generics.ListCreateAPIView):
     """List or create chat feedback"""
@@ -287,16 +592,22 @@ def quick_chat(request):
     
     try:
         start_time = time.time()
+        timer = StageTimer('quick')
         rag_service = RAGService()
         chatbot_service = ChatbotService()
         
-        # Get relevant context
-        context = rag_service.get_relevant_context(message)
-        
-        # Generate response
-        ai_response = chatbot_service.generate_response(message, context)
+        with timer.stage('faq'):
+            ai_response = answer_from_faq(message)
+        if ai_response is None:
+            # Get relevant context
+            with timer.stage('retrieval'):
+                context = rag_service.get_relevant_context(message)
+            
+            # Generate response
+            ai_response = chatbot_service.generate_response(message, context, timer=timer)
         
         response_time = time.time() - start_time
+        timer.observe()
         
         return Response({
             'response': ai_response['response'],
@@ -351,7 +662,9 @@ def search_knowledge_base(request):
                 query=serializer.validated_data['query'],
                 content_type=serializer.validated_data.get('content_type'),
                 source_type=serializer.validated_data.get('source_type'),
-                limit=serializer.validated_data.get('limit', 10)
+                limit=serializer.validated_data.get('limit', 10),
+                language=serializer.validated_data.get('language'),
+                province_id=serializer.validated_data.get('province_id')
             )
             
             return Response({
@@ -405,42 +718,21 @@ def chat_history(request):
 @permission_classes([IsAdminUser])
 def chat_statistics(request):
     """Get chat statistics for admin dashboard"""
-    today = timezone.now().date()
-    week_ago = today - timedelta(days=7)
-    
-    stats = {
-        'total_sessions': ChatSession.objects.count(),
-        'total_messages': ChatMessage.objects.count(),
-        'active_sessions_today': ChatSession.objects.filter(
-            updated_at__date=today
-        ).count(),
-        'average_session_length': ChatMessage.objects.values('session').annotate(
-            message_count=Count('id')
-        ).aggregate(avg_length=Avg('message_count'))['avg_length'] or 0,
-        'average_response_time': ChatMessage.objects.filter(
-            processing_time_ms__isnull=False
-        ).aggregate(avg_time=Avg('processing_time_ms'))['avg_time'] or 0,
-        'user_satisfaction': ChatFeedback.objects.filter(
-            feedback_type__in=['helpful', 'excellent']
-        ).count() / max(ChatFeedback.objects.count(), 1) * 100,
-        'popular_topics': {
-            'places': ChatAnalytics.objects.filter(date__gte=week_ago).first().top_places_mentioned if ChatAnalytics.objects.filter(date__gte=week_ago).exists() else {},
-            'provinces': ChatAnalytics.objects.filter(date__gte=week_ago).first().top_provinces_mentioned if ChatAnalytics.objects.filter(date__gte=week_ago).exists() else {}
-        },
-        'daily_message_count': dict(
-            ChatMessage.objects.filter(
-                created_at__date__gte=week_ago
-            ).extra(
-                select={'day': 'date(created_at)'}
-            ).values('day').annotate(
-                count=Count('id')
-            ).values_list('day', 'count')
-        )
-    }
+    # Read from the daily ChatAnalytics rollups rather than the message tables
+    stats = analytics.chat_statistics()
     
     serializer = ChatStatsSerializer(stats)
     return Response(serializer.data)
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def generation_statistics(request):
+    """Get LLM queue and circuit breaker metrics for this worker process"""
+    return Response({
+        **generation_scheduler.metrics(),
+        'circuit_breakers': circuit_breakers.metrics()
+    })
+
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def knowledge_base_statistics(request):
@@ -471,7 +763,7 @@ def knowledge_base_statistics(request):
 # Admin Views
 class AdminChatSessionListView(generics.ListAPIView):
     """Admin view for all chat sessions"""
-    queryset = ChatSession.objects.all().select_related('user').order_by('-updated_at')
+    queryset = ChatSession.objects.all().select_related('user').with_message_stats().order_by('-updated_at')
     serializer_class = ChatSessionAdminSerializer
     permission_classes = [IsAdminUser]
     pagination_class = ChatPagination
@@ -493,32 +785,82 @@ def bulk_knowledge_base_operations(request):
         
         queryset = KnowledgeBase.objects.filter(id__in=document_ids)
         
+        # queryset.update() skips auto_now and signals, so bump updated_at for
+        # other workers and patch this process's search index directly
         if action == 'activate':
-            updated_count = queryset.update(is_active=True)
+            updated_count = queryset.update(is_active=True, updated_at=timezone.now())
+            shared_knowledge_index.apply_changes(
+                upserts=list(queryset.values(*KnowledgeIndex.DOCUMENT_FIELDS))
+            )
             message = f'{updated_count} documents activated'
         elif action == 'deactivate':
-            updated_count = queryset.update(is_active=False)
+            updated_count = queryset.update(is_active=False, updated_at=timezone.now())
+            shared_knowledge_index.apply_changes(removed_ids=document_ids)
             message = f'{updated_count} documents deactivated'
         elif action == 'delete':
+            # Deleted rows are dropped from the index by the post_delete signal
             updated_count = queryset.count()
             queryset.delete()
             message = f'{updated_count} documents deleted'
         
+        if action in ('activate', 'deactivate'):
+            # Re-check the dense index now rather than after the check interval,
+            # and drop cached answers that may quote entries that just changed
+            shared_dense_index.invalidate()
+            response_cache.invalidate()
+        
         return Response({'message': message}, status=status.HTTP_200_OK)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def ingest_knowledge_base(request):
+    """Ingest documents as deduplicated, overlapping knowledge base chunks"""
+    serializer = KnowledgeIngestSerializer(data=request.data)
+    if serializer.is_valid():
+        data = serializer.validated_data
+        options = {key: data[key] for key in ('chunk_tokens', 'overlap_tokens') if key in data}
+        report = ingest_documents(
+            data['documents'],
+            replace=data['replace'],
+            created_by=request.user,
+            **options
+        )
+        return Response(report._asdict(), status=status.HTTP_201_CREATED)
+    
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
 @api_view(['POST'])
 @permission_classes([IsAdminUser])
 def export_chat_data(request):
     """Export chat data for analysis"""
     serializer = ChatExportSerializer(data=request.data)
     if serializer.is_valid():
-        # Implementation for data export would go here
-        # This is a placeholder for the actual export functionality
-        return Response({
-            'message': 'Export functionality not yet implemented',
-            'requested_format': serializer.validated_data.get('format', 'json')
-        })
+        data = serializer.validated_data
+        export_format = data['format']
+        queryset = exporters.export_queryset(
+            session_ids=data.get('session_ids'),
+            start_date=data.get('start_date'),
+            end_date=data.get('end_date'),
+            include_feedback=data['include_feedback']
+        )
+        
+        # Rows are read through a cursor and written out as they arrive, so
+        # memory use does not grow with the size of the export
+        chunk_size = exporters.EXPORT_CHUNK_SIZE
+        writer = exporters.STREAM_WRITERS[export_format]
+        content_type, extension = exporters.EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            writer(
+                queryset.iterator(chunk_size=chunk_size),
+                exporters.export_columns(data['include_feedback']),
+                chunk_size
+            ),
+            content_type=content_type
+        )
+        filename = f"chat-export-{timezone.now().strftime('%Y%m%d-%H%M%S')}.{extension}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,18 @@
+#!/bin/sh
+set -e
+
+# Prometheus multiprocess metrics: each process type (web, celery, beat) gets
+# its own directory, emptied on every start so counters and histograms from a
+# previous run or another process type aren't merged into this one's
+if [ -n "$PROMETHEUS_MULTIPROC_ROOT" ]; then
+    case " $* " in
+        *" beat "*) process_type=beat ;;
+        *celery*) process_type=celery ;;
+        *) process_type=web ;;
+    esac
+    export PROMETHEUS_MULTIPROC_DIR="$PROMETHEUS_MULTIPROC_ROOT/${PROMETHEUS_PROCESS_TYPE:-$process_type}"
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+exec "$@"
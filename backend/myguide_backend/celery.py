@@ -0,0 +1,15 @@
+"""Celery application for myguide_backend.
+
+Workers are started with `celery -A myguide_backend worker`, which picks up
+this module. Settings prefixed with CELERY_ in settings.py configure it.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myguide_backend.settings')
+
+app = Celery('myguide_backend')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -12,7 +12,7 @@ Developed & maintained by Slimene Fellah — Available for freelance work at sli
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 from datetime import timedelta
 import dj_database_url
 
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     'corsheaders',
     'django_extensions',
     'drf_spectacular',
+    'django_prometheus',
     
     # Local apps
     'authentication',
@@ -216,6 +217,27 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # Static files production
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Knowledge base search index artifact (see `manage.py build_knowledge_index`)
+RAG_INDEX_DIR = config('RAG_INDEX_DIR', default=str(BASE_DIR / 'knowledge_index'))
+
+# Celery (background chat generation, see chatbot/tasks.py)
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default='redis://localhost:6379/0')
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+# Run tasks inline in the web process, for development without a worker
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=False, cast=bool)
+CELERY_BEAT_SCHEDULE = {
+    'rollup-chat-analytics': {
+        'task': 'chatbot.tasks.rollup_chat_analytics',
+        'schedule': config('CHAT_ANALYTICS_ROLLUP_INTERVAL', default=300.0, cast=float),
+    },
+}
+
+# Clients allowed to read /metrics besides staff users: the Prometheus scraper's
+# addresses or networks, e.g. the monitoring network's subnet
+METRICS_ALLOWED_NETWORKS = config('METRICS_ALLOWED_NETWORKS', default='127.0.0.1/32,::1/128', cast=Csv())
+
 # Custom User Model
 AUTH_USER_MODEL = 'authentication.User'
 
@@ -15,11 +15,14 @@ Including another URLconf
 
 Developed & maintained by Slimene Fellah — Available for freelance work at slimenefellah.dev
 """
+import ipaddress
+
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from django.http import JsonResponse
+from django.http import HttpResponseForbidden, JsonResponse
+from django_prometheus.exports import ExportToDjangoView
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
 def api_root(request):
@@ -38,6 +41,20 @@ def api_root(request):
         }
     })
 
+METRICS_ALLOWED_NETWORKS = [ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_NETWORKS]
+
+def metrics(request):
+    """Prometheus metrics, for staff and the scraper's networks only"""
+    # REMOTE_ADDR rather than X-Forwarded-For, which clients can set
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        address = None
+    allowed = address is not None and any(address in network for network in METRICS_ALLOWED_NETWORKS)
+    if not allowed and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return ExportToDjangoView(request)
+
 urlpatterns = [
     path('', api_root, name='api-root'),
     path('admin/', admin.site.urls),
@@ -51,6 +68,9 @@ urlpatterns = [
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    
+    # Prometheus metrics, scraped by monitoring/prometheus.yml
+    path('metrics', metrics, name='prometheus-django-metrics'),
 ]
 
 # Serve media files during development